@@ -34,4 +34,4 @@ scheduler.init_app(app)
 
 
 
-from app import routes, models
\ No newline at end of file
+from app import routes, models, commands
\ No newline at end of file
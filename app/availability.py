@@ -0,0 +1,194 @@
+'''Facility capacity checks backed by per-day occupancy counters'''
+
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from sqlalchemy import select, update, delete, insert, and_, func
+from sqlalchemy.dialects import postgresql, sqlite
+from app import db
+from app.models import Booking, Facility, FacilityOccupancy, CacheVersion
+from app.fragments import bump_versions
+
+
+# facility_occupancy holds the number of dogs booked at each facility on
+# each day. A booking holds its dogs on every day from check-in up to the
+# day before check-out (or just the check-in day for same-day daycare)
+# from the moment it is created, until it is cancelled or declined.
+# Reserving is one conditional UPDATE over the booking's days inside a
+# savepoint: the UPDATE only counts days that still have room, so two
+# concurrent requests can't both take the last place, and a booking that
+# doesn't fit on every day changes nothing. Facilities without a capacity
+# are unlimited but still counted. Every change bumps the facility's
+# occupancy:<id> version counter, which the availability endpoint uses as
+# its ETag.
+
+RELEASED_STATUSES = ('cancelled', 'declined')
+
+
+class FacilityFullError(Exception):
+    '''Raised when a booking doesn't fit in the facility's capacity'''
+
+    def __init__(self, days):
+        super().__init__('No room left on ' + ', '.join(day.strftime('%B %d, %Y') for day in days))
+        self.days = days
+
+
+def holds_capacity(status):
+    '''Return True if a booking with this status takes up places'''
+    return status not in RELEASED_STATUSES
+
+
+def _day(value):
+    return value.date() if isinstance(value, datetime) else value
+
+
+def booking_days(check_in, check_out):
+    '''Return the days a booking takes up places'''
+    first = _day(check_in)
+    last = max(_day(check_out) - timedelta(days=1), first)
+    return [first + timedelta(days=offset) for offset in range((last - first).days + 1)]
+
+
+def occupancy_version_name(facility_id):
+    '''Return the name of a facility's occupancy version counter'''
+    return f'occupancy:{facility_id}'
+
+
+def _create_days(connection, facility_id, days):
+    '''Insert the missing occupancy rows with no dogs'''
+    rows = [{'facility_id': facility_id, 'day': day, 'dogs': 0} for day in days]
+    dialect = {'sqlite': sqlite, 'postgresql': postgresql}.get(connection.dialect.name)
+    if dialect is not None:
+        connection.execute(dialect.insert(FacilityOccupancy).on_conflict_do_nothing(), rows)
+        return
+    existing = set(connection.execute(
+        select(FacilityOccupancy.day).where(FacilityOccupancy.facility_id == facility_id,
+                                            FacilityOccupancy.day.between(days[0], days[-1]))
+    ).scalars())
+    missing = [row for row in rows if row['day'] not in existing]
+    if missing:
+        connection.execute(insert(FacilityOccupancy), missing)
+
+
+def _in_range(facility_id, days):
+    return and_(FacilityOccupancy.facility_id == facility_id, FacilityOccupancy.day.between(days[0], days[-1]))
+
+
+def full_days(facility, dogs_by_day):
+    '''Return the days on which the extra dogs would exceed the capacity'''
+    if facility.capacity is None:
+        return []
+    booked = db.session.execute(
+        select(FacilityOccupancy.day, FacilityOccupancy.dogs)
+        .where(FacilityOccupancy.facility_id == facility.id, FacilityOccupancy.day.in_(sorted(dogs_by_day)))
+    ).all()
+    return sorted(day for day, dogs in booked if dogs + dogs_by_day[day] > facility.capacity)
+
+
+def reserve(facility, check_in, check_out, dogs):
+    '''Take dogs places on every day of a stay, or raise FacilityFullError'''
+    dogs = int(dogs or 1)
+    reserve_days(facility, {day: dogs for day in booking_days(check_in, check_out)})
+
+
+def reserve_days(facility, dogs_by_day):
+    '''Take places on many days at once, or raise FacilityFullError taking none
+
+    dogs_by_day maps each day to the number of places to take on it, e.g.
+    the sum over a series of bookings. Days needing the same number of
+    places are reserved by one UPDATE.
+    '''
+    days = sorted(dogs_by_day)
+    _create_days(db.session.connection(), facility.id, days)
+    days_by_dogs = defaultdict(list)
+    for day in days:
+        days_by_dogs[dogs_by_day[day]].append(day)
+    savepoint = db.session.begin_nested()
+    updated = 0
+    for dogs, group in days_by_dogs.items():
+        condition = and_(FacilityOccupancy.facility_id == facility.id, FacilityOccupancy.day.in_(group))
+        if facility.capacity is not None:
+            condition = and_(condition, FacilityOccupancy.dogs + dogs <= facility.capacity)
+        updated += db.session.execute(
+            update(FacilityOccupancy).where(condition).values(dogs=FacilityOccupancy.dogs + dogs),
+            execution_options={'synchronize_session': False}
+        ).rowcount
+    if updated != len(days):
+        savepoint.rollback()
+        raise FacilityFullError(full_days(facility, dogs_by_day))
+    savepoint.commit()
+    bump_versions(db.session.connection(), [occupancy_version_name(facility.id)])
+
+
+def release(booking):
+    '''Give back the places taken by a booking'''
+    days = booking_days(booking.check_in, booking.check_out)
+    db.session.execute(
+        update(FacilityOccupancy).where(_in_range(booking.facility_id, days))
+        .values(dogs=FacilityOccupancy.dogs - int(booking.number_of_dogs or 1)),
+        execution_options={'synchronize_session': False}
+    )
+    bump_versions(db.session.connection(), [occupancy_version_name(booking.facility_id)])
+
+
+def change_status(booking, status):
+    '''Set a booking's status, taking or giving back its places as needed
+
+    Raises FacilityFullError, leaving the booking unchanged, when a released
+    booking is taken back but no longer fits.
+    '''
+    if holds_capacity(status) and not holds_capacity(booking.status):
+        reserve(booking.facility, booking.check_in, booking.check_out, booking.number_of_dogs)
+    elif holds_capacity(booking.status) and not holds_capacity(status):
+        release(booking)
+    booking.status = status
+
+
+def occupancy_rows(bookings):
+    '''Return the occupancy rows for (facility id, check in, check out, dogs) rows'''
+    occupancy = Counter()
+    for facility_id, check_in, check_out, dogs in bookings:
+        for day in booking_days(check_in, check_out):
+            occupancy[facility_id, day] += int(dogs or 1)
+    return [{'facility_id': facility_id, 'day': day, 'dogs': dogs} for (facility_id, day), dogs in occupancy.items()]
+
+
+def rebuild_occupancy():
+    '''Recompute every occupancy counter from the bookings'''
+    rows = db.session.execute(
+        select(Booking.facility_id, Booking.check_in, Booking.check_out, Booking.number_of_dogs)
+        .where(Booking.status.notin_(RELEASED_STATUSES), Booking.facility_id.isnot(None),
+               Booking.check_in.isnot(None), Booking.check_out.isnot(None))
+    ).all()
+    db.session.execute(delete(FacilityOccupancy))
+    values = occupancy_rows(rows)
+    if values:
+        db.session.execute(insert(FacilityOccupancy), values)
+    facility_ids = db.session.execute(select(Facility.id)).scalars()
+    bump_versions(db.session.connection(), [occupancy_version_name(facility_id) for facility_id in facility_ids])
+    return len(values)
+
+
+def availability_state(facility_id):
+    '''Return the capacity and occupancy version of a facility, or None if it doesn't exist
+
+    This is all the availability endpoint reads to answer a conditional GET.
+    '''
+    version = (select(CacheVersion.version)
+               .where(CacheVersion.name == occupancy_version_name(facility_id)).scalar_subquery())
+    return db.session.execute(
+        select(Facility.capacity, func.coalesce(version, 0)).where(Facility.id == facility_id)
+    ).first()
+
+
+def remaining_places(facility_id, capacity, first, last):
+    '''Return (day, dogs booked, places left) from first to last
+
+    Places left is None for facilities without a capacity.
+    '''
+    booked = dict(db.session.execute(
+        select(FacilityOccupancy.day, FacilityOccupancy.dogs)
+        .where(FacilityOccupancy.facility_id == facility_id, FacilityOccupancy.day.between(first, last))
+    ).all())
+    days = [first + timedelta(days=offset) for offset in range((last - first).days + 1)]
+    return [(day, booked.get(day, 0), None if capacity is None else max(capacity - booked.get(day, 0), 0))
+            for day in days]
@@ -0,0 +1,64 @@
+'''In-process caches shared by the application'''
+
+import time
+import threading
+from collections import OrderedDict
+
+
+# A small thread-safe cache with a time-to-live and LRU eviction
+# Each gunicorn worker keeps its own copy, so only cache values that
+# may be slightly stale or are invalidated by the worker that changes them.
+
+class TTLCache:
+    '''Least recently used cache whose entries expire after ttl seconds'''
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        '''Return the cached value or default if missing or expired'''
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            value, expires_at = item
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        '''Store a value, evicting the least recently used entry if full'''
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def get_or_set(self, key, factory, ttl=None):
+        '''Return the cached value, computing and storing it if missing'''
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing:
+            value = factory()
+            self.set(key, value, ttl)
+        return value
+
+    def delete(self, key):
+        '''Remove a key from the cache'''
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        '''Remove every entry from the cache'''
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
@@ -0,0 +1,95 @@
+'''Flask CLI commands for maintenance tasks'''
+
+import click
+from datetime import datetime
+from sqlalchemy import select, update, func
+from app import app, db
+from app.models import Facility, Review, OutboxMessage
+from app.outbox import drain_outbox
+from app.routes import update_bookings
+from app.availability import rebuild_occupancy
+from app.gazetteer import build_gazetteer
+
+
+# Rebuild the facility rating counters from the reviews table
+# The counters are normally maintained incrementally, see models.py
+# Usage: flask rebuild-ratings
+
+@app.cli.command('rebuild-ratings')
+def rebuild_ratings():
+    '''Recompute review_count, rating_sum and avg_rating for every facility'''
+    counted = (Review.facility_id == Facility.id) & Review.deleted.isnot(True) & Review.rating.isnot(None)
+    review_count = select(func.count(Review.id)).where(counted).scalar_subquery()
+    rating_sum = select(func.coalesce(func.sum(Review.rating), 0)).where(counted).scalar_subquery()
+    avg_rating = select(func.coalesce(func.avg(Review.rating), 0)).where(counted).scalar_subquery()
+
+    result = db.session.execute(
+        update(Facility).values(review_count=review_count,
+                                rating_sum=rating_sum,
+                                avg_rating=avg_rating)
+    )
+    db.session.commit()
+    click.echo(f'Rebuilt ratings for {result.rowcount} facilities.')
+
+
+# Apply the due booking transitions now. --full rescans every booking
+# instead of only those that checked in or out since the last run
+# Usage: flask update-bookings [--full]
+
+@app.cli.command('update-bookings')
+@click.option('--full', is_flag=True, help='Rescan every booking instead of starting from the watermark.')
+def update_bookings_command(full):
+    '''Apply the booking status transitions that are due'''
+    click.echo(f'Updated {update_bookings(full=full)} bookings.')
+
+
+# Rebuild the per-day facility occupancy from the bookings
+# The counters are normally maintained as bookings change, see availability.py
+# Usage: flask rebuild-occupancy
+
+@app.cli.command('rebuild-occupancy')
+def rebuild_occupancy_command():
+    '''Recompute the dogs booked per facility per day'''
+    count = rebuild_occupancy()
+    db.session.commit()
+    click.echo(f'Rebuilt occupancy for {count} facility days.')
+
+
+# Build the offline gazetteer index at GAZETTEER_PATH from a GeoNames
+# postal code dump and, optionally, countryInfo.txt for country names
+# Usage: flask build-gazetteer allCountries.txt [--countries countryInfo.txt]
+
+@app.cli.command('build-gazetteer')
+@click.argument('postal_codes', type=click.Path(exists=True, dir_okay=False))
+@click.option('--countries', type=click.Path(exists=True, dir_okay=False), help='GeoNames countryInfo.txt file.')
+def build_gazetteer_command(postal_codes, countries):
+    '''Build the offline gazetteer index from GeoNames dumps'''
+    if not app.config.get('GAZETTEER_PATH'):
+        raise click.UsageError('Set GAZETTEER_PATH to the index file to build.')
+    count = build_gazetteer(app.config['GAZETTEER_PATH'], postal_codes, countries)
+    click.echo(f'Indexed {count} postal codes in {app.config["GAZETTEER_PATH"]}.')
+
+
+# Send the queued emails now, e.g. when the scheduler is not running
+# Usage: flask drain-outbox
+
+@app.cli.command('drain-outbox')
+def drain_outbox_command():
+    '''Deliver every due message in the email outbox'''
+    totals = drain_outbox()
+    click.echo(f"Sent {totals['sent']} emails, {totals['failed']} failed.")
+
+
+# Give dead outbox messages another round of attempts, e.g. after fixing
+# the mail settings
+# Usage: flask requeue-dead-mail
+
+@app.cli.command('requeue-dead-mail')
+def requeue_dead_mail():
+    '''Move dead outbox messages back to pending'''
+    result = db.session.execute(
+        update(OutboxMessage).where(OutboxMessage.status == 'dead')
+        .values(status='pending', attempts=0, next_attempt_at=datetime.now())
+    )
+    db.session.commit()
+    click.echo(f'Requeued {result.rowcount} emails.')
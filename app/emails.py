@@ -0,0 +1,102 @@
+'''Email notifications rendered from Jinja templates'''
+
+import os
+from jinja2 import Environment, FileSystemLoader, StrictUndefined
+from app import app
+
+
+# Notification emails live in templates/email/. Each one defines a
+# subject(booking) and a body(recipient_name, booking) macro, sharing the
+# pieces in layout.html. They use their own environment with every value
+# autoescaped, since most of them come from user input. The templates are
+# compiled and their modules built once at import, so rendering is just
+# two macro calls with no per-message template context.
+# booking is a dict from booking_context(), row_context() or series_context().
+
+EMAIL_TEMPLATE_FOLDER = os.path.join(app.root_path, 'templates', 'email')
+EMAIL_TEMPLATES = (
+    'booking_created_owner', 'booking_created_facility',
+    'booking_cancelled_owner', 'booking_cancelled_facility',
+    'booking_accepted_owner', 'booking_accepted_facility',
+    'booking_declined_owner',
+    'booking_completed_owner', 'booking_completed_facility',
+    'booking_series_owner', 'booking_series_facility',
+)
+
+
+def format_date(value):
+    '''Format a date the way the emails show it, e.g. March 04, 2025'''
+    return value.strftime('%B %d, %Y') if value else ''
+
+
+environment = Environment(loader=FileSystemLoader(EMAIL_TEMPLATE_FOLDER), autoescape=True, auto_reload=False,
+                          trim_blocks=True, lstrip_blocks=True, undefined=StrictUndefined)
+environment.filters['date'] = format_date
+templates = {name: environment.get_template(f'{name}.html').module for name in EMAIL_TEMPLATES}
+
+
+def services_requested(daycare, boarding):
+    '''Return the services of a booking as shown in the emails'''
+    return ', '.join(service for service, requested in (('Daycare', daycare), ('Boarding', boarding)) if requested)
+
+
+def booking_context(booking):
+    '''Return the email context of a booking'''
+    return {
+        'booking_code': booking.booking_code,
+        'check_in': booking.check_in,
+        'check_out': booking.check_out,
+        'number_of_dogs': booking.number_of_dogs,
+        'notes': booking.notes,
+        'services': services_requested(booking.daycare, booking.boarding),
+        'facility_name': booking.facility.name,
+        'facility_location': booking.facility.location,
+        'client_first_name': booking.user.first_name,
+        'client_last_name': booking.user.last_name,
+        'client_email': booking.user.email,
+        'client_phone_number': booking.user.phone_number,
+    }
+
+
+def series_context(facility, user, bookings, number_of_dogs, notes, daycare, boarding):
+    '''Return the email context of a series of bookings made together
+
+    bookings are (booking code, check in, check out) rows, listed in one
+    summary email instead of one email each.
+    '''
+    return {
+        'bookings': [{'booking_code': code, 'check_in': check_in, 'check_out': check_out}
+                     for code, check_in, check_out in bookings],
+        'number_of_dogs': number_of_dogs,
+        'notes': notes,
+        'services': services_requested(daycare, boarding),
+        'facility_name': facility.name,
+        'facility_location': facility.location,
+        'client_first_name': user.first_name,
+        'client_last_name': user.last_name,
+        'client_email': user.email,
+        'client_phone_number': user.phone_number,
+    }
+
+
+def row_context(row):
+    '''Return the email context of a row selected with the booking_context() names
+
+    Batch runs select just these columns instead of loading every booking,
+    user and facility.
+    '''
+    context = row._asdict()
+    context['services'] = services_requested(context.pop('daycare'), context.pop('boarding'))
+    return context
+
+
+def render_email(name, recipient_name, booking):
+    '''Render an email, returning its subject and html'''
+    template = templates[name]
+    return template.subject(booking).unescape(), str(template.body(recipient_name, booking))
+
+
+def render_emails(name, messages):
+    '''Render the same email for many (recipient name, booking) pairs, e.g. in a batch run'''
+    subject, body = templates[name].subject, templates[name].body
+    return [(subject(booking).unescape(), str(body(recipient_name, booking))) for recipient_name, booking in messages]
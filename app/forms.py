@@ -7,8 +7,8 @@ from app.models import User, Facility
 from flask_login import current_user
 from flask_wtf import FlaskForm
 from flask_wtf.file import FileField, FileAllowed
-from wtforms import StringField, PasswordField, BooleanField, SubmitField, SelectMultipleField, SelectField, DateField, TextAreaField
-from wtforms.validators import DataRequired, Email, EqualTo, ValidationError, Length, AnyOf
+from wtforms import StringField, PasswordField, BooleanField, SubmitField, SelectMultipleField, SelectField, DateField, TextAreaField, IntegerField
+from wtforms.validators import DataRequired, Email, EqualTo, ValidationError, Length, AnyOf, Optional, NumberRange
 
 
 #--------------------LOGIN FORMS--------------------
@@ -296,7 +296,9 @@ class UpdateFacilityProfileForm(FlaskForm):
 
 class SearchFacilityForm(FlaskForm):
     '''Search facility form'''
-    location = StringField('Location', validators=[DataRequired()])
+    # The query is kept whole in the search cache key, see routes.py
+    location = StringField('Location', validators=[DataRequired(), Length(max=100)])
+    radius = IntegerField('Within (km)', validators=[Optional(), NumberRange(min=1, max=500)])
     daycare = BooleanField('Daycare')
     boarding = BooleanField('Boarding')
     submit = SubmitField('Search')
@@ -0,0 +1,134 @@
+'''Cached page fragments invalidated by version counters'''
+
+import functools
+from flask import render_template
+from markupsafe import Markup
+from sqlalchemy import event, inspect, select, update, insert, literal, cast, or_
+from sqlalchemy.dialects import postgresql, sqlite
+from app import app, db
+from app.cache import TTLCache
+from app.models import User, Dog, Facility, Booking, Review, CacheVersion
+
+
+# The rendered content of a page is cached per process under a key that
+# includes the version counters of everything it shows. The mapper events
+# below bump the counters in the same transaction as the change, so every
+# worker stops using the old fragment as soon as the change is committed.
+# Updates only bump them when an attribute the pages show has changed.
+#   user:<id>      the user, their dogs, facilities and bookings
+#   facility:<id>  the facility, its bookings and reviews
+
+fragment_cache = TTLCache(maxsize=app.config['DASHBOARD_CACHE_SIZE'], ttl=app.config['DASHBOARD_CACHE_TTL'])
+
+
+def bump_versions(connection, names):
+    '''Increment the version counters, creating missing ones'''
+    names = sorted(set(names))
+    if not names:
+        return
+    dialect = {'sqlite': sqlite, 'postgresql': postgresql}.get(connection.dialect.name)
+    if dialect is not None:
+        statement = dialect.insert(CacheVersion).values(version=1)
+        connection.execute(statement.on_conflict_do_update(
+            index_elements=['name'], set_={'version': CacheVersion.version + 1}
+        ), [{'name': name} for name in names])
+        return
+    for name in names:
+        updated = connection.execute(
+            update(CacheVersion).where(CacheVersion.name == name)
+            .values(version=CacheVersion.version + 1)
+        ).rowcount
+        if not updated:
+            connection.execute(insert(CacheVersion).values(name=name, version=1))
+
+
+def _previous(target, name):
+    '''Return the value of an attribute before the change being flushed'''
+    history = inspect(target).attrs[name].history
+    return history.deleted[0] if history.deleted else getattr(target, name)
+
+
+def _listen(model, attributes, names):
+    '''Bump the counters named by names(connection, target, previous) when a model row changes
+
+    Inserts and deletes always bump them, updates only when one of the
+    attributes shown on the cached pages changed. previous(name) is the
+    value before the update, so a row moved e.g. to another facility bumps
+    the counters of both.
+    '''
+    def bump(connection, target):
+        previous = functools.partial(_previous, target)
+        bump_versions(connection, [name for name in names(connection, target, previous)
+                                   if not name.endswith(':None')])
+
+    def changed(mapper, connection, target):
+        bump(connection, target)
+
+    def updated(mapper, connection, target):
+        state = inspect(target)
+        if any(state.attrs[name].history.has_changes() for name in attributes):
+            bump(connection, target)
+
+    # propagate reaches the DogOwner and FacilityOwner subclasses of User
+    event.listen(model, 'after_insert', changed, propagate=True)
+    event.listen(model, 'after_delete', changed, propagate=True)
+    event.listen(model, 'after_update', updated, propagate=True)
+
+
+def _user_names(connection, user, previous):
+    # Facility owners see the first names of the users booking with them
+    facility_ids = connection.execute(
+        select(Booking.facility_id).where(Booking.issued_by == user.id).distinct()).scalars()
+    return [f'user:{user.id}'] + [f'facility:{facility_id}' for facility_id in facility_ids]
+
+
+def _facility_names(connection, facility, previous):
+    # Users see the names of the facilities they booked
+    user_ids = connection.execute(
+        select(Booking.issued_by).where(Booking.facility_id == facility.id).distinct()).scalars()
+    return ([f'user:{facility.owner_id}', f'user:{previous("owner_id")}', f'facility:{facility.id}'] +
+            [f'user:{user_id}' for user_id in user_ids])
+
+
+_listen(User, ('first_name',), _user_names)
+_listen(Dog, ('owner_id',), lambda connection, dog, previous: [f'user:{dog.owner_id}', f'user:{previous("owner_id")}'])
+_listen(Facility, ('name', 'owner_id', 'completed_bookings'), _facility_names)
+_listen(Booking, ('booking_code', 'status', 'check_in', 'check_out', 'issued_by', 'facility_id'),
+        lambda connection, booking, previous: [
+            f'user:{booking.issued_by}', f'user:{previous("issued_by")}',
+            f'facility:{booking.facility_id}', f'facility:{previous("facility_id")}'])
+_listen(Review, ('response', 'facility_id'),
+        lambda connection, review, previous: [f'facility:{review.facility_id}', f'facility:{previous("facility_id")}'])
+
+
+def get_versions(user):
+    '''Return the counters of a user and of the facilities they own'''
+    facility_names = select(literal('facility:') + cast(Facility.id, db.String)).where(Facility.owner_id == user.id)
+    rows = db.session.execute(
+        select(CacheVersion.name, CacheVersion.version)
+        .where(or_(CacheVersion.name == f'user:{user.id}', CacheVersion.name.in_(facility_names)))
+        .order_by(CacheVersion.name)
+    ).all()
+    return tuple((name, version) for name, version in rows)
+
+
+def render_block(template_name, block, **context):
+    '''Render one block of a template with the usual template context'''
+    template = app.jinja_env.get_template(template_name)
+    app.update_template_context(context)
+    return Markup(''.join(template.blocks[block](template.new_context(context))))
+
+
+def render_cached(template_name, key, build_context):
+    '''Render a page whose content block is cached under key
+
+    build_context() returns the template variables and is only called on a
+    miss. The rest of the page, e.g. the flashed messages, is rendered on
+    every request.
+    '''
+    key = (template_name,) + tuple(key)
+    content = fragment_cache.get(key)
+    if content is None:
+        content = render_block(template_name, 'content', **build_context())
+        fragment_cache.set(key, content)
+    return render_template('partials/content.html', content=content)
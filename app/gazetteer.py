@@ -0,0 +1,189 @@
+'''Offline gazetteer for city and postal code lookups'''
+
+import csv
+import os
+import sqlite3
+import threading
+from pathlib import Path
+
+
+# Built from a GeoNames postal code dump (e.g. allCountries.txt or ZA.txt
+# from https://download.geonames.org/export/zip/) by `flask build-gazetteer`.
+# Each row of the dump is:
+#   country code, postal code, place name, admin names and codes...,
+#   latitude, longitude, accuracy
+# The index is a read-only SQLite file rather than dicts in memory, so the
+# gunicorn workers share it through the OS page cache instead of each
+# holding a copy of every postal code (several hundred MB for allCountries).
+
+COUNTRY_CODE, POSTAL_CODE, PLACE_NAME, LATITUDE, LONGITUDE = 0, 1, 2, 9, 10
+
+SCHEMA = '''
+CREATE TABLE postal_code (
+    id INTEGER PRIMARY KEY,
+    country TEXT NOT NULL,
+    postal TEXT NOT NULL,
+    place TEXT NOT NULL,
+    latitude REAL NOT NULL,
+    longitude REAL NOT NULL
+);
+CREATE TABLE country (name TEXT PRIMARY KEY, code TEXT NOT NULL);
+'''
+
+# Built after loading, which is much faster than updating them per row.
+# Within equal keys index entries are ordered by id, so "ORDER BY id LIMIT 1"
+# is a single index seek.
+INDEXES = '''
+CREATE INDEX ix_postal_code_country_postal ON postal_code (country, postal);
+CREATE INDEX ix_postal_code_postal_place ON postal_code (postal, place);
+CREATE INDEX ix_postal_code_place_country ON postal_code (place, country);
+'''
+
+
+def _normalize(text):
+    '''Lower case and collapse whitespace'''
+    return ' '.join(text.lower().split())
+
+
+def _postal_code_rows(path):
+    '''Yield the (country, postal, place, latitude, longitude) rows of a GeoNames dump'''
+    with open(path, encoding='utf-8', newline='') as dump:
+        for row in csv.reader(dump, delimiter='\t', quoting=csv.QUOTE_NONE):
+            if len(row) <= LONGITUDE:
+                continue
+            try:
+                latitude, longitude = float(row[LATITUDE]), float(row[LONGITUDE])
+            except ValueError:
+                continue
+            yield (row[COUNTRY_CODE].upper(), _normalize(row[POSTAL_CODE]), _normalize(row[PLACE_NAME]),
+                   latitude, longitude)
+
+
+def _country_rows(path):
+    '''Yield the (name, code) rows of a GeoNames countryInfo.txt file'''
+    with open(path, encoding='utf-8', newline='') as info:
+        for row in csv.reader(info, delimiter='\t', quoting=csv.QUOTE_NONE):
+            if not row or row[0].startswith('#') or len(row) < 5:
+                continue
+            yield _normalize(row[4]), row[0].upper()
+
+
+def build_gazetteer(index_path, postal_codes_path, countries_path=None):
+    '''Build the gazetteer index file from GeoNames dumps, returning the number of postal codes
+
+    The file is written next to index_path and moved into place when
+    complete, so running workers never see a half-built index.
+    '''
+    partial_path = f'{index_path}.partial'
+    if os.path.exists(partial_path):
+        os.remove(partial_path)
+    connection = sqlite3.connect(partial_path)
+    try:
+        connection.executescript(SCHEMA)
+        connection.executemany('INSERT INTO postal_code (country, postal, place, latitude, longitude) '
+                               'VALUES (?, ?, ?, ?, ?)', _postal_code_rows(postal_codes_path))
+        if countries_path:
+            connection.executemany('INSERT OR REPLACE INTO country (name, code) VALUES (?, ?)',
+                                   _country_rows(countries_path))
+        connection.executescript(INDEXES)
+        connection.commit()
+        count = connection.execute('SELECT count(*) FROM postal_code').fetchone()[0]
+    finally:
+        connection.close()
+    os.replace(partial_path, index_path)
+    return count
+
+
+class Gazetteer:
+    '''Read-only index of postal codes and place names'''
+
+    def __init__(self, path):
+        self.uri = Path(path).resolve().as_uri() + '?mode=ro'
+        # sqlite3 connections can't be shared between threads
+        self._local = threading.local()
+
+    @property
+    def connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = sqlite3.connect(self.uri, uri=True)
+        return connection
+
+    def __len__(self):
+        return self.connection.execute('SELECT count(*) FROM postal_code').fetchone()[0]
+
+    def _first(self, where, *parameters):
+        '''Return the coordinates of the first postal code matching where, or None'''
+        # The first entry wins, later duplicates are usually sub-areas
+        return self.connection.execute(
+            f'SELECT latitude, longitude FROM postal_code WHERE {where} ORDER BY id LIMIT 1',
+            parameters).fetchone()
+
+    def country_code(self, name):
+        '''Return the ISO code for a known country name or code, or None'''
+        name = _normalize(name)
+        if self._first('country = ?', name.upper()):
+            return name.upper()
+        row = self.connection.execute('SELECT code FROM country WHERE name = ? OR code = ?',
+                                      (name, name.upper())).fetchone()
+        return row[0] if row else None
+
+    def lookup(self, address):
+        '''Return (latitude, longitude) for an address, or None on a miss
+
+        The address is split on commas, e.g. "street, city, postal code, country".
+        Postal codes are tried before place names as they are more precise.
+        '''
+        parts = [_normalize(part) for part in address.split(',') if part.strip()]
+        if not parts:
+            return None
+        country = self.country_code(parts[-1]) if len(parts) > 1 else None
+
+        if country:
+            for part in parts:
+                coordinates = self._first('country = ? AND postal = ?', country, part)
+                if coordinates:
+                    return coordinates
+        for postal in parts:
+            if not any(char.isdigit() for char in postal):
+                continue
+            for place in parts:
+                coordinates = self._first('postal = ? AND place = ?', postal, place)
+                if coordinates:
+                    return coordinates
+        for part in parts:
+            if country:
+                coordinates = self._first('place = ? AND country = ?', part, country)
+            else:
+                coordinates = self._first('place = ?', part)
+            if coordinates:
+                return coordinates
+        return None
+
+
+# The gazetteer is opened once per process, on first use
+
+_gazetteer = None
+_loaded = False
+_lock = threading.Lock()
+
+
+def get_gazetteer(config):
+    '''Return the gazetteer whose index file is GAZETTEER_PATH, or None'''
+    global _gazetteer, _loaded
+    if _loaded:
+        return _gazetteer
+    with _lock:
+        if not _loaded:
+            if config.get('GAZETTEER_PATH'):
+                _gazetteer = Gazetteer(config['GAZETTEER_PATH'])
+            _loaded = True
+    return _gazetteer
+
+
+def reset_gazetteer():
+    '''Forget the opened gazetteer so it is reopened from the config'''
+    global _gazetteer, _loaded
+    with _lock:
+        _gazetteer = None
+        _loaded = False
@@ -0,0 +1,150 @@
+'''Geospatial helpers: the facility geohash index and batch distances'''
+
+import math
+import numpy as np
+from geopy.distance import geodesic
+
+
+# Geohash base32 alphabet and the precision stored on each facility.
+# A precision of 8 gives cells of roughly 38m x 19m.
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_PRECISION = 8
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+# The spherical distances are within 0.6% of the WGS-84 geodesic, e.g. a
+# degree of latitude is 110.57 km at the equator, not 111.195 km
+HAVERSINE_MARGIN = 1.006
+
+
+def encode_geohash(latitude, longitude, precision=GEOHASH_PRECISION):
+    '''Encode a latitude/longitude pair as a geohash string'''
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    geohash = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(geohash) < precision:
+        if even:
+            mid = (lon_range[0] + lon_range[1]) / 2
+            if longitude >= mid:
+                bits = (bits << 1) | 1
+                lon_range[0] = mid
+            else:
+                bits = bits << 1
+                lon_range[1] = mid
+        else:
+            mid = (lat_range[0] + lat_range[1]) / 2
+            if latitude >= mid:
+                bits = (bits << 1) | 1
+                lat_range[0] = mid
+            else:
+                bits = bits << 1
+                lat_range[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            geohash.append(BASE32[bits])
+            bits = 0
+            bit_count = 0
+    return ''.join(geohash)
+
+
+def cell_size(precision):
+    '''Return the (height, width) of a geohash cell in degrees'''
+    total_bits = 5 * precision
+    lon_bits = (total_bits + 1) // 2
+    lat_bits = total_bits // 2
+    return 180.0 / (2 ** lat_bits), 360.0 / (2 ** lon_bits)
+
+
+def neighbour_cells(latitude, longitude, precision):
+    '''Return the cell containing the point and its eight neighbours'''
+    height, width = cell_size(precision)
+    cells = set()
+    for dlat in (-height, 0, height):
+        lat = min(max(latitude + dlat, -90.0), 90.0)
+        for dlon in (-width, 0, width):
+            lon = (longitude + dlon + 180.0) % 360.0 - 180.0
+            cells.add(encode_geohash(lat, lon, precision))
+    return cells
+
+
+def covered_radius(latitude, precision):
+    '''Return the distance in km that is fully covered by the neighbour cells.
+
+    Any point closer than this to (latitude, longitude) is guaranteed to
+    fall inside one of the cells returned by neighbour_cells().
+    '''
+    height, width = cell_size(precision)
+    worst_latitude = min(abs(latitude) + height, 90.0)
+    height_km = height * KM_PER_DEGREE
+    width_km = width * KM_PER_DEGREE * math.cos(math.radians(worst_latitude))
+    return min(height_km, width_km)
+
+
+def prefix_upper_bound(prefix):
+    '''Return the smallest string greater than every geohash with this prefix'''
+    # '~' sorts after every character of the base32 alphabet, so
+    # geohash >= prefix AND geohash < prefix + '~' is an index range scan.
+    return prefix + '~'
+
+
+def bounding_box(latitude, longitude, radius_km):
+    '''Return (min_lat, max_lat, lon_ranges) enclosing a circle around a point
+
+    lon_ranges is a list of (min_lon, max_lon) pairs, split in two when the
+    box crosses the antimeridian. The box is padded by HAVERSINE_MARGIN, so
+    it also encloses every point within radius_km along the geodesic.
+    '''
+    radius_km *= HAVERSINE_MARGIN
+    dlat = radius_km / KM_PER_DEGREE
+    min_lat = max(latitude - dlat, -90.0)
+    max_lat = min(latitude + dlat, 90.0)
+
+    # Near a pole the circle covers every longitude
+    widest = max(abs(min_lat), abs(max_lat))
+    if widest >= 90.0 or radius_km >= EARTH_RADIUS_KM * math.pi / 2:
+        return min_lat, max_lat, [(-180.0, 180.0)]
+    dlon = radius_km / (KM_PER_DEGREE * math.cos(math.radians(widest)))
+    if dlon >= 180.0:
+        return min_lat, max_lat, [(-180.0, 180.0)]
+
+    min_lon = longitude - dlon
+    max_lon = longitude + dlon
+    if min_lon < -180.0:
+        return min_lat, max_lat, [(min_lon + 360.0, 180.0), (-180.0, max_lon)]
+    if max_lon > 180.0:
+        return min_lat, max_lat, [(min_lon, 180.0), (-180.0, max_lon - 360.0)]
+    return min_lat, max_lat, [(min_lon, max_lon)]
+
+
+# Batch distance engine
+# Computes the distance from one point to many facilities in one pass.
+# The haversine formula is used for ranking; the exact geodesic is only
+# worth its cost for the handful of distances that are displayed.
+
+def haversine_distances(latitude, longitude, latitudes, longitudes):
+    '''Return the great-circle distances in km as a NumPy array'''
+    lat1 = math.radians(latitude)
+    lon1 = math.radians(longitude)
+    lat2 = np.radians(np.asarray(latitudes, dtype=np.float64))
+    lon2 = np.radians(np.asarray(longitudes, dtype=np.float64))
+
+    a = (np.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def batch_distances(latitude, longitude, latitudes, longitudes, exact=False):
+    '''Return the distances in km from a point to arrays of coordinates
+
+    With exact=True the WGS-84 geodesic is computed for each pair instead,
+    which is much slower and meant for the final displayed page only.
+    '''
+    if not exact:
+        return haversine_distances(latitude, longitude, latitudes, longitudes)
+    origin = (latitude, longitude)
+    return np.array([geodesic(origin, (lat, lon)).kilometers
+                     for lat, lon in zip(latitudes, longitudes)], dtype=np.float64)
@@ -0,0 +1,326 @@
+'''Geocoding of addresses with a persistent cache'''
+
+import re
+import time
+import random
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from datetime import datetime, timedelta
+from urllib.parse import quote
+from sqlalchemy import select, insert, update
+from sqlalchemy.exc import IntegrityError
+from app import app, db, metrics
+from app.cache import TTLCache
+from app.gazetteer import get_gazetteer
+from app.models import GeocodeCache
+
+
+class GeocodingError(Exception):
+    '''Raised when the geocoding provider cannot be reached or fails'''
+
+
+class CircuitOpenError(GeocodingError):
+    '''Raised without calling the provider while the circuit breaker is open'''
+
+
+# --------------------HTTP CLIENT--------------------
+
+# A stuck provider must not pin a gunicorn worker, so every request has
+# connect/read timeouts, a few retries with jittered backoff, and a circuit
+# breaker that fails fast after repeated failures.
+
+class CircuitBreaker:
+    '''Stops calling a failing provider for a while
+
+    After threshold consecutive failed calls the breaker opens and calls fail
+    fast. Once reset_timeout seconds have passed a single trial call is let
+    through: success closes the breaker again, failure re-opens it.
+    '''
+
+    def __init__(self, threshold=5, reset_timeout=30, clock=time.monotonic):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def _set_state(self, state):
+        self.state = state
+        metrics.set_gauge('geocoding.circuit_state', state)
+
+    def allow(self):
+        '''Return True if a call may be made now'''
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and self.clock() - self.opened_at >= self.reset_timeout:
+                self._set_state('half_open')
+                return True
+            return False
+
+    def record_success(self):
+        '''Close the breaker after a successful call'''
+        with self._lock:
+            self.failures = 0
+            if self.state != 'closed':
+                self._set_state('closed')
+
+    def record_failure(self):
+        '''Count a failed call, opening the breaker if needed'''
+        with self._lock:
+            self.failures += 1
+            if self.state == 'half_open' or self.failures >= self.threshold:
+                self.opened_at = self.clock()
+                self._set_state('open')
+
+
+class GeocodingClient:
+    '''Pooled HTTP client shared by the geocoding backends'''
+
+    def __init__(self, connect_timeout=3.05, read_timeout=5, retries=2, backoff=0.2,
+                 breaker=None, pool_size=10):
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = breaker or CircuitBreaker()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def get_json(self, url, provider):
+        '''GET a URL and return the decoded JSON body'''
+        if not self.breaker.allow():
+            metrics.increment('geocoding.circuit_rejected')
+            raise CircuitOpenError(f'{provider} circuit breaker is open')
+
+        error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                # Exponential backoff with full jitter between retries
+                time.sleep(random.uniform(0, self.backoff * 2 ** (attempt - 1)))
+            start = time.perf_counter()
+            try:
+                response = self.session.get(url, timeout=self.timeout)
+                if response.status_code == 200:
+                    data = response.json()
+                    self.breaker.record_success()
+                    return data
+                error = f'status {response.status_code}'
+                if response.status_code < 500 and response.status_code != 429:
+                    # The provider is up but rejected the request, retrying won't help
+                    self.breaker.record_success()
+                    raise GeocodingError(f'{provider} returned {error}')
+            except (requests.RequestException, ValueError) as exception:
+                error = str(exception)
+            finally:
+                metrics.observe('geocoding.upstream_latency', time.perf_counter() - start)
+            metrics.increment('geocoding.upstream_error')
+
+        self.breaker.record_failure()
+        raise GeocodingError(f'{provider} request failed: {error}')
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_http_client():
+    '''Return the shared client, created from the GEOCODER_* settings'''
+    global _client
+    with _client_lock:
+        if _client is None:
+            config = app.config
+            _client = GeocodingClient(
+                connect_timeout=config['GEOCODER_CONNECT_TIMEOUT'],
+                read_timeout=config['GEOCODER_READ_TIMEOUT'],
+                retries=config['GEOCODER_RETRIES'],
+                backoff=config['GEOCODER_BACKOFF'],
+                breaker=CircuitBreaker(threshold=config['GEOCODER_BREAKER_THRESHOLD'],
+                                       reset_timeout=config['GEOCODER_BREAKER_RESET']))
+        return _client
+
+
+def reset_http_client():
+    '''Discard the shared client so it is rebuilt from the config'''
+    global _client
+    with _client_lock:
+        _client = None
+
+
+# --------------------BACKENDS--------------------
+
+# Each backend has a lookup(address) method returning (latitude, longitude),
+# None when the address has no results, or raising GeocodingError.
+
+class GoMapsGeocoder:
+    '''GoMaps geocoding API backend'''
+    url = 'https://maps.gomaps.pro/maps/api/geocode/json?address={address}&key={key}&limit=1'
+
+    def lookup(self, address):
+        '''Look up the coordinates of an address'''
+        geocode_url = self.url.format(address=quote(address), key=app.config['GO_MAPS_API_KEY'])
+        data = get_http_client().get_json(geocode_url, 'GoMaps')
+        if not data.get('results'):
+            return None
+        location = data['results'][0]['geometry']['location']
+        return location['lat'], location['lng']
+
+
+class OpenWeatherMapGeocoder:
+    '''OpenWeatherMap direct geocoding API backend'''
+    url = 'http://api.openweathermap.org/geo/1.0/direct?q={address}&limit=1&appid={key}'
+
+    def lookup(self, address):
+        '''Look up the coordinates of an address'''
+        geocode_url = self.url.format(address=quote(address), key=app.config['OWM_API_KEY'])
+        data = get_http_client().get_json(geocode_url, 'OpenWeatherMap')
+        if not data:
+            return None
+        return data[0]['lat'], data[0]['lon']
+
+
+class StubGeocoder:
+    '''Local geocoder for tests, answers only addresses added to it'''
+
+    def __init__(self):
+        self.addresses = {}
+        self.calls = 0
+
+    def add(self, address, latitude, longitude):
+        '''Register the coordinates of an address'''
+        self.addresses[normalize_address(address)] = (latitude, longitude)
+
+    def lookup(self, address):
+        '''Look up the coordinates of an address'''
+        self.calls += 1
+        return self.addresses.get(normalize_address(address))
+
+
+stub_geocoder = StubGeocoder()
+
+BACKENDS = {
+    'gomaps': GoMapsGeocoder,
+    'owm': OpenWeatherMapGeocoder,
+    'stub': lambda: stub_geocoder,
+}
+
+
+def get_geocoder():
+    '''Return the backend selected by the GEOCODER_BACKEND setting'''
+    return BACKENDS[app.config['GEOCODER_BACKEND']]()
+
+
+# --------------------CACHE--------------------
+
+# Results are cached in the geocode_cache table, keyed by the normalized
+# address, and in a small per-process cache in front of it. Addresses with
+# no results are cached too, for a shorter time. When an offline gazetteer
+# is configured it is asked before the table and the provider.
+
+_memory_cache = TTLCache(maxsize=4096, ttl=300)
+_NO_RESULTS = ()
+
+
+def normalize_address(address):
+    '''Normalize an address so equivalent spellings share a cache entry'''
+    parts = [re.sub(r'\s+', ' ', part).strip() for part in address.lower().split(',')]
+    return ', '.join(part for part in parts if part)
+
+
+def _read_cache(key, now, allow_expired=False):
+    '''Return the cached coordinates, _NO_RESULTS, or None on a miss'''
+    with db.engine.begin() as connection:
+        row = connection.execute(
+            select(GeocodeCache.latitude, GeocodeCache.longitude, GeocodeCache.expires_at)
+            .where(GeocodeCache.address == key)
+        ).first()
+        if row is None or (row.expires_at <= now and not allow_expired):
+            return None
+        connection.execute(
+            update(GeocodeCache)
+            .where(GeocodeCache.address == key)
+            .values(hits=GeocodeCache.hits + 1)
+        )
+    if row.latitude is None:
+        return _NO_RESULTS
+    return row.latitude, row.longitude
+
+
+def _write_cache(key, coordinates, now):
+    '''Store a geocoding result, replacing any expired entry'''
+    if coordinates:
+        latitude, longitude = coordinates
+        expires_at = now + timedelta(seconds=app.config['GEOCODE_CACHE_TTL'])
+    else:
+        latitude = longitude = None
+        expires_at = now + timedelta(seconds=app.config['GEOCODE_NEGATIVE_TTL'])
+    values = dict(latitude=latitude, longitude=longitude, created_at=now, expires_at=expires_at)
+
+    # Runs in its own transaction so the result is kept even if the request
+    # that asked for it is rolled back.
+    with db.engine.begin() as connection:
+        updated = connection.execute(
+            update(GeocodeCache).where(GeocodeCache.address == key).values(**values)
+        ).rowcount
+    if updated:
+        return
+    try:
+        with db.engine.begin() as connection:
+            connection.execute(insert(GeocodeCache).values(address=key, hits=0, **values))
+    except IntegrityError:
+        # Another worker cached the same address first
+        pass
+
+
+def geocode(address, approximate=False):
+    '''Return (latitude, longitude) for an address, or None if not found
+
+    If the provider fails, an expired cache entry is served instead when there
+    is one; otherwise GeocodingError is raised.
+
+    With approximate set, e.g. for search queries, the offline gazetteer may
+    answer with the centroid of a postal code or place. Addresses that are
+    saved, such as a facility's street address, always go to the provider.
+    '''
+    key = normalize_address(address)
+    cached = _memory_cache.get(key)
+    if cached is not None:
+        metrics.increment('geocode_cache.hit')
+        return cached or None
+
+    gazetteer = get_gazetteer(app.config) if approximate else None
+    if gazetteer is not None:
+        # Not kept in the memory cache, which also serves exact lookups
+        coordinates = gazetteer.lookup(address)
+        if coordinates:
+            metrics.increment('gazetteer.hit')
+            return coordinates
+        metrics.increment('gazetteer.miss')
+
+    cached = _read_cache(key, datetime.now())
+    if cached is not None:
+        metrics.increment('geocode_cache.hit')
+        _memory_cache.set(key, cached)
+        return cached or None
+
+    metrics.increment('geocode_cache.miss')
+    try:
+        coordinates = get_geocoder().lookup(address)
+    except GeocodingError:
+        stale = _read_cache(key, datetime.now(), allow_expired=True)
+        if stale is None:
+            raise
+        metrics.increment('geocode_cache.stale')
+        return stale or None
+    _write_cache(key, coordinates, datetime.now())
+    _memory_cache.set(key, coordinates or _NO_RESULTS)
+    return coordinates
+
+
+def clear_memory_cache():
+    '''Forget the per-process cache, used by the tests'''
+    _memory_cache.clear()
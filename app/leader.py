@@ -0,0 +1,142 @@
+'''Database lease electing one process to run the scheduled jobs'''
+
+import os
+import socket
+import functools
+from uuid import uuid4
+from datetime import datetime, timedelta
+from sqlalchemy import select, update, insert, or_, case
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from app import app, db, metrics
+from app.models import SchedulerLease
+
+
+# Every gunicorn worker starts the scheduler (see start_scheduler() in
+# routes.py), so the jobs would run once per worker. Instead each process
+# runs a heartbeat job that tries to take or renew the lease row, and the
+# leader_only jobs only run in the process holding it. A leader that dies stops renewing and the
+# lease is taken over after SCHEDULER_LEASE_TTL seconds; one that shuts
+# down cleanly releases it straight away.
+
+class LeaderLease:
+    '''Lease row held by at most one process at a time
+
+    on_elected and on_deposed are called when this process gains or loses
+    the lease. When disabled the process always counts as the leader.
+    '''
+
+    def __init__(self, name='scheduler', ttl=None, on_elected=None, on_deposed=None, enabled=True):
+        self.name = name
+        self.ttl = timedelta(seconds=ttl or app.config['SCHEDULER_LEASE_TTL'])
+        self.holder = f'{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:8]}'
+        self.on_elected = on_elected
+        self.on_deposed = on_deposed
+        self.enabled = enabled
+        self.term = None
+        self.valid_until = None
+        self.leading = False
+
+    def is_leader(self, now=None):
+        '''Return True while this process holds an unexpired lease'''
+        if not self.enabled:
+            return True
+        return self.valid_until is not None and (now or datetime.now()) < self.valid_until
+
+    def _renew(self, connection, now):
+        '''Renew the lease, or take it over if expired, returning its term'''
+        held = SchedulerLease.holder == self.holder
+        result = connection.execute(
+            update(SchedulerLease)
+            .where(SchedulerLease.name == self.name, or_(held, SchedulerLease.expires_at <= now))
+            .values(holder=self.holder, renewed_at=now, expires_at=now + self.ttl,
+                    term=case((held, SchedulerLease.term), else_=SchedulerLease.term + 1),
+                    acquired_at=case((held, SchedulerLease.acquired_at), else_=now))
+        )
+        if not result.rowcount:
+            return None
+        return connection.execute(select(SchedulerLease.term).where(SchedulerLease.name == self.name)).scalar()
+
+    def try_acquire(self, now=None):
+        '''Take or renew the lease, returning True if this process holds it'''
+        now = now or datetime.now()
+        try:
+            with db.engine.begin() as connection:
+                term = self._renew(connection, now)
+                if term is None and connection.execute(
+                    select(SchedulerLease.name).where(SchedulerLease.name == self.name)
+                ).first() is None:
+                    connection.execute(insert(SchedulerLease).values(
+                        name=self.name, holder=self.holder, term=1,
+                        acquired_at=now, renewed_at=now, expires_at=now + self.ttl))
+                    term = 1
+        except IntegrityError:
+            # Another process created the lease first
+            term = None
+        if term is None:
+            self.valid_until = None
+        else:
+            # Local deadline measured from before the UPDATE, so it never
+            # outlasts the lease stored in the database
+            self.term, self.valid_until = term, now + self.ttl
+        return term is not None
+
+    def release(self):
+        '''Give up the lease so another process can take over at once'''
+        if not self.enabled or self.valid_until is None:
+            return
+        try:
+            with app.app_context(), db.engine.begin() as connection:
+                connection.execute(
+                    update(SchedulerLease)
+                    .where(SchedulerLease.name == self.name, SchedulerLease.holder == self.holder)
+                    .values(expires_at=datetime.now())
+                )
+        except SQLAlchemyError as error:
+            # The lease then simply expires. This also runs at exit, when the
+            # database may not even have the table, e.g. before migrations.
+            app.logger.warning('Could not release scheduler lease: %s', error.__class__.__name__)
+        self.valid_until = None
+        self.leading = False
+        self._report()
+
+    def heartbeat(self):
+        '''Scheduler job renewing the lease and reporting leadership changes'''
+        if not self.enabled:
+            return
+        was_leader = self.leading
+        try:
+            with app.app_context():
+                leader = self.try_acquire()
+        except Exception:
+            app.logger.exception('Scheduler lease heartbeat failed')
+            leader = self.is_leader()
+        self.leading = leader
+        if leader and not was_leader:
+            metrics.increment('scheduler.elected')
+            app.logger.info('Scheduler lease %s taken by %s (term %s)', self.name, self.holder, self.term)
+            if self.on_elected:
+                self.on_elected()
+        elif was_leader and not leader:
+            metrics.increment('scheduler.deposed')
+            app.logger.warning('Scheduler lease %s lost by %s', self.name, self.holder)
+            if self.on_deposed:
+                self.on_deposed()
+        self._report()
+
+    def _report(self):
+        metrics.set_gauge('scheduler.leader', int(self.is_leader()))
+        metrics.set_gauge('scheduler.lease', {
+            'holder': self.holder,
+            'term': self.term,
+            'valid_until': self.valid_until.isoformat() if self.valid_until else None,
+        })
+
+    def leader_only(self, func):
+        '''Wrap a job so it only runs in the leader process'''
+        @functools.wraps(func)
+        def job(*args, **kwargs):
+            if not self.is_leader():
+                metrics.increment('scheduler.skipped')
+                return None
+            return func(*args, **kwargs)
+        return job
@@ -0,0 +1,103 @@
+'''Batched email sending over reused SMTP connections'''
+
+import time
+import smtplib
+from app import app, mail, metrics
+
+
+# Opening an SMTP connection (and its TLS handshake and login) costs more
+# than sending a message, so bulk senders such as the outbox go through a
+# MailDispatcher: one connection is kept open for up to
+# MAIL_MAX_PER_CONNECTION messages and replaced when the server drops it.
+
+class DispatchStats:
+    '''Counts and timing of one dispatcher run'''
+
+    def __init__(self):
+        self.sent = 0
+        self.failed = 0
+        self.connections = 0
+        self.reconnects = 0
+        self.seconds = 0.0
+
+    @property
+    def throughput(self):
+        '''Messages sent per second'''
+        return self.sent / self.seconds if self.seconds else 0.0
+
+    def __repr__(self):
+        return ('<DispatchStats sent={} failed={} connections={} reconnects={} {:.1f} msg/s>'
+                .format(self.sent, self.failed, self.connections, self.reconnects, self.throughput))
+
+
+def _connection_lost(exception):
+    '''Return True if the error means the connection can't be used any more'''
+    if isinstance(exception, smtplib.SMTPResponseException):
+        return exception.smtp_code == 421
+    return isinstance(exception, (smtplib.SMTPServerDisconnected, OSError))
+
+
+class MailDispatcher:
+    '''Sends messages over a reused connection, reconnecting on failure'''
+
+    def __init__(self, max_per_connection=None, retries=1):
+        self.max_per_connection = max_per_connection or app.config['MAIL_MAX_PER_CONNECTION']
+        self.retries = retries
+        self.stats = DispatchStats()
+        self._connection = None
+        self._count = 0
+
+    def _connect(self):
+        self._connection = mail.connect().__enter__()
+        self._count = 0
+        self.stats.connections += 1
+        metrics.increment('mail.connections')
+
+    def _close(self):
+        connection, self._connection = self._connection, None
+        if connection is None or connection.host is None:
+            return
+        try:
+            connection.host.quit()
+        except (smtplib.SMTPException, OSError):
+            connection.host.close()
+
+    def _send(self, message):
+        for attempt in range(self.retries + 1):
+            if self._connection is None:
+                self._connect()
+            try:
+                self._connection.send(message)
+            except Exception as exception:
+                if not _connection_lost(exception) or attempt == self.retries:
+                    if _connection_lost(exception):
+                        self._close()
+                    raise
+                self._close()
+                self.stats.reconnects += 1
+                metrics.increment('mail.reconnects')
+                continue
+            self._count += 1
+            if self._count >= self.max_per_connection:
+                self._close()
+            return
+
+    def send_all(self, messages):
+        '''Send every message, returning None or the error for each one'''
+        errors = []
+        start = time.perf_counter()
+        with app.app_context():
+            try:
+                for message in messages:
+                    try:
+                        self._send(message)
+                    except Exception as exception:
+                        errors.append(f'{type(exception).__name__}: {exception}')
+                        self.stats.failed += 1
+                    else:
+                        errors.append(None)
+                        self.stats.sent += 1
+            finally:
+                self._close()
+        self.stats.seconds += time.perf_counter() - start
+        return errors
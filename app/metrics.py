@@ -0,0 +1,58 @@
+'''In-process application metrics'''
+
+import threading
+from collections import defaultdict
+
+
+# Metrics are kept per process and exposed as JSON on /metrics
+# See routes.py
+
+_lock = threading.Lock()
+_counters = defaultdict(int)
+_gauges = {}
+_timings = {}
+
+
+def increment(name, amount=1):
+    '''Increment a counter'''
+    with _lock:
+        _counters[name] += amount
+
+
+def get_counter(name):
+    '''Return the current value of a counter'''
+    with _lock:
+        return _counters.get(name, 0)
+
+
+def set_gauge(name, value):
+    '''Set a gauge to its current value'''
+    with _lock:
+        _gauges[name] = value
+
+
+def observe(name, seconds):
+    '''Record a duration, keeping the count, total and maximum'''
+    with _lock:
+        timing = _timings.setdefault(name, {'count': 0, 'total': 0.0, 'max': 0.0})
+        timing['count'] += 1
+        timing['total'] += seconds
+        timing['max'] = max(timing['max'], seconds)
+
+
+def snapshot():
+    '''Return a copy of every metric'''
+    with _lock:
+        timings = {
+            name: dict(timing, avg=timing['total'] / timing['count'])
+            for name, timing in _timings.items()
+        }
+        return {'counters': dict(_counters), 'gauges': dict(_gauges), 'timings': timings}
+
+
+def reset():
+    '''Reset every metric, used by the tests'''
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _timings.clear()
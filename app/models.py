@@ -1,7 +1,10 @@
 '''All models for the application are stored in this file'''
 
 from app import db, login
+from app.geo import encode_geohash
 from datetime import datetime
+from sqlalchemy import event, update, case, inspect
+from sqlalchemy.orm import mapped_column
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 
@@ -126,6 +129,7 @@ class Facility(db.Model):
     location = db.Column(db.String(64))
     latitude = db.Column(db.Float)
     longitude = db.Column(db.Float)
+    geohash = db.Column(db.String(12), index=True)
     daycare = db.Column(db.Boolean)
     boarding = db.Column(db.Boolean)
     amenities = db.Column(db.Text)
@@ -141,16 +145,39 @@ class Facility(db.Model):
     completed_bookings = db.Column(db.Integer, default=0)
     repeated_bookings = db.Column(db.Integer, default=0)
     repeated_customers = db.Column(db.Integer, default=0)
-    avg_rating = db.Column(db.Float, default=0)
+    avg_rating = db.Column(db.Float, default=0, nullable=False)
+    review_count = db.Column(db.Integer, default=0, nullable=False)
+    rating_sum = db.Column(db.Float, default=0, nullable=False)
     photos = db.relationship('FacilityPhoto', backref='facility', lazy='dynamic')
     owner_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     bookings = db.relationship('Booking', back_populates='facility')
     reviews = db.relationship('Review', backref='facility', lazy='dynamic')
 
+    # Supports keyset pagination of the facility listing by rating
+    # and the bounding box prefilter of the radius search
+    __table_args__ = (
+        db.Index('ix_facility_avg_rating_id', 'avg_rating', 'id'),
+        db.Index('ix_facility_latitude_longitude', 'latitude', 'longitude'),
+    )
+
     def __repr__(self):
         '''Define the string representation for the Facility model'''
         return '<Facility {}>'.format(self.name)
-    
+
+
+# Keep the facility geohash in sync with its coordinates
+# The geohash is used by the nearest facility lookup on the index page
+
+@event.listens_for(Facility, 'before_insert')
+@event.listens_for(Facility, 'before_update')
+def update_facility_geohash(mapper, connection, target):
+    '''Recompute the geohash from the facility coordinates'''
+    if target.latitude is None or target.longitude is None:
+        target.geohash = None
+    else:
+        target.geohash = encode_geohash(target.latitude, target.longitude)
+
+
 class FacilityPhoto(db.Model):
     '''Facility photo model'''
     id = db.Column(db.Integer, primary_key=True)
@@ -161,22 +188,90 @@ class FacilityPhoto(db.Model):
 class Review(db.Model):
     '''Facility review model'''
     id = db.Column(db.Integer, primary_key=True)
-    rating = db.Column(db.Float)
+    # active_history loads the previous value on change so the facility
+    # rating counters can be adjusted, see adjust_facility_rating()
+    rating = mapped_column(db.Float, active_history=True)
     comment = db.Column(db.Text)
     response = db.Column(db.Text)
     response_date = db.Column(db.DateTime)
-    deleted = db.Column(db.Boolean, default=False)
+    deleted = mapped_column(db.Boolean, default=False, active_history=True)
     created_at = db.Column(db.DateTime, default=db.func.current_timestamp())
     updated_at = db.Column(db.DateTime, default=db.func.current_timestamp(), onupdate=db.func.current_timestamp())
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
-    facility_id = db.Column(db.Integer, db.ForeignKey('facility.id'))
-    
-    
+    facility_id = mapped_column(db.Integer, db.ForeignKey('facility.id'), active_history=True)
+
+    def soft_delete(self):
+        '''Hide the review and remove its rating from the facility average'''
+        self.deleted = True
+
+
+# Keep the facility rating counters in sync with its reviews
+# The counters are adjusted with a single UPDATE in the same flush as the
+# review, so concurrent reviews never overwrite each other's totals.
+
+def adjust_facility_rating(connection, facility_id, count, total):
+    '''Add count reviews totalling total stars to the facility counters'''
+    if facility_id is None or not count:
+        return
+    new_count = Facility.review_count + count
+    new_sum = Facility.rating_sum + total
+    connection.execute(
+        update(Facility)
+        .where(Facility.id == facility_id)
+        .values(review_count=new_count,
+                rating_sum=new_sum,
+                avg_rating=case((new_count > 0, new_sum / new_count), else_=0))
+    )
+
+
+def counted_rating(rating, deleted):
+    '''Return the rating a review contributes, or None if it does not count'''
+    if deleted or rating is None:
+        return None
+    return rating
+
+
+@event.listens_for(Review, 'after_insert')
+def review_inserted(mapper, connection, target):
+    '''Count a new review'''
+    rating = counted_rating(target.rating, target.deleted)
+    if rating is not None:
+        adjust_facility_rating(connection, target.facility_id, 1, rating)
+
+
+@event.listens_for(Review, 'after_delete')
+def review_deleted(mapper, connection, target):
+    '''Uncount a deleted review'''
+    rating = counted_rating(target.rating, target.deleted)
+    if rating is not None:
+        adjust_facility_rating(connection, target.facility_id, -1, -rating)
+
+
+@event.listens_for(Review, 'after_update')
+def review_updated(mapper, connection, target):
+    '''Recount a review whose rating, facility or deleted flag changed'''
+    state = inspect(target)
+    changed = {name: state.attrs[name].history for name in ('rating', 'facility_id', 'deleted')}
+    if not any(history.has_changes() for history in changed.values()):
+        return
+
+    def previous(name):
+        history = changed[name]
+        return history.deleted[0] if history.deleted else getattr(target, name)
+
+    old_rating = counted_rating(previous('rating'), previous('deleted'))
+    if old_rating is not None:
+        adjust_facility_rating(connection, previous('facility_id'), -1, -old_rating)
+    new_rating = counted_rating(target.rating, target.deleted)
+    if new_rating is not None:
+        adjust_facility_rating(connection, target.facility_id, 1, new_rating)
+
+
 
 class Booking(db.Model):
     '''Booking model'''
     id = db.Column(db.Integer, primary_key=True)
-    booking_code = db.Column(db.String(64))
+    booking_code = db.Column(db.String(64), unique=True, index=True)
     check_in = db.Column(db.DateTime)
     check_out = db.Column(db.DateTime)
     status = db.Column(db.String(64), default='pending')
@@ -191,6 +286,17 @@ class Booking(db.Model):
     facility_id = db.Column(db.Integer, db.ForeignKey('facility.id'))
     facility = db.relationship('Facility', back_populates='bookings') 
 
+    # Support the dashboard queries and the history pages by user and by facility,
+    # and the status transitions looking for check-ins and check-outs in a time window
+    __table_args__ = (
+        db.Index('ix_booking_issued_by_status_check_in', 'issued_by', 'status', 'check_in'),
+        db.Index('ix_booking_facility_id_status_check_in', 'facility_id', 'status', 'check_in'),
+        db.Index('ix_booking_issued_by_check_out', 'issued_by', 'check_out'),
+        db.Index('ix_booking_facility_id_check_out', 'facility_id', 'check_out'),
+        db.Index('ix_booking_status_check_in', 'status', 'check_in'),
+        db.Index('ix_booking_status_check_out', 'status', 'check_out'),
+    )
+
 
     def update_status(self):
         '''Update the status to ongoing if the start date has arrived'''
@@ -199,4 +305,122 @@ class Booking(db.Model):
 
     def __repr__(self):
         '''Define the string representation for the Booking model'''
-        return '<Booking was created by {}>'.format(self.user.first_name)
\ No newline at end of file
+        return '<Booking was created by {}>'.format(self.user.first_name)
+
+# Geocoding results cached by normalized address
+# A row without coordinates records that the address had no results
+# See geocoding.py
+
+class GeocodeCache(db.Model):
+    '''Geocode cache model'''
+    __tablename__ = 'geocode_cache'
+
+    id = db.Column(db.Integer, primary_key=True)
+    address = db.Column(db.String(255), index=True, unique=True, nullable=False)
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+    hits = db.Column(db.Integer, default=0, nullable=False)
+    created_at = db.Column(db.DateTime, default=db.func.current_timestamp())
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        '''Define the string representation for the GeocodeCache model'''
+        return '<GeocodeCache {}>'.format(self.address)
+
+
+# Version counters for cached pages, e.g. 'user:1' or 'facility:2'
+# Bumped whenever the data behind a cached page changes, see fragments.py
+
+class CacheVersion(db.Model):
+    '''Cache version model'''
+    __tablename__ = 'cache_version'
+
+    name = db.Column(db.String(64), primary_key=True)
+    version = db.Column(db.Integer, default=0, nullable=False)
+
+    def __repr__(self):
+        '''Define the string representation for the CacheVersion model'''
+        return '<CacheVersion {} {}>'.format(self.name, self.version)
+
+
+# Emails waiting to be sent, written in the same transaction as the change
+# they announce and delivered by background workers, see outbox.py
+# status is one of pending, sending, sent or dead (gave up after retries)
+
+class OutboxMessage(db.Model):
+    '''Outbox message model'''
+    __tablename__ = 'outbox'
+
+    id = db.Column(db.Integer, primary_key=True)
+    sender = db.Column(db.String(120))
+    recipient = db.Column(db.String(120))
+    subject = db.Column(db.String(255), nullable=False)
+    html = db.Column(db.Text)
+    status = db.Column(db.String(16), default='pending', nullable=False)
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    last_error = db.Column(db.Text)
+    next_attempt_at = db.Column(db.DateTime, default=db.func.current_timestamp(), nullable=False)
+    claimed_by = db.Column(db.String(32))
+    claimed_at = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, default=db.func.current_timestamp())
+    sent_at = db.Column(db.DateTime)
+
+    # Workers look for due messages by status and time
+    __table_args__ = (
+        db.Index('ix_outbox_status_next_attempt_at', 'status', 'next_attempt_at'),
+    )
+
+    def __repr__(self):
+        '''Define the string representation for the OutboxMessage model'''
+        return '<OutboxMessage {} to {}>'.format(self.subject, self.recipient)
+
+
+# Dogs booked per facility per day, kept up to date by availability.py so
+# capacity checks read one row per day instead of every overlapping booking
+
+class FacilityOccupancy(db.Model):
+    '''Facility occupancy model'''
+    __tablename__ = 'facility_occupancy'
+
+    facility_id = db.Column(db.Integer, db.ForeignKey('facility.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    dogs = db.Column(db.Integer, default=0, nullable=False)
+
+    def __repr__(self):
+        '''Define the string representation for the FacilityOccupancy model'''
+        return '<FacilityOccupancy {} {} {}>'.format(self.facility_id, self.day, self.dogs)
+
+
+# How far a scheduled job has processed, so the next run only looks at
+# what happened since, see update_bookings() in routes.py
+
+class JobWatermark(db.Model):
+    '''Job watermark model'''
+    __tablename__ = 'job_watermark'
+
+    name = db.Column(db.String(64), primary_key=True)
+    value = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        '''Define the string representation for the JobWatermark model'''
+        return '<JobWatermark {} {}>'.format(self.name, self.value)
+
+
+# Lease naming the one process that runs the scheduled jobs, see leader.py
+# The holder renews it on every heartbeat and another process takes over
+# once it expires. term goes up each time the lease changes hands.
+
+class SchedulerLease(db.Model):
+    '''Scheduler lease model'''
+    __tablename__ = 'scheduler_lease'
+
+    name = db.Column(db.String(64), primary_key=True)
+    holder = db.Column(db.String(128), nullable=False)
+    term = db.Column(db.Integer, default=1, nullable=False)
+    acquired_at = db.Column(db.DateTime, nullable=False)
+    renewed_at = db.Column(db.DateTime, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        '''Define the string representation for the SchedulerLease model'''
+        return '<SchedulerLease {} held by {}>'.format(self.name, self.holder)
@@ -0,0 +1,170 @@
+'''Transactional email outbox delivered by background workers'''
+
+import random
+import threading
+import time
+from uuid import uuid4
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from sqlalchemy import select, update, insert, or_, and_
+from app import app, db, metrics, Message
+from app.mailer import MailDispatcher
+from app.models import OutboxMessage
+
+
+# Emails are added to the outbox table in the same transaction as the
+# change they announce, so a committed booking always gets its emails and
+# a rolled back one never does, and requests never wait on the mail server.
+# drain_outbox() runs on the scheduler: it claims batches of due messages
+# and splits them between a thread pool, each thread sending its share over
+# one reused SMTP connection (see mailer.py). Failed messages are retried with
+# exponential backoff and marked dead after OUTBOX_MAX_ATTEMPTS.
+
+
+def enqueue(recipient, subject, html, sender=None):
+    '''Add an email to the outbox in the current transaction'''
+    message = OutboxMessage(recipient=recipient, subject=subject, html=html, sender=sender,
+                            next_attempt_at=datetime.now())
+    db.session.add(message)
+    return message
+
+
+def enqueue_many(messages, sender=None):
+    '''Add (recipient, subject, html) emails to the outbox with one INSERT'''
+    if not messages:
+        return
+    now = datetime.now()
+    db.session.execute(insert(OutboxMessage), [
+        {'recipient': recipient, 'subject': subject, 'html': html, 'sender': sender, 'next_attempt_at': now}
+        for recipient, subject, html in messages
+    ])
+
+
+def retry_delay(attempts):
+    '''Return the seconds to wait before the next attempt, with jitter'''
+    delay = min(app.config['OUTBOX_BACKOFF'] * 2 ** (attempts - 1), app.config['OUTBOX_MAX_BACKOFF'])
+    return delay * random.uniform(0.5, 1)
+
+
+def claim_batch(limit, now):
+    '''Mark up to limit due messages as being sent by this worker
+
+    Messages left in 'sending' by a worker that died are claimed again after
+    OUTBOX_CLAIM_TIMEOUT seconds.
+    '''
+    token = uuid4().hex
+    stale = now - timedelta(seconds=app.config['OUTBOX_CLAIM_TIMEOUT'])
+    due = or_(
+        and_(OutboxMessage.status == 'pending', OutboxMessage.next_attempt_at <= now),
+        and_(OutboxMessage.status == 'sending', OutboxMessage.claimed_at <= stale)
+    )
+    with db.engine.begin() as connection:
+        ids = connection.execute(
+            select(OutboxMessage.id).where(due).order_by(OutboxMessage.id).limit(limit)
+        ).scalars().all()
+        if not ids:
+            return []
+        # Re-checking due makes the claim safe against a concurrent worker
+        connection.execute(
+            update(OutboxMessage).where(OutboxMessage.id.in_(ids), due)
+            .values(status='sending', claimed_by=token, claimed_at=now)
+        )
+        return connection.execute(
+            select(OutboxMessage.id, OutboxMessage.sender, OutboxMessage.recipient,
+                   OutboxMessage.subject, OutboxMessage.html, OutboxMessage.attempts)
+            .where(OutboxMessage.claimed_by == token)
+        ).all()
+
+
+def deliver(messages):
+    '''Send claimed messages over one connection, returning None or the error for each'''
+    start = time.perf_counter()
+    sendable = [message for message in messages if message.recipient]
+    with app.app_context():
+        dispatcher = MailDispatcher()
+        sent = iter(dispatcher.send_all([
+            Message(message.subject, sender=message.sender, html=message.html, recipients=[message.recipient])
+            for message in sendable
+        ]))
+    metrics.observe('outbox.delivery', time.perf_counter() - start)
+    return [next(sent) if message.recipient else 'No recipient' for message in messages], dispatcher.stats
+
+
+def record_results(results, now):
+    '''Store the outcome of each delivery attempt'''
+    sent = [message.id for message, error in results if error is None]
+    with db.engine.begin() as connection:
+        if sent:
+            connection.execute(
+                update(OutboxMessage).where(OutboxMessage.id.in_(sent))
+                .values(status='sent', sent_at=now, claimed_by=None, last_error=None,
+                        attempts=OutboxMessage.attempts + 1)
+            )
+        for message, error in results:
+            if error is None:
+                continue
+            attempts = message.attempts + 1
+            if attempts >= app.config['OUTBOX_MAX_ATTEMPTS'] or not message.recipient:
+                values = dict(status='dead')
+            else:
+                values = dict(status='pending', next_attempt_at=now + timedelta(seconds=retry_delay(attempts)))
+            connection.execute(
+                update(OutboxMessage).where(OutboxMessage.id == message.id)
+                .values(attempts=attempts, last_error=error, claimed_by=None, **values)
+            )
+    outcomes = Counter('sent' if error is None else 'failed' for _, error in results)
+    metrics.increment('outbox.sent', outcomes['sent'])
+    metrics.increment('outbox.failed', outcomes['failed'])
+    return outcomes
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    '''Return the shared delivery thread pool'''
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=app.config['OUTBOX_WORKERS'],
+                                       thread_name_prefix='outbox')
+        return _pool
+
+
+def split(batch, parts):
+    '''Split batch into at most parts chunks of about the same size'''
+    size = -(-len(batch) // parts)
+    return [batch[start:start + size] for start in range(0, len(batch), size)]
+
+
+def drain_outbox(batch_size=None):
+    '''Deliver every due message, returning the number sent and failed'''
+    batch_size = batch_size or app.config['OUTBOX_BATCH_SIZE']
+    totals = Counter()
+    sent, seconds = 0, 0.0
+    while True:
+        now = datetime.now()
+        batch = claim_batch(batch_size, now)
+        if not batch:
+            break
+        start = time.perf_counter()
+        errors = []
+        for chunk_errors, stats in get_pool().map(deliver, split(batch, app.config['OUTBOX_WORKERS'])):
+            errors += chunk_errors
+            sent += stats.sent
+        seconds += time.perf_counter() - start
+        totals += record_results(list(zip(batch, errors)), datetime.now())
+        if len(batch) < batch_size:
+            break
+    if seconds:
+        metrics.set_gauge('outbox.throughput', sent / seconds)
+    metrics.set_gauge('outbox.dead', OutboxMessage.query.filter_by(status='dead').count())
+    return totals
+
+
+def run_outbox_worker():
+    '''Scheduler job draining the outbox'''
+    with app.app_context():
+        drain_outbox()
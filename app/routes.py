@@ -1,19 +1,36 @@
 # Module - app/routes.py
 
+import math
 import string
-import random
 from app import scheduler
-from sqlalchemy import and_, or_, func
+from sqlalchemy import and_, or_, func, case, select, update, insert, event
+from sqlalchemy.orm import joinedload, aliased, Session
+from sqlalchemy.exc import IntegrityError
 from geopy.distance import geodesic
 from operator import itemgetter
-import requests, secrets, os
-from datetime import datetime
+from collections import Counter
+import secrets, os
+import atexit
+from datetime import datetime, date, timedelta
 from urllib.parse import urlsplit
-from urllib.parse import quote
-from app import app, db, mail, Message
+from app import app, db
+from app.geo import neighbour_cells, covered_radius, prefix_upper_bound, batch_distances, bounding_box
+from app.geo import HAVERSINE_MARGIN
+from app.cache import TTLCache
+from app import metrics
+from app.geocoding import geocode, GeocodingError
+from app.search import search_facility_ids
+from app.fragments import render_cached, get_versions, bump_versions
+from app.outbox import enqueue, enqueue_many, run_outbox_worker
+from app.emails import render_email, render_emails, booking_context, row_context, series_context
+from app.timers import TransitionTimer
+from app.availability import reserve, reserve_days, booking_days, change_status, FacilityFullError
+from app.availability import availability_state, remaining_places
+from app.schedules import parse_weekdays, occurrences, ScheduleError
+from app.leader import LeaderLease
 from werkzeug.utils import secure_filename
-from app.models import User, Facility, Dog, DogOwner, FacilityOwner, Booking, FacilityPhoto, Review
-from flask import render_template, redirect, flash, url_for, request, session
+from app.models import User, Facility, Dog, DogOwner, FacilityOwner, Booking, FacilityPhoto, Review, JobWatermark
+from flask import render_template, redirect, flash, url_for, request, session, abort, jsonify
 from flask_login import current_user, login_user, logout_user, login_required
 from app.forms import FacilityOwnerRegistrationForm, FacilityRegistrationForm, DogRegistrationForm
 from app.forms import DogOwnerLoginForm, FacilityOwnerLoginForm, DogOwnerRegistrationForm, UpdateFacilityOwnerProfileForm 
@@ -21,11 +38,20 @@ from app.forms import SearchFacilityForm, BookingForm, UpdateDogProfileForm, Upd
 from app.forms import SetLocationForm
 
 
-# API Keys for OpenWeatherMap and Google Maps
-# These are used to get the geolocation of the location
+# Cache for listing totals such as the number of facilities
+# Counting is a full index scan, so it is not repeated on every page view
 
-OWM_API_KEY = app.config['OWM_API_KEY']
-GO_MAPS_API_KEY = app.config['GO_MAPS_API_KEY']
+listing_cache = TTLCache(maxsize=16, ttl=300)
+
+# Largest radius in km accepted by the radius search
+MAX_SEARCH_RADIUS = 500
+
+# Search results shared by every user running the same query
+# Keyed by the normalized query, see search_cache_key()
+
+search_cache = TTLCache(maxsize=app.config['SEARCH_CACHE_SIZE'], ttl=app.config['SEARCH_CACHE_TTL'])
+SEARCH_RESULT_LIMIT = 500
+SEARCH_PAGE_SIZE = 10
 
 
 # --------------------HELPER FUNCTIONS--------------------
@@ -33,22 +59,17 @@ GO_MAPS_API_KEY = app.config['GO_MAPS_API_KEY']
 # Get the geolocation of the location
 # This is used to get the latitude and longitude of the location
 
-def get_location(location):
-    '''Get the geolocation of the location'''
-    geocode_url = f"https://maps.gomaps.pro/maps/api/geocode/json?address={quote(location)}&key={GO_MAPS_API_KEY}&limit=1"
-    response = requests.get(geocode_url)
-    if response.status_code == 200:
-        data = response.json()
-        if data.get('results'):
-            latitude = data['results'][0]['geometry']['location']['lat']
-            longitude = data['results'][0]['geometry']['location']['lng']
-            return latitude, longitude
-        else:
-            flash('No coordinates found for this location.', 'danger')
-            return None
-    else:
+def get_location(location, approximate=False):
+    '''Get the geolocation of the location, see geocode() for approximate'''
+    try:
+        coordinates = geocode(location, approximate=approximate)
+    except GeocodingError:
         flash('Failed to get coordinates. Please try again.', 'danger')
         return None
+    if not coordinates:
+        flash('No coordinates found for this location.', 'danger')
+        return None
+    return coordinates
     
 
 # Generating the greeting message for the user based on the current time.
@@ -78,15 +99,17 @@ def generate_welcoming_msg():
 # Sending email notification function
 # This is used to send email notifications to the user and facility owner
 # on booking creation, cancellation, and completion
+# The email is rendered from templates/email/, see emails.py, then queued in
+# the outbox and sent once the transaction commits, so call it before
+# db.session.commit(), see outbox.py
+
+NOTIFICATION_SENDER = 'pawsitivelybookings@gmail.com'
 
-def send_notification(email, subject, template):
-    '''Send email notification'''
-    msg = Message(subject,
-                  sender='pawsitivelybookings@gmail.com',
-                  html=template,
-                    recipients=[email])
-    
-    mail.send(msg)
+
+def send_notification(email, template, recipient_name, booking):
+    '''Queue an email notification about a booking'''
+    subject, html = render_email(template, recipient_name, booking)
+    enqueue(email, subject, html, sender=NOTIFICATION_SENDER)
 
 # Calculate the distance between the facility and the user
 # This is used to calculate the distance between the facility and the user
@@ -99,14 +122,149 @@ def calculate_distance(facility, user):
     return round(distance, 2)
 
 
+# Rank facilities by distance from the user
+# All distances are computed in one vectorized pass
+
+def rank_by_distance(facilities, user):
+    '''Return (facility, distance) pairs sorted nearest first'''
+    if not facilities:
+        return []
+    distances = batch_distances(user.latitude, user.longitude,
+                                [facility.latitude for facility in facilities],
+                                [facility.longitude for facility in facilities])
+    order = distances.argsort(kind='stable')
+    return [(facilities[i], float(distances[i])) for i in order]
+
+
+# Find the facilities nearest to the user
+# Searches the geohash cells around the user, widening the cells until
+# every facility that could be on the requested page has been seen.
+# The total is cached, see get_located_facility_count().
+
+def get_nearest_facilities(user, limit, offset=0):
+    '''Return the (facility, distance) pairs nearest to the user'''
+    needed = offset + limit
+    located = Facility.query.filter(Facility.geohash.isnot(None))
+    total = get_located_facility_count()
+
+    ranked = None
+    for precision in range(6, 0, -1):
+        cells = neighbour_cells(user.latitude, user.longitude, precision)
+        candidates = located.filter(or_(*[
+            and_(Facility.geohash >= cell, Facility.geohash < prefix_upper_bound(cell))
+            for cell in cells
+        ])).all()
+        ranked = rank_by_distance(candidates, user)
+
+        # Every facility within the covered radius is among the candidates,
+        # so the nearest ones inside it are exact.
+        radius = covered_radius(user.latitude, precision) * 0.99
+        within = [pair for pair in ranked if pair[1] <= radius]
+        if len(within) >= needed or len(candidates) >= total:
+            break
+    else:
+        ranked = rank_by_distance(located.all(), user)
+
+    # Exact geodesic distances for the displayed page only, which may
+    # order its rows slightly differently from the haversine ranking
+    page = [facility for facility, _ in ranked[offset:needed]]
+    exact = batch_distances(user.latitude, user.longitude,
+                            [facility.latitude for facility in page],
+                            [facility.longitude for facility in page], exact=True)
+    rows = [(facility, round(float(distance), 2)) for facility, distance in zip(page, exact)]
+    rows.sort(key=itemgetter(1))
+    return rows, total
+
+
+# Find the facilities within a radius of a point
+# The indexed latitude/longitude bounding box narrows the candidates in SQL,
+# reading only their coordinates. The haversine distance, within 0.6% of
+# the geodesic, rules out the candidates clearly outside the radius, and
+# exact geodesic distances are then computed for the nearest limit only.
+
+def get_facilities_within(latitude, longitude, radius, limit=SEARCH_RESULT_LIMIT):
+    '''Return the (facility id, distance) pairs of at most limit facilities within radius km, nearest first'''
+    min_lat, max_lat, lon_ranges = bounding_box(latitude, longitude, radius)
+    candidates = db.session.execute(select(Facility.id, Facility.latitude, Facility.longitude).where(
+        Facility.latitude.between(min_lat, max_lat),
+        or_(*[Facility.longitude.between(min_lon, max_lon) for min_lon, max_lon in lon_ranges])
+    )).all()
+    if not candidates:
+        return []
+
+    distances = batch_distances(latitude, longitude,
+                                [row.latitude for row in candidates],
+                                [row.longitude for row in candidates])
+    order = [i for i in distances.argsort(kind='stable') if distances[i] <= radius * HAVERSINE_MARGIN]
+    near = [candidates[i] for i in order[:limit]]
+    exact = batch_distances(latitude, longitude,
+                            [row.latitude for row in near],
+                            [row.longitude for row in near], exact=True)
+    within = [(row.id, round(float(distance), 2))
+              for row, distance in zip(near, exact) if distance <= radius]
+    within.sort(key=itemgetter(1))
+    return within
+
+
 # Generate a booking code.
 # This is used to create booking tickets and used to the public
 # See models
+# Codes are unique in the database. A new booking gets its code before its
+# first flush, in a savepoint that is retried with a new code on the (with
+# 36^8 codes, very unlikely) collision, so the booking is still created in
+# a single transaction.
+
+BOOKING_CODE_ATTEMPTS = 5
+
 
 def generate_booking_code():
     length = 8
     characters = string.ascii_uppercase + string.digits
-    return ''.join(random.choice(characters) for _ in range(length))
+    return ''.join(secrets.choice(characters) for _ in range(length))
+
+
+def add_with_booking_code(booking):
+    '''Add a new booking to the session with a unique booking code, flushing it'''
+    for attempt in range(BOOKING_CODE_ATTEMPTS):
+        booking.booking_code = generate_booking_code()
+        try:
+            with db.session.begin_nested():
+                db.session.add(booking)
+            return booking
+        except IntegrityError:
+            if attempt == BOOKING_CODE_ATTEMPTS - 1:
+                raise
+            metrics.increment('bookings.code_collisions')
+
+
+# Keyset pagination cursors
+# A cursor is the sort value and id of the last row shown, e.g. "4.5:17"
+
+def encode_cursor(value, id):
+    '''Encode the last row of a page as a cursor string'''
+    return f'{value}:{id}'
+
+
+def decode_cursor(cursor, cast):
+    '''Decode a cursor string, returning None if it is missing or invalid'''
+    if not cursor:
+        return None
+    value, _, id = cursor.rpartition(':')
+    try:
+        return cast(value), int(id)
+    except ValueError:
+        return None
+
+
+def get_facility_count():
+    '''Return the total number of facilities, cached for a few minutes'''
+    return listing_cache.get_or_set('facility_count', lambda: Facility.query.count())
+
+
+def get_located_facility_count():
+    '''Return the number of facilities with coordinates, cached like get_facility_count()'''
+    return listing_cache.get_or_set('located_facility_count',
+                                    lambda: Facility.query.filter(Facility.geohash.isnot(None)).count())
 
 
 # --------------------INDEX--------------------
@@ -122,45 +280,50 @@ def index():
     '''Define the view function for the index page'''
     form = SearchFacilityForm()
     page = request.args.get('page', 1, type=int)
-
-    # Query facilities with their average rating
-    facilities_query = (
-        db.session.query(
-            Facility,
-            func.coalesce(func.avg(Review.rating), 0).label('avg_rating')
-        )
-        .outerjoin(Review, Facility.id == Review.facility_id)
-        .group_by(Facility.id)
-    ).all()
+    next_cursor = None
 
     # Calculate the distance if the user is authenticated and has a location
-    facilities_with_distance = []
     if current_user.is_authenticated and current_user.location:
-        for facility, avg_rating in facilities_query:
-            distance = calculate_distance(facility, current_user)
-            facilities_with_distance.append((facility, avg_rating, distance))
-
-        # Sort facilities by distance (nearest first)
-        # Sort by distance
-        facilities_with_distance.sort(key=itemgetter(2))  
-
-        # Paginate the sorted facilities
-        start = (page - 1) * 5
-        end = start + 5
-        facilities_paginated = facilities_with_distance[start:end]
-        total_pages = (len(facilities_with_distance) + 4) // 5
+        # Only the facilities near the user are looked up, nearest first
+        nearest, total = get_nearest_facilities(current_user, limit=5, offset=max(page - 1, 0) * 5)
+        facilities_paginated = [(facility, facility.avg_rating, distance) for facility, distance in nearest]
+        total_pages = (total + 4) // 5
 
     else:
         # No location set, no distance sorting
-        facilities_paginated = [(facility, avg_rating, None) for facility, avg_rating in facilities_query]
-        total_pages = (len(facilities_query) + 4) // 5 
+        # Facilities are paged in the database, best rated first
+        # The pages link to each other by cursor, ?page= only serves old links
+        facilities_query = Facility.query.order_by(Facility.avg_rating.desc(), Facility.id.desc())
+        cursor = decode_cursor(request.args.get('after'), float)
+        if cursor:
+            last_rating, last_id = cursor
+            if not math.isfinite(last_rating):
+                abort(400)
+            page = None
+            facilities_query = facilities_query.filter(or_(
+                Facility.avg_rating < last_rating,
+                and_(Facility.avg_rating == last_rating, Facility.id < last_id)
+            ))
+        else:
+            facilities_query = facilities_query.offset(max(page - 1, 0) * 5)
+
+        # Visitors who aren't logged in only see the landing page
+        if current_user.is_authenticated:
+            facilities = facilities_query.limit(5).all()
+            total_pages = (get_facility_count() + 4) // 5
+        else:
+            facilities, total_pages = [], 0
+        facilities_paginated = [(facility, facility.avg_rating, None) for facility in facilities]
+        if len(facilities) == 5:
+            next_cursor = encode_cursor(facilities[-1].avg_rating, facilities[-1].id)
 
     return render_template(
         'index.html',
         form=form,
         facilities=facilities_paginated,
         current_page=page,
-        total_pages=total_pages
+        total_pages=total_pages,
+        next_cursor=next_cursor
     )
 
 # --------------------CUSTOM ERROR PAGES--------------------
@@ -183,6 +346,34 @@ def forbidden(e):
 # --------------------DASHBOARDS--------------------
 
 
+# Booking filters shared by the dashboards
+# Each booking matches at most one of them, so the dashboards can fetch
+# every category in one query and split the rows by status.
+
+def upcoming_booking_filter(now):
+    '''Accepted or pending bookings that have not started'''
+    return and_(Booking.status.in_(['accepted', 'pending']), Booking.check_in > now)
+
+
+def history_booking_filter(now):
+    '''Finished bookings, and cancelled or declined ones'''
+    return or_(
+        and_(
+            Booking.status.in_(['completed', 'expired']),
+            Booking.check_out <= now
+        ),
+        and_(
+            Booking.status.in_(['cancelled', 'declined']),
+            Booking.check_out > now
+        )
+    )
+
+
+def ongoing_booking_filter(now):
+    '''Bookings in progress'''
+    return and_(Booking.status == 'ongoing', Booking.check_in <= now, Booking.check_out > now)
+
+
 # The dashboard page for the application.
 # Displays the dashboard page for the dog owner if the user is a dog owner.
 
@@ -190,56 +381,47 @@ def forbidden(e):
 @login_required
 def dashboard_dog_owner():
     '''Define the view function for the dashboard page'''
-    dogs = current_user.dogs.all()                                   
-
-    upcoming_bookings = Booking.query.filter(Booking.issued_by == current_user.id,
-                                              Booking.status.in_(['accepted', 'pending']),
-                                                Booking.check_in > datetime.now()).all()
-    for booking in upcoming_bookings:
-        booking.check_in_formatted = booking.check_in.strftime('%B %d, %Y')
-        booking.check_out_formatted = booking.check_out.strftime('%B %d, %Y')
-
+    greeting = generate_welcoming_msg()
+    return render_cached('dog_owner/dashboard.html',
+                         (current_user.id, greeting) + get_versions(current_user),
+                         lambda: dog_owner_dashboard_context(greeting))
 
-    history_bookings = Booking.query.filter(
-                    Booking.issued_by == current_user.id,
-                        or_(
-                            and_(
-                                Booking.status.in_(['completed', 'expired']),
-                                Booking.check_out <= datetime.now()
-                            ),
-                            and_(
-                                Booking.status.in_(['cancelled', 'declined']),
-                                Booking.check_out > datetime.now()
-                            )
-                        )
-                    ).all()
 
+def dog_owner_dashboard_context(greeting):
+    '''Build the dog owner dashboard, cached by dashboard_dog_owner()'''
+    dogs = current_user.dogs.all()                                   
 
-    for booking in history_bookings:
-        booking.check_in_formatted = booking.check_in.strftime('%B %d, %Y')
-        booking.check_out_formatted = booking.check_out.strftime('%B %d, %Y')
-
-    ongoing_bookings = Booking.query.filter(Booking.issued_by == current_user.id,
-                                             Booking.status == 'ongoing',
-                                               Booking.check_in <= datetime.now(),
-                                               Booking.check_out > datetime.now()).all()
-    
-    for booking in ongoing_bookings:
+    # The user's upcoming and ongoing bookings, with their facilities, in one
+    # indexed query, split below. History is only counted here, the page
+    # loads it from dog_owner_booking_history().
+    now = datetime.now()
+    bookings = Booking.query.options(joinedload(Booking.facility)).filter(
+                                    Booking.issued_by == current_user.id,
+                                    or_(upcoming_booking_filter(now),
+                                        ongoing_booking_filter(now))).all()
+    history_count = Booking.query.filter(Booking.issued_by == current_user.id,
+                                         history_booking_filter(now)).count()
+
+    upcoming_bookings, ongoing_bookings = [], []
+    for booking in bookings:
         booking.check_in_formatted = booking.check_in.strftime('%B %d, %Y')
         booking.check_out_formatted = booking.check_out.strftime('%B %d, %Y')
+        if booking.status == 'ongoing':
+            ongoing_bookings.append(booking)
+        else:
+            upcoming_bookings.append(booking)
 
     length = {
         'upcoming_count': len(upcoming_bookings),
-        'history_count': len(history_bookings),
+        'history_count': history_count,
         'ongoing_count': len(ongoing_bookings)
     }
     
-    return render_template('dog_owner/dashboard.html',dogs=dogs,
-                            greeting=generate_welcoming_msg(),
-                            upcoming_bookings=upcoming_bookings,
-                              history_bookings=history_bookings,
-                                ongoing_bookings=ongoing_bookings,
-                                length=length)
+    return dict(dogs=dogs,
+                greeting=greeting,
+                upcoming_bookings=upcoming_bookings,
+                ongoing_bookings=ongoing_bookings,
+                length=length)
 
 
 # The dashboard page for the application.
@@ -249,66 +431,126 @@ def dashboard_dog_owner():
 @login_required
 def dashboard_facility_owner():
     '''Define the view function for the dashboard page'''
+    greeting = generate_welcoming_msg()
+    return render_cached('facility_owner/dashboard.html',
+                         (current_user.id, greeting) + get_versions(current_user),
+                         lambda: facility_owner_dashboard_context(greeting))
 
-    facilities_with_bookings = []
+
+def facility_owner_dashboard_context(greeting):
+    '''Build the facility owner dashboard, cached by dashboard_facility_owner()'''
     facilities = current_user.facilities.all()
-    for facility in facilities:
-        facility.unresponded_count = Review.query.filter(
-            and_(Review.facility_id == facility.id, Review.response == None)
-        ).count() 
-        booking_requests = Booking.query.filter(Booking.facility_id == facility.id,
-                                                Booking.status == 'pending').all()
-        
-        for booking in booking_requests:
-            booking.check_in_formatted = booking.check_in.strftime('%B %d, %Y')
-            booking.check_out_formatted = booking.check_out.strftime('%B %d, %Y')
-
-        upcoming_bookings = Booking.query.filter(Booking.facility_id == facility.id,
-                                                  Booking.status == 'accepted',
-                                                    Booking.check_in > datetime.now()).all()
-        for booking in upcoming_bookings:
-            booking.check_in_formatted = booking.check_in.strftime('%B %d, %Y')
-            booking.check_out_formatted = booking.check_out.strftime('%B %d, %Y')
-
-        ongoing_bookings = Booking.query.filter(Booking.facility_id == facility.id,
-                                                    Booking.status == 'ongoing',
-                                                    Booking.check_in <= datetime.now(),
-                                                    Booking.check_out > datetime.now()).all()
-        for booking in ongoing_bookings:
-            booking.check_in_formatted = booking.check_in.strftime('%B %d, %Y')
-            booking.check_out_formatted = booking.check_out.strftime('%B %d, %Y')
-        
+    facility_ids = [facility.id for facility in facilities]
+
+    # Unresponded review counts for every facility in one grouped query
+    unresponded_counts = dict(db.session.query(Review.facility_id, func.count(Review.id))
+                              .filter(Review.facility_id.in_(facility_ids), Review.response == None)
+                              .group_by(Review.facility_id).all())
+
+    # Every request, upcoming and ongoing booking across the owner's
+    # facilities, with the users who made them, in one query, split by
+    # facility and category below. History is only counted here, the page
+    # loads it from facility_booking_history().
+    now = datetime.now()
+    bookings = Booking.query.options(joinedload(Booking.user)).filter(
+                                    Booking.facility_id.in_(facility_ids),
+                                    or_(Booking.status == 'pending',
+                                        and_(Booking.status == 'accepted', Booking.check_in > now),
+                                        ongoing_booking_filter(now))).all()
+    history_counts = dict(db.session.query(Booking.facility_id, func.count(Booking.id))
+                          .filter(Booking.facility_id.in_(facility_ids), history_booking_filter(now))
+                          .group_by(Booking.facility_id).all())
 
-        history_bookings = Booking.query.filter(
-        Booking.facility_id == facility.id,
-                    or_(
-                        and_(
-                            Booking.status.in_(['completed','expired']),
-                            Booking.check_out <= datetime.now()
-                        ),
-                        and_(
-                            Booking.status.in_(['cancelled', 'declined']),
-                            Booking.check_out > datetime.now()
-                        )
-                    )
-                ).all()
-
-        for booking in history_bookings:
-            booking.check_in_formatted = booking.check_in.strftime('%B %d, %Y')
-            booking.check_out_formatted = booking.check_out.strftime('%B %d, %Y')
-
-        facilities_with_bookings.append({
+    facilities_with_bookings = []
+    by_facility = {}
+    for facility in facilities:
+        facility.unresponded_count = unresponded_counts.get(facility.id, 0)
+        by_facility[facility.id] = {
             'facility': facility,
-            'booking_requests': booking_requests,
-            'upcoming_bookings': upcoming_bookings,
-            'ongoing_bookings': ongoing_bookings,
-            'history_bookings': history_bookings
-        })
+            'booking_requests': [],
+            'upcoming_bookings': [],
+            'ongoing_bookings': [],
+            'history_count': history_counts.get(facility.id, 0)
+        }
+        facilities_with_bookings.append(by_facility[facility.id])
+
+    for booking in bookings:
+        booking.check_in_formatted = booking.check_in.strftime('%B %d, %Y')
+        booking.check_out_formatted = booking.check_out.strftime('%B %d, %Y')
+        if booking.status == 'pending':
+            category = 'booking_requests'
+        elif booking.status == 'accepted':
+            category = 'upcoming_bookings'
+        else:
+            category = 'ongoing_bookings'
+        by_facility[booking.facility_id][category].append(booking)
+
+    return dict(facilities=facilities,
+                facilities_with_bookings=facilities_with_bookings,
+                greeting=greeting)
+
+
+# Booking history for the dashboards, newest check-out first
+# Served as JSON pages with a keyset cursor on (check_out, id) so the
+# dashboards stay the same size however much history there is.
+
+HISTORY_PAGE_SIZE = 20
+
+
+def get_history_page(query, after, limit):
+    '''Return a page of history bookings and the cursor for the next one'''
+    query = query.filter(history_booking_filter(datetime.now()))
+    cursor = decode_cursor(after, datetime.fromisoformat)
+    if cursor:
+        last_check_out, last_id = cursor
+        query = query.filter(or_(
+            Booking.check_out < last_check_out,
+            and_(Booking.check_out == last_check_out, Booking.id < last_id)
+        ))
+    bookings = query.order_by(Booking.check_out.desc(), Booking.id.desc()).limit(limit + 1).all()
+    next_cursor = None
+    if len(bookings) > limit:
+        bookings = bookings[:limit]
+        next_cursor = encode_cursor(bookings[-1].check_out.isoformat(), bookings[-1].id)
+    return bookings, next_cursor
+
+
+def history_page_response(query, view_endpoint):
+    '''Return a JSON page of history bookings for the request's cursor'''
+    limit = min(max(request.args.get('limit', HISTORY_PAGE_SIZE, type=int), 1), 100)
+    bookings, next_cursor = get_history_page(query, request.args.get('after'), limit)
+    return jsonify({
+        'bookings': [{
+            'id': booking.id,
+            'booking_code': booking.booking_code,
+            'client': booking.user.first_name if booking.user else None,
+            'facility': booking.facility.name if booking.facility else None,
+            'check_in': booking.check_in.strftime('%B %d, %Y'),
+            'check_out': booking.check_out.strftime('%B %d, %Y'),
+            'status': booking.status,
+            'url': url_for(view_endpoint, booking_id=booking.id)
+        } for booking in bookings],
+        'next_cursor': next_cursor
+    })
+
+
+@app.route('/dog_owner/booking_history')
+@login_required
+def dog_owner_booking_history():
+    '''Define the view function for the dog owner's booking history'''
+    query = Booking.query.options(joinedload(Booking.facility)).filter(Booking.issued_by == current_user.id)
+    return history_page_response(query, 'view_booking')
+
 
-    return render_template('facility_owner/dashboard.html',
-                            facilities=facilities,
-                              facilities_with_bookings=facilities_with_bookings,
-                                greeting=generate_welcoming_msg())
+@app.route('/facility_owner/<int:facility_id>/booking_history')
+@login_required
+def facility_booking_history(facility_id):
+    '''Define the view function for a facility's booking history'''
+    facility = Facility.query.get_or_404(facility_id)
+    if facility.owner_id != current_user.id:
+        abort(403)
+    query = Booking.query.options(joinedload(Booking.user)).filter(Booking.facility_id == facility.id)
+    return history_page_response(query, 'view_booking_facility_owner')
 
 
 #---------------UPDATE BOOKING STATUS-------------
@@ -318,70 +560,246 @@ def dashboard_facility_owner():
 # This automatically update the bookings
 # See models.py
 
-def update_bookings():
-    '''Update the booking status'''
+def transition_bookings(condition, status):
+    '''Move every booking matching condition to status in one UPDATE
+
+    Returns the (id, issued_by, facility_id) of the updated rows.
+    '''
+    statement = update(Booking).where(condition).values(status=status)
+    if db.engine.dialect.update_returning:
+        rows = db.session.execute(
+            statement.returning(Booking.id, Booking.issued_by, Booking.facility_id),
+            execution_options={'synchronize_session': False}
+        ).all()
+    else:
+        rows = db.session.execute(select(Booking.id, Booking.issued_by, Booking.facility_id)
+                                  .where(condition).with_for_update()).all()
+        db.session.execute(update(Booking).where(Booking.id.in_([row.id for row in rows]))
+                           .values(status=status), execution_options={'synchronize_session': False})
+    return rows
+
+
+def add_completed_bookings(counts):
+    '''Add to the completed booking count of each facility in one UPDATE'''
+    if not counts:
+        return
+    db.session.execute(
+        update(Facility)
+        .where(Facility.id.in_(counts))
+        .values(completed_bookings=func.coalesce(Facility.completed_bookings, 0)
+                + case(counts, value=Facility.id, else_=0)),
+        execution_options={'synchronize_session': False}
+    )
+
+
+def notify_completed_bookings(booking_ids, chunk_size=500):
+    '''Send the completion emails for the given bookings
+
+    Only the columns the emails use are selected, and each chunk is rendered
+    in bulk and added to the outbox with one INSERT. Emails whose recipient
+    is missing, e.g. a deleted user or a facility without an owner, are
+    skipped and counted in notifications.unresolved.
+    '''
+    client, owner = aliased(User), aliased(User)
+    columns = (
+        select(Booking.id.label('booking_id'), Booking.booking_code, Booking.check_in, Booking.check_out,
+               Booking.number_of_dogs, Booking.notes, Booking.daycare, Booking.boarding,
+               Facility.name.label('facility_name'), Facility.location.label('facility_location'),
+               client.first_name.label('client_first_name'), client.last_name.label('client_last_name'),
+               client.email.label('client_email'), client.phone_number.label('client_phone_number'),
+               owner.first_name.label('owner_first_name'), owner.email.label('owner_email'))
+        .outerjoin(client, Booking.issued_by == client.id)
+        .outerjoin(Facility, Booking.facility_id == Facility.id)
+        .outerjoin(owner, Facility.owner_id == owner.id)
+    )
+
+    for start in range(0, len(booking_ids), chunk_size):
+        rows = db.session.execute(columns.where(Booking.id.in_(booking_ids[start:start + chunk_size]))).all()
+        contexts = [row_context(row) for row in rows]
+        clients = [context for context in contexts if context['client_email']]
+        owners = [context for context in contexts if context['owner_email']]
+        unresolved = [(context['booking_id'], role) for context in contexts for role, email in
+                      (('client', context['client_email']), ('facility owner', context['owner_email'])) if not email]
+        if unresolved:
+            metrics.increment('notifications.unresolved', len(unresolved))
+            app.logger.warning('No recipient for completion emails (booking id, recipient): %s', unresolved)
+
+        to_clients = render_emails('booking_completed_owner',
+                                   [(context['client_first_name'], context) for context in clients])
+        to_owners = render_emails('booking_completed_facility',
+                                  [(context['owner_first_name'], context) for context in owners])
+        messages = [(context['client_email'], *email) for context, email in zip(clients, to_clients)]
+        messages += [(context['owner_email'], *email) for context, email in zip(owners, to_owners)]
+        enqueue_many(messages, sender=NOTIFICATION_SENDER)
+
+
+def apply_transitions(now, booking_ids=None, since=None):
+    '''Move every booking whose check-in or check-out has passed to its next status
+
+    booking_ids limits the transitions to those bookings, as used by the
+    transition timer. since limits them to check-ins and check-outs after
+    that time, so a run only reads the bookings that can have changed.
+    '''
+    def due(condition, *columns):
+        if since is not None:
+            condition = and_(condition, or_(*[column > since for column in columns]))
+        if booking_ids is not None:
+            condition = and_(condition, Booking.id.in_(booking_ids))
+        return condition
+
+    # Each transition is a single set-based UPDATE. Mapper events don't
+    # run for these, so the dashboard versions are bumped here.
+    # Bookings accepted after their check-in still start until they check out.
+    started = transition_bookings(due(and_(Booking.status == 'accepted', Booking.check_in <= now),
+                                      Booking.check_in, Booking.check_out), 'ongoing')
+    expired = transition_bookings(due(and_(Booking.status == 'pending', Booking.check_out <= now),
+                                      Booking.check_out), 'expired')
+    completed = transition_bookings(due(and_(Booking.status == 'ongoing', Booking.check_out <= now),
+                                        Booking.check_out), 'completed')
+
+    add_completed_bookings(Counter(row.facility_id for row in completed if row.facility_id))
+    rows = started + expired + completed
+    bump_versions(db.session.connection(),
+                  [f'user:{row.issued_by}' for row in rows if row.issued_by] +
+                  [f'facility:{row.facility_id}' for row in rows if row.facility_id])
+
+    notify_completed_bookings([row.id for row in completed])
+
+    # Commit the changes and their emails to the database
+    db.session.commit()
+    return len(rows)
+
+
+def update_bookings(full=False):
+    '''Reconcile the booking statuses, catching anything the timer missed
+
+    Only check-ins and check-outs since the last run are looked at, except
+    on a full pass. One runs when full is set, when the job has never run,
+    and once every UPDATE_BOOKINGS_FULL_INTERVAL seconds, so bookings whose
+    deadline was already behind the watermark are still reconciled, e.g.
+    one accepted after its check-out.
+    '''
     print(f'Updating bookings at {datetime.now()}')
     with app.app_context():
-        ongoing_bookings = Booking.query.filter(Booking.check_in <= datetime.now(),
-                                    Booking.status.in_(['accepted'])).all()
-        for booking in ongoing_bookings:
-            booking.update_status()
+        now = datetime.now()
+        watermark = db.session.get(JobWatermark, 'update_bookings') or JobWatermark(name='update_bookings')
+        last_full = db.session.get(JobWatermark, 'update_bookings_full') or JobWatermark(name='update_bookings_full')
+        full_interval = timedelta(seconds=app.config['UPDATE_BOOKINGS_FULL_INTERVAL'])
+        if full or last_full.value is None or now - last_full.value >= full_interval:
+            since = None
+            last_full.value = now
+        else:
+            since = watermark.value
+        # Committed with the transitions, so a failed run is retried from the same point
+        watermark.value = now
+        db.session.add_all([watermark, last_full])
+        return apply_transitions(now, since=since)
 
-        expired_bookings = Booking.query.filter(Booking.check_out <= datetime.now(),
-                                        Booking.status.in_(['pending'])).all()
-        for booking in expired_bookings:
-            booking.status = 'expired'
 
+# Deadlines of the transitions still ahead of a booking
+# Accepted bookings start at check-in, and every open booking ends at check-out.
+
+OPEN_STATUSES = ('pending', 'accepted', 'ongoing')
+
+
+def booking_deadlines(booking):
+    '''Return the (due, booking id) of the booking's next transitions'''
+    deadlines = []
+    if booking.status == 'accepted' and booking.check_in:
+        deadlines.append((booking.check_in, booking.id))
+    if booking.status in OPEN_STATUSES and booking.check_out:
+        deadlines.append((booking.check_out, booking.id))
+    return deadlines
+
+
+def load_deadlines(start, end):
+    '''Return the deadlines in (start, end], or every one up to end when start is None'''
+    def window(column):
+        return column <= end if start is None else and_(column > start, column <= end)
+
+    with app.app_context():
+        check_ins = db.session.execute(
+            select(Booking.check_in, Booking.id).where(Booking.status == 'accepted', window(Booking.check_in))
+        ).all()
+        check_outs = db.session.execute(
+            select(Booking.check_out, Booking.id).where(Booking.status.in_(OPEN_STATUSES), window(Booking.check_out))
+        ).all()
+    return [tuple(row) for row in check_ins + check_outs]
+
+
+def fire_transitions(now, booking_ids):
+    '''Apply the transitions due for the given bookings'''
+    with app.app_context():
+        apply_transitions(now, booking_ids)
+
+
+transition_timer = TransitionTimer(load_deadlines, fire_transitions)
 
-        completed_bookings = Booking.query.filter(Booking.check_out <= datetime.now(),
-                                        Booking.status == 'ongoing').all()
-        
-        for booking in completed_bookings:
-            booking.status = 'completed'
-            if booking.facility.completed_bookings:
-                booking.facility.completed_bookings += 1
-            else:
-                booking.facility.completed_bookings = 1
-
-            check_in = booking.check_in.strftime('%B %d, %Y')
-            check_out = booking.check_out.strftime('%B %d, %Y')
-
-            send_notification(booking.user.email,
-                            f'Your Booking #{booking.booking_code} is Now Complete - Thank you!',
-                            template=(f'<p> Hi {booking.user.first_name}, </p>'
-                              f'<p>We hope your furry friend enjoyed their stay with us! We are writing to let you know that your booking at {booking.facility.name} has been successfully completed. </p>'
-                                f'<p> Here are the datails of your booking: </p>' 
-                                f'<p> <b>Check-in: </b> {check_in} </p>'
-                                f'<p> <b>Check-out: </b> {check_out} </p>'
-                                f'<p> <b>Number of dogs: </b>{booking.number_of_dogs} </p>'
-                                f'<p><b> Facility: </b>{booking.facility.name} </p>'
-                                f'<p>We would love to hear about your experience. Your feedback helps us improve and continue providing the best care for your beloved pet.</p>'
-                                f'<p> Thank you for using our services. We look forward to seeing you again soon! </p>'
-                                f'<p> Best regards, </p>' 
-                                f'<p> The PawsitivelyBooked Team </p>'
-                                ))
-
-            
-            send_notification(booking.facility.owner.email,
-                                'Booking Completion Notification - Booking Code #{}'.format(booking.booking_code),
-                                template=(f"<p> Hi {booking.facility.owner.first_name}, </p>"
-                                f'<p> This is a notification to inform you that the booking with Code #{booking.booking_code} for {booking.user.first_name }at your facility, {booking.facility.name}, has been successfully completed as of {booking.check_out}</p>'
-                                f'<p> Here are the details of the booking: </p>'
-                                f'<p> <b>Check-in: </b> {check_in} </p>' 
-                                f'<p> <b>Check-out: </b> {check_out} </p>' 
-                                f'<p> <b>Number of dogs: </b>{booking.number_of_dogs} </p>'
-                                f'<p><b> Facility: </b>{booking.facility.name} </p>'
-                                f'<p> Thank you for your attention to this booking. Your dedication to providing excellent service is greatly appreciated. </p>'
-                                f'<p> Best regards, </p>' 
-                                f'<p> The PawsitivelyBooked Team </p>'
-                                ))
-
-        # Commit the changes to the database
-        db.session.commit()
 
-# Add the update_bookings function to the scheduler
-scheduler.add_job(id='update_bookings', func=update_bookings, trigger='interval', hours=6)
-scheduler.start()
+# Queue the deadlines of bookings created or changed in this process once
+# they commit, so they don't wait for the next refill
+
+@event.listens_for(Booking, 'after_insert')
+@event.listens_for(Booking, 'after_update')
+def booking_saved(mapper, connection, target):
+    '''Remember the booking's deadlines until the transaction commits'''
+    session = Session.object_session(target)
+    if session is not None:
+        session.info.setdefault('booking_deadlines', []).extend(booking_deadlines(target))
+
+
+@event.listens_for(Session, 'after_commit')
+def queue_booking_deadlines(session):
+    '''Hand the committed deadlines to the transition timer'''
+    for due, booking_id in session.info.pop('booking_deadlines', ()):
+        transition_timer.add(due, booking_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def discard_booking_deadlines(session):
+    '''Forget the deadlines of a rolled back transaction'''
+    session.info.pop('booking_deadlines', None)
+
+
+# Only one process runs the scheduled jobs and the transition timer
+# Every process renews or bids for the lease on each heartbeat, see leader.py
+
+def start_transition_timer():
+    '''Start firing booking transitions in this process'''
+    if app.config['TRANSITION_TIMER_ENABLED']:
+        transition_timer.start()
+
+
+leader_lease = LeaderLease('scheduler', on_elected=start_transition_timer, on_deposed=transition_timer.stop,
+                           enabled=app.config['SCHEDULER_LEASE_ENABLED'])
+
+
+def start_scheduler():
+    '''Start the scheduled jobs and the transition timer in this process
+
+    Called by the serving process (run.py, gunicorn.conf.py) rather than at
+    import, so flask commands and the tests don't run the jobs.
+    '''
+    if scheduler.running:
+        return
+    # Add the update_bookings function to the scheduler
+    # The timer fires transitions on time, this sweep only reconciles
+    scheduler.add_job(id='update_bookings', func=leader_lease.leader_only(update_bookings), trigger='interval',
+                      hours=6, replace_existing=True)
+
+    # Deliver the queued emails in the background
+    if app.config['OUTBOX_WORKER_ENABLED']:
+        scheduler.add_job(id='drain_outbox', func=leader_lease.leader_only(run_outbox_worker), trigger='interval',
+                          seconds=app.config['OUTBOX_POLL_INTERVAL'], replace_existing=True)
+
+    if leader_lease.enabled:
+        scheduler.add_job(id='leader_heartbeat', func=leader_lease.heartbeat, trigger='interval',
+                          seconds=app.config['SCHEDULER_HEARTBEAT'], next_run_time=datetime.now(),
+                          replace_existing=True)
+        atexit.register(leader_lease.release)
+    else:
+        start_transition_timer()
+    scheduler.start()
 
 
 # --------------------REDIRECT DASHBOARDS--------------------
@@ -583,6 +1001,8 @@ def facility_registration():
         
         db.session.add(facility)
         db.session.commit()
+        listing_cache.delete('facility_count')
+        listing_cache.delete('located_facility_count')
         flash('Facility successfully registered.', 'success')
         return redirect(url_for('dashboard_facility_owner'))
     return render_template('facility_owner/register_facility.html', form=form)
@@ -615,51 +1035,94 @@ def dog_registration():
 # --------------------SEARCH FACILITY--------------------
 
 
-# Search facilities not complete
-# See forms.py
+# Search facilities
+# See forms.py and search.py
+
+# Search cache keys
+# The key is the normalized query itself, e.g. "text:pool" or
+# "radius:25:cape town", so any worker can rerun a search it has not cached.
+# SearchFacilityForm rejects queries over 100 characters, which keeps the
+# key short enough for the session cookie without truncating the query.
+
+def search_cache_key(location, radius=None):
+    '''Return the cache key for a search'''
+    query = ' '.join(location.lower().split())
+    if radius:
+        return f'radius:{min(radius, MAX_SEARCH_RADIUS):g}:{query}'
+    return f'text:{query}'
+
+
+def run_search(key):
+    '''Run the search described by a cache key, None if it cannot be run'''
+    mode, _, rest = key.partition(':')
+    if mode == 'radius':
+        radius, _, query = rest.partition(':')
+        # A search only needs the area, so a place centroid will do
+        coordinates = get_location(query, approximate=True)
+        if not coordinates:
+            return None
+        latitude, longitude = coordinates
+        return [facility_id for facility_id, _ in get_facilities_within(latitude, longitude, float(radius))]
+
+    # Full-text search over the facility name, description,
+    # amenities, services and location, best match first
+    return search_facility_ids(rest, limit=SEARCH_RESULT_LIMIT)
+
+
+def get_search_results(key):
+    '''Return the facility ids for a search, from the cache when possible'''
+    facility_ids = search_cache.get(key)
+    if facility_ids is None:
+        facility_ids = run_search(key)
+        if facility_ids is not None:
+            search_cache.set(key, facility_ids)
+    return facility_ids
+
 
 @app.route('/search_facility', methods=['GET', 'POST'])
 def search_facility():
     '''Define the view function for the search facility page'''
+    form = SearchFacilityForm()
     if request.method == 'POST':
-        location = request.form.get('location')
-
-        geocode_url = f'http://api.openweathermap.org/geo/1.0/direct?q={location}&limit=1&appid={OWM_API_KEY}'
-        response = requests.get(geocode_url)
-        if response.status_code == 200:
-            data = response.json()
-            if data:
-                latitude = data[0]['lat']
-                longitude = data[0]['lon']
-
-                facilities = Facility.query.filter_by(location=location).all()
-
-                if not facilities:
-                    flash('No facilities found in this location.', 'danger')
-                    return redirect(url_for('search_facility'))
-                
-                facility_ids = [facility.id for facility in facilities]
-                session['facilities'] = facility_ids
-                return redirect(url_for('search_results'))
-            else:
-                flash('No coordinates found for this location.', 'danger')
-                return redirect(url_for('search_facility'))
-        else:
-            flash('Failed to get coordinates. Please try again.', 'danger')
+        if not form.validate():
+            for name, errors in form.errors.items():
+                for error in errors:
+                    flash(f'{form[name].label.text}: {error}', 'danger')
+            return redirect(url_for('search_facility'))
+
+        # Radius search when a radius is given, full-text search otherwise
+        key = search_cache_key(form.location.data, form.radius.data)
+        facility_ids = get_search_results(key)
+        if facility_ids is None:
             return redirect(url_for('search_facility'))
-    return render_template('dog_owner/home.html')
+
+        if not facility_ids:
+            flash('No facilities found in this location.', 'danger')
+            return redirect(url_for('search_facility'))
+        
+        # Only the short cache key is kept in the session cookie
+        session['search'] = key
+        return redirect(url_for('search_results'))
+    return render_template('dog_owner/home.html', form=form)
 
 
 @app.route('/search_results', methods=['GET', 'POST'])
 def search_results():
     '''Define the view function for the search results page'''
-    facility_ids = session.get('facilities')
+    key = session.get('search')
+    facility_ids = get_search_results(key) if key else None
 
     if not facility_ids:
         return redirect(url_for('search_facility'))
-    # Retrieve facilities from database using stored ids
-    facilities = Facility.query.filter(Facility.id.in_(facility_ids)).all()
-    return render_template('dog_owner/search_results.html', facilities=facilities)
+
+    # Retrieve one page of facilities using the cached ids, keeping their rank
+    page = max(request.args.get('page', 1, type=int), 1)
+    page_ids = facility_ids[(page - 1) * SEARCH_PAGE_SIZE:page * SEARCH_PAGE_SIZE]
+    facilities = Facility.query.filter(Facility.id.in_(page_ids)).all() if page_ids else []
+    facilities.sort(key=lambda facility: page_ids.index(facility.id))
+    total_pages = (len(facility_ids) + SEARCH_PAGE_SIZE - 1) // SEARCH_PAGE_SIZE
+    return render_template('dog_owner/search_results.html', facilities=facilities,
+                           current_page=page, total_pages=total_pages)
 
 
 # --------------------BOOKING--------------------
@@ -677,7 +1140,15 @@ def create_booking():
         if not facility:
             flash('Facility not found. Please try again.', 'danger')
             return redirect(url_for('create_booking'))
-        
+
+        # Take the places first, so a full facility never gets the booking
+        try:
+            reserve(facility, form.check_in.data, form.check_out.data, form.number_of_dogs.data)
+        except FacilityFullError as error:
+            db.session.rollback()
+            flash(f'{facility.name}: {error}. Please choose other dates.', 'danger')
+            return render_template('dog_owner/create_booking.html', form=form)
+
         booking = Booking(check_in=form.check_in.data,
                           check_out=form.check_out.data,
                           issued_by=current_user.id,
@@ -687,67 +1158,17 @@ def create_booking():
                           notes = form.notes.data,
                           number_of_dogs=form.number_of_dogs.data)
         
-        db.session.add(booking)
-        db.session.commit()
-        booking_code = generate_booking_code()
-        booking.booking_code = booking_code
-        db.session.commit()
-        flash('Booking successfully created.', 'success')
-
-        check_in = booking.check_in.strftime('%B %d, %Y')
-        check_out = booking.check_out.strftime('%B %d, %Y')
-
-        services_requested = ''
-        if booking.daycare:
-            services_requested += 'Daycare, '
-        if booking.boarding:
-            services_requested += 'Boarding'
-
-        # Sending email to the user
-        send_notification(
-        booking.user.email,
-        f'Booking Created Successfully! Code #{booking.booking_code}',
-        template=(
-            f'<p> Hi {booking.user.first_name}, </p>'
-            f'<p> You have successfully created a booking at {booking.facility.name} with code #{booking.booking_code}. Below are the details: </p>'
-            f'<h5>Facility Information:</h5>'
-            f'<p> <b>Name:</b> {booking.facility.name} </p>'
-            f'<p> <b>Location:</b> {booking.facility.location} </p>'
-            f'<h2>Booking Details:</h2>'
-            f'<p><b>Booking Reference: </b> { booking.booking_code }</p>'
-            f'<p><b>Service Requested: </b> { services_requested }</p>'
-            f'<p> <b>Check-in:</b> {check_in} </p>'
-            f'<p> <b>Check-out:</b> {check_out} </p>'
-            f'<p> <b>Number of dogs:</b> {booking.number_of_dogs} </p>'
-            f'<p> <b> Special Requests/Notes:</b> { booking.notes } </p>'
-            f'<p> Please check your dashboard for any information that might not be correct. </p>'
-            f'<p> Best regards, </p> <p> The PawsitivelyBooked Team </p>'
-        )
-        )
+        add_with_booking_code(booking)
 
-        # Sending email to the facility owner
-        send_notification(
-        booking.facility.contact_email,
-        f'New Booking Request - Booking Code #{booking.booking_code}',
-        template=(
-            f'<p> Hi {booking.facility.owner.first_name},</p>'
-            f'<p> You have recieved a new  booking for {booking.facility.name} with code #{booking.booking_code}. Below are the details: </p>'
-            f'<h2>Dog Owner Information:</h2>'
-            f'<p> <b>Name:</b> {booking.user.first_name} {booking.user.last_name} </p>'
-            f'<p> <b>Email:</b> {booking.user.email} </p>'
-            f'<p> <b>Phone Number:</b> {booking.user.phone_number} </p>'
-            f'<h2>Booking Details:</h2>'
-            f'<p><b>Booking Reference: </b> { booking.booking_code }</p>'
-            f'<p><b>Service Requested: </b> { services_requested }</p>'
-            f'<p> <b>Check-in:</b> {check_in} </p>'
-            f'<p> <b>Check-out:</b> {check_out} </p>'
-            f'<p> <b>Number of dogs:</b> {booking.number_of_dogs} </p>'
-            f'<p> <b> Special Requests/Notes:</b> { booking.notes } </p>'
-            f'<p> Please check your dashboard to review the request and take action! </p>'
-            f'<p> Best regards, </p> <p> The PawsitivelyBooked Team </p>'
-        )
-        )
+        # Sending emails to the user and the facility owner
+        context = booking_context(booking)
+        send_notification(booking.user.email, 'booking_created_owner', booking.user.first_name, context)
+        send_notification(booking.facility.contact_email, 'booking_created_facility',
+                          booking.facility.owner.first_name, context)
 
+        # Commit the booking and its emails together
+        db.session.commit()
+        flash('Booking successfully created.', 'success')
         return redirect(url_for('dashboard_dog_owner'))
     elif request.method == 'GET':
         form.check_in.data = datetime.now()
@@ -765,6 +1186,144 @@ def create_booking():
 
     return render_template('dog_owner/create_booking.html', form=form)
 
+# Recurring bookings - by dog owners
+# A whole series, e.g. daycare Monday to Friday for 8 weeks, is checked
+# against the capacity in one pass, inserted with one INSERT and announced
+# with one summary email to each side, all in a single transaction.
+# The INSERT skips the mapper events, so the cache versions and the
+# transition deadlines they would record are added here.
+
+RECURRING_MAX_WEEKS = 12
+RECURRING_MAX_NIGHTS = 6
+
+
+def booking_error(message, status=400, **details):
+    '''Return a JSON error response for the booking API'''
+    return jsonify({'error': message, **details}), status
+
+
+def json_integer(data, name, default=None):
+    '''Return a whole number field of a JSON request, raising ValueError for anything else'''
+    value = data.get(name, default)
+    # bool is a subclass of int, and int() would truncate 1.9 to 1
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise ValueError(f'{name} must be a whole number')
+    return value
+
+
+def insert_booking_series(rows):
+    '''Insert new bookings with unique codes in one statement, returning their (id, code, check in, check out)'''
+    statement = insert(Booking).returning(Booking.id, Booking.booking_code, Booking.check_in, Booking.check_out,
+                                          sort_by_parameter_order=True)
+    for attempt in range(BOOKING_CODE_ATTEMPTS):
+        codes = set()
+        while len(codes) < len(rows):
+            codes.add(generate_booking_code())
+        for row, code in zip(rows, codes):
+            row['booking_code'] = code
+        try:
+            with db.session.begin_nested():
+                return db.session.execute(statement, rows).all()
+        except IntegrityError:
+            if attempt == BOOKING_CODE_ATTEMPTS - 1:
+                raise
+            metrics.increment('bookings.code_collisions')
+
+
+@app.route('/dog_owner/recurring_booking', methods=['POST'])
+@login_required
+def create_recurring_booking():
+    '''Define the view function creating a series of bookings from a schedule rule'''
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return booking_error('Expected a JSON object')
+    try:
+        weekdays = parse_weekdays(data.get('days', 'mon-fri'))
+    except ScheduleError as error:
+        return booking_error(str(error))
+    try:
+        facility_id = json_integer(data, 'facility_id')
+        start = date.fromisoformat(data.get('start'))
+        weeks = json_integer(data, 'weeks', 1)
+        nights = json_integer(data, 'nights', 0)
+        number_of_dogs = json_integer(data, 'number_of_dogs', 1)
+    except (TypeError, ValueError):
+        return booking_error('facility_id, weeks, nights and number_of_dogs must be whole numbers and start a date')
+    if start < date.today():
+        return booking_error('Check-in date cannot be in the past')
+    if not 1 <= weeks <= RECURRING_MAX_WEEKS:
+        return booking_error(f'weeks must be between 1 and {RECURRING_MAX_WEEKS}')
+    if not 0 <= nights <= RECURRING_MAX_NIGHTS:
+        return booking_error(f'nights must be between 0 and {RECURRING_MAX_NIGHTS}')
+    if not 1 <= number_of_dogs <= 6:
+        return booking_error('number_of_dogs must be between 1 and 6')
+    daycare = data.get('daycare', nights == 0)
+    boarding = data.get('boarding', nights > 0)
+    if not isinstance(daycare, bool) or not isinstance(boarding, bool):
+        return booking_error('daycare and boarding must be true or false')
+    if not daycare and not boarding:
+        return booking_error('Please select either daycare or boarding')
+    notes = data.get('notes')
+    if notes is not None and not isinstance(notes, str):
+        return booking_error('notes must be text')
+    facility = db.session.get(Facility, facility_id)
+    if facility is None:
+        return booking_error('Facility not found', 404)
+    # The facility owner gets the summary email, so check before taking any places
+    if facility.owner is None:
+        return booking_error(f'{facility.name} is not taking bookings', 409)
+    days = occurrences(start, weekdays, weeks)
+    if not days:
+        return booking_error('The schedule has no days')
+    # Each stay has to end by the next check-in, or the dogs would be booked twice
+    if any((later - earlier).days < nights for earlier, later in zip(days, days[1:])):
+        return booking_error(f'Stays of {nights} nights overlap on this schedule')
+
+    # Take the places of the whole series, or none of them
+    stays = [(datetime.combine(day, datetime.min.time()),
+              datetime.combine(day + timedelta(days=nights), datetime.min.time())) for day in days]
+    dogs_by_day = Counter()
+    for check_in, check_out in stays:
+        for day in booking_days(check_in, check_out):
+            dogs_by_day[day] += number_of_dogs
+    try:
+        reserve_days(facility, dogs_by_day)
+    except FacilityFullError as error:
+        db.session.rollback()
+        return booking_error(f'{facility.name}: {error}', 409, full_days=[day.isoformat() for day in error.days])
+
+    bookings = insert_booking_series([
+        {'check_in': check_in, 'check_out': check_out, 'status': 'pending', 'issued_by': current_user.id,
+         'facility_id': facility.id, 'daycare': daycare, 'boarding': boarding, 'notes': notes,
+         'number_of_dogs': number_of_dogs}
+        for check_in, check_out in stays
+    ])
+    bump_versions(db.session.connection(), [f'user:{current_user.id}', f'facility:{facility.id}'])
+    # Pending bookings are next due at check-out, see booking_deadlines()
+    db.session.info.setdefault('booking_deadlines', []).extend(
+        (check_out, booking_id) for booking_id, _, _, check_out in bookings)
+
+    # One summary email to each side instead of one per booking
+    context = series_context(facility, current_user, [booking[1:] for booking in bookings],
+                             number_of_dogs, notes, daycare, boarding)
+    send_notification(current_user.email, 'booking_series_owner', current_user.first_name, context)
+    send_notification(facility.contact_email, 'booking_series_facility', facility.owner.first_name, context)
+
+    db.session.commit()
+    metrics.increment('bookings.series_created')
+    return jsonify({
+        'facility_id': facility.id,
+        'count': len(bookings),
+        'bookings': [{
+            'id': booking_id,
+            'booking_code': booking_code,
+            'check_in': check_in.isoformat(),
+            'check_out': check_out.isoformat(),
+            'url': url_for('view_booking', booking_id=booking_id)
+        } for booking_id, booking_code, check_in, check_out in bookings]
+    }), 201
+
+
 # --------------------VIEW BOOKING--------------------
 
 @app.route('/dog_owner/view_booking/<int:booking_id>')
@@ -794,42 +1353,14 @@ def cancel_booking(booking_id):
         return redirect(url_for('dashboard_dog_owner'))
     
     booking.updated_at = datetime.now()
-    booking.status = 'cancelled'
+    change_status(booking, 'cancelled')
+
+    context = booking_context(booking)
+    send_notification(booking.user.email, 'booking_cancelled_owner', booking.user.first_name, context)
+    send_notification(booking.facility.contact_email, 'booking_cancelled_facility',
+                      booking.facility.owner.first_name, context)
     db.session.commit()
     flash('Booking successfully cancelled.', 'success')
-
-    check_in = booking.check_in.strftime('%B %d, %Y')
-    check_out = booking.check_out.strftime('%B %d, %Y')
-
-
-    send_notification(
-    booking.user.email,
-    f'Booking #{booking.booking_code} Cancelled',
-    template=(
-        f'<p> Hi {booking.user.first_name}, </p>'
-        f'<p> You have cancelled your booking {booking.facility.name} '
-        f'.</p>'
-        f'<p> <b>Check-in:</b> {check_in} </p>'
-        f'<p> <b>Check-out:</b> {check_out} </p>'
-        f'<p> <b>Number of dogs:</b> {booking.number_of_dogs} </p>'
-        f'<p>Please log in and check your dahsboard for any information might not be correct.</p>'
-        f'<p> Best regards, </p> <p> The PawsitivelyBooked Team </p>'
-    )
-    )
-
-    send_notification(
-    booking.facility.contact_email,
-    f'Booking #{booking.booking_code} Canncelled',
-    template=(
-        f'<p> Hi {booking.facility.owner.first_name},</p>'
-        f'<p> This booking has been cancelled  Booking code #{booking.booking_code}. </p>'
-        f'<p> <b>Check-in:</b> {check_in} </p>'
-        f'<p> <b>Check-out:</b> {check_out} </p>'
-        f'<p> <b>Number of dogs:</b> {booking.number_of_dogs} </p>'
-        f'<p> Please check your dashboard for more details. </p>'
-        f'<p> Best regards, </p> <p> The PawsitivelyBooked Team </p>'
-    )
-    )
     return redirect(url_for('dashboard_dog_owner'))
 
 
@@ -1151,45 +1682,22 @@ def accept_booking(booking_id):
 
     # booking.facility.owner.email = current_user.email
 
-    # Update booking status and commit to the database
+    # Update booking status, committed below with the notifications
+    # A booking declined or cancelled earlier has to fit again
+    try:
+        change_status(booking, 'accepted')
+    except FacilityFullError as error:
+        db.session.rollback()
+        flash(f'This booking no longer fits: {error}.', 'danger')
+        return redirect(url_for('dashboard_facility_owner'))
     booking.updated_at = datetime.now()
-    booking.status = 'accepted'
-    db.session.commit()
-
-    # Format the dates for the notification messages
-    check_in = booking.check_in.strftime('%B %d, %Y')
-    check_out = booking.check_out.strftime('%B %d, %Y')
 
-    # Send notification to the user
-    send_notification(
-        booking.user.email,
-        f'Your Booking is Now Confirmed #ID {booking.booking_code} - Thank you!',
-        template=(
-            f'<p> Hi {booking.user.first_name}, </p>'
-            f'<p> We are pleased to inform you that your booking at {booking.facility.name} '
-            f'has been successfully accepted. </p>'
-            f'<p> <b>Check-in:</b> {check_in} </p>'
-            f'<p> <b>Check-out:</b> {check_out} </p>'
-            f'<p> <b>Number of dogs:</b> {booking.number_of_dogs} </p>'
-            f'<p> Thank you for using our services. We look forward to seeing you soon! </p>'
-            f'<p> Best regards, </p> <p> The PawsitivelyBooked Team </p>'
-        )
-    )
-
-    # Send notification to the facility owner
-    send_notification(
-        booking.facility.contact_email,
-        f'New Booking Confirmed - Booking ID #{booking.booking_code}',
-        template=(
-            f'<p> Hi {booking.facility.owner.first_name}, </p>'
-            f'<p> You have accepted a booking for {booking.facility.name} with ID #{booking.booking_code}. </p>'
-            f'<p> <b>Check-in:</b> {check_in} </p>'
-            f'<p> <b>Check-out:</b> {check_out} </p>'
-            f'<p> <b>Number of dogs:</b> {booking.number_of_dogs} </p>'
-            f'<p> Please check your dashboard for more details. </p>'
-            f'<p> Best regards, </p> <p> The PawsitivelyBooked Team </p>'
-        )
-    )
+    # Send notifications to the user and the facility owner
+    context = booking_context(booking)
+    send_notification(booking.user.email, 'booking_accepted_owner', booking.user.first_name, context)
+    send_notification(booking.facility.contact_email, 'booking_accepted_facility',
+                      booking.facility.owner.first_name, context)
+    db.session.commit()
 
     flash('Booking successfully accepted.', 'success')
     return redirect(url_for('dashboard_facility_owner'))
@@ -1208,14 +1716,11 @@ def decline_booking(booking_id):
         return redirect(url_for('dashboard_facility_owner'))
     
     booking.updated_at = datetime.now()
-    booking.status = 'declined'
-    db.session.commit()
+    change_status(booking, 'declined')
 
-    check_in = booking.check_in.strftime('%B %d, %Y')
-    check_out = booking.check_out.strftime('%B %d, %Y')
-    send_notification(booking.user.email,
-                        f'Your Booking Has Been Declined #{booking.booking_code}',
-                        template=f'<p> Hi {booking.user.first_name}, </p> <p> We regret to inform you that your booking at {booking.facility.name} has been declined. </p> <p> Here are the details of your booking: </p> <p> <b>Check-in: </b> {check_in} </p> <p> <b>Check-out: </b> {check_out} </p> <p> <b>Number of dogs: </b>{booking.number_of_dogs} </p><p><b> Facility: </b>{booking.facility.name} </p> <p> We apologize for any inconvenience this may have caused. Please feel free to contact us for further assistance. </p> <p> Best regards, </p> <p> The PawsitivelyBooked Team </p>')
+    send_notification(booking.user.email, 'booking_declined_owner', booking.user.first_name,
+                      booking_context(booking))
+    db.session.commit()
     flash('Booking successfully declined.', 'warning')
     return redirect(url_for('dashboard_facility_owner'))
 
@@ -1244,6 +1749,56 @@ def view_facility(facility_id):
     return render_template('dog_owner/view_facility.html', facility=facility, owner=owner, facility_pictures_path=facility_pictures_path)
 
 
+# Remaining places per day for the booking calendar, read from the
+# facility_occupancy counters. The ETag is the facility's occupancy version,
+# so a widget polling an unchanged calendar gets a 304 after one primary key
+# lookup instead of the day rows.
+
+AVAILABILITY_DAYS = 31
+AVAILABILITY_MAX_DAYS = 93
+
+
+def parse_day(value, default):
+    '''Parse an ISO date query argument, aborting with 400 if it is invalid'''
+    if not value:
+        return default
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        abort(400)
+
+
+@app.route('/facility/<int:facility_id>/availability')
+@login_required
+def facility_availability(facility_id):
+    '''Define the view function returning a facility's remaining places per day'''
+    first = parse_day(request.args.get('from'), date.today())
+    last = parse_day(request.args.get('to'), first + timedelta(days=AVAILABILITY_DAYS - 1))
+    if last < first or (last - first).days >= AVAILABILITY_MAX_DAYS:
+        abort(400)
+    state = availability_state(facility_id)
+    if state is None:
+        abort(404)
+    capacity, version = state
+    etag = f'{facility_id}.{version}.{capacity}.{first.isoformat()}.{last.isoformat()}'
+    if request.if_none_match.contains(etag):
+        metrics.increment('availability.not_modified')
+        response = app.response_class(status=304)
+    else:
+        response = jsonify({
+            'facility_id': facility_id,
+            'capacity': capacity,
+            'from': first.isoformat(),
+            'to': last.isoformat(),
+            'days': [{'date': day.isoformat(), 'booked': booked, 'remaining': remaining}
+                     for day, booked, remaining in remaining_places(facility_id, capacity, first, last)]
+        })
+    response.set_etag(etag)
+    # Cache it, but check with the server before every reuse
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
 
 #------------------SET LOCATION--------------------
 
@@ -1407,6 +1962,19 @@ def facilty_reviews(facility_id):
     )
 
 
+# --------------------METRICS--------------------
+
+# In-process metrics for this worker, see metrics.py
+# Only served when METRICS_ENABLED is set
+
+@app.route('/metrics')
+def show_metrics():
+    '''Return the metrics of this worker as JSON'''
+    if not app.config['METRICS_ENABLED']:
+        abort(404)
+    return jsonify(metrics.snapshot())
+
+
 # --------------------LOGOUT--------------------
 
 @app.route('/logout')
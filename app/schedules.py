@@ -0,0 +1,45 @@
+'''Schedule rules for recurring bookings'''
+
+from datetime import timedelta
+
+
+# A recurring booking repeats on some days of the week for a number of
+# weeks, e.g. Monday to Friday for 8 weeks from a start date. The days are
+# written as names or ranges of names, such as "mon-fri" or
+# ["mon", "wed", "fri"].
+
+WEEKDAYS = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+
+
+class ScheduleError(ValueError):
+    '''Raised when a schedule rule is not valid'''
+
+
+def parse_weekdays(days):
+    '''Return the sorted weekday numbers (Monday is 0) of a days rule'''
+    if isinstance(days, str):
+        days = days.split(',')
+    elif not isinstance(days, list):
+        raise ScheduleError('days must be a name, a range of names or a list of them')
+    weekdays = set()
+    for part in days:
+        if not isinstance(part, str):
+            raise ScheduleError(f'Unknown day: {part}')
+        first, _, last = part.strip().lower().partition('-')
+        try:
+            start = WEEKDAYS.index(first[:3])
+            end = WEEKDAYS.index(last[:3]) if last else start
+        except ValueError:
+            raise ScheduleError(f'Unknown day: {part}') from None
+        if end < start:
+            raise ScheduleError(f'Day range goes backwards: {part}')
+        weekdays.update(range(start, end + 1))
+    if not weekdays:
+        raise ScheduleError('No days given')
+    return sorted(weekdays)
+
+
+def occurrences(start, weekdays, weeks):
+    '''Return the days on the given weekdays in the weeks from start'''
+    return [start + timedelta(days=offset) for offset in range(weeks * 7)
+            if (start + timedelta(days=offset)).weekday() in weekdays]
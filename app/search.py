@@ -0,0 +1,142 @@
+'''Full-text search over facilities'''
+
+import re
+from sqlalchemy import event, text, inspect
+from app import db
+from app.models import Facility
+
+
+# Indexed facility columns and their ranking weights
+# SQLite uses an FTS5 table ranked with bm25(), kept in sync by the mapper
+# events below. Postgres uses a generated tsvector column with a GIN index,
+# ranked with ts_rank_cd(), which the database keeps in sync itself.
+
+SEARCH_COLUMNS = ('name', 'description', 'amenities', 'services', 'location')
+SEARCH_WEIGHTS = (10.0, 2.0, 1.0, 1.0, 4.0)
+POSTGRES_WEIGHTS = ('A', 'C', 'D', 'D', 'B')
+
+
+def _create_sqlite(connection):
+    connection.execute(text(
+        'CREATE VIRTUAL TABLE IF NOT EXISTS facility_fts USING fts5('
+        + ', '.join(SEARCH_COLUMNS) + ", tokenize='porter unicode61')"
+    ))
+
+
+def _create_postgres(connection):
+    vector = ' || '.join(
+        f"setweight(to_tsvector('english', coalesce({column}, '')), '{weight}')"
+        for column, weight in zip(SEARCH_COLUMNS, POSTGRES_WEIGHTS)
+    )
+    connection.execute(text(
+        f'ALTER TABLE facility ADD COLUMN IF NOT EXISTS search_vector tsvector '
+        f'GENERATED ALWAYS AS ({vector}) STORED'
+    ))
+    connection.execute(text(
+        'CREATE INDEX IF NOT EXISTS ix_facility_search_vector ON facility USING gin (search_vector)'
+    ))
+
+
+def create_search_index(connection):
+    '''Create the search index for the connection's database'''
+    if connection.dialect.name == 'sqlite':
+        _create_sqlite(connection)
+    elif connection.dialect.name == 'postgresql':
+        _create_postgres(connection)
+
+
+def drop_search_index(connection):
+    '''Drop the search index for the connection's database'''
+    if connection.dialect.name == 'sqlite':
+        connection.execute(text('DROP TABLE IF EXISTS facility_fts'))
+    elif connection.dialect.name == 'postgresql':
+        connection.execute(text('DROP INDEX IF EXISTS ix_facility_search_vector'))
+        connection.execute(text('ALTER TABLE facility DROP COLUMN IF EXISTS search_vector'))
+
+
+def rebuild_search_index(connection):
+    '''Re-index every facility, used after creating the index'''
+    if connection.dialect.name != 'sqlite':
+        return
+    columns = ', '.join(SEARCH_COLUMNS)
+    connection.execute(text('DELETE FROM facility_fts'))
+    connection.execute(text(
+        f'INSERT INTO facility_fts (rowid, {columns}) SELECT id, {columns} FROM facility'
+    ))
+
+
+# Create and drop the index along with the tables, e.g. in the tests
+event.listen(Facility.__table__, 'after_create', lambda target, connection, **kw: create_search_index(connection))
+event.listen(Facility.__table__, 'before_drop', lambda target, connection, **kw: drop_search_index(connection))
+
+
+# --------------------SQLITE SYNC--------------------
+
+def _index_facility(connection, facility):
+    values = {column: getattr(facility, column) for column in SEARCH_COLUMNS}
+    columns = ', '.join(SEARCH_COLUMNS)
+    placeholders = ', '.join(f':{column}' for column in SEARCH_COLUMNS)
+    connection.execute(text('DELETE FROM facility_fts WHERE rowid = :id'), {'id': facility.id})
+    connection.execute(
+        text(f'INSERT INTO facility_fts (rowid, {columns}) VALUES (:id, {placeholders})'),
+        dict(values, id=facility.id)
+    )
+
+
+@event.listens_for(Facility, 'after_insert')
+def facility_inserted(mapper, connection, target):
+    '''Index a new facility'''
+    if connection.dialect.name == 'sqlite':
+        _index_facility(connection, target)
+
+
+@event.listens_for(Facility, 'after_update')
+def facility_updated(mapper, connection, target):
+    '''Re-index a facility when one of its searchable columns changed'''
+    if connection.dialect.name != 'sqlite':
+        return
+    state = inspect(target)
+    if any(state.attrs[column].history.has_changes() for column in SEARCH_COLUMNS):
+        _index_facility(connection, target)
+
+
+@event.listens_for(Facility, 'after_delete')
+def facility_deleted(mapper, connection, target):
+    '''Remove a deleted facility from the index'''
+    if connection.dialect.name == 'sqlite':
+        connection.execute(text('DELETE FROM facility_fts WHERE rowid = :id'), {'id': target.id})
+
+
+# --------------------QUERIES--------------------
+
+def _fts5_query(query):
+    '''Turn user input into an FTS5 query matching every word as a prefix'''
+    words = re.findall(r'\w+', query.lower())
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def search_facility_ids(query, limit=100):
+    '''Return the ids of the facilities matching query, best match first'''
+    connection = db.session.connection()
+    if connection.dialect.name == 'sqlite':
+        match = _fts5_query(query)
+        if not match:
+            return []
+        weights = ', '.join(str(weight) for weight in SEARCH_WEIGHTS)
+        rows = connection.execute(text(
+            f'SELECT rowid FROM facility_fts WHERE facility_fts MATCH :match '
+            f'ORDER BY bm25(facility_fts, {weights}) LIMIT :limit'
+        ), {'match': match, 'limit': limit})
+    elif connection.dialect.name == 'postgresql':
+        rows = connection.execute(text(
+            "SELECT id FROM facility, websearch_to_tsquery('english', :query) AS query "
+            'WHERE search_vector @@ query '
+            'ORDER BY ts_rank_cd(search_vector, query) DESC LIMIT :limit'
+        ), {'query': query, 'limit': limit})
+    else:
+        # Other databases fall back to a substring match
+        pattern = f'%{query}%'
+        rows = db.session.query(Facility.id).filter(
+            db.or_(*[getattr(Facility, column).ilike(pattern) for column in SEARCH_COLUMNS])
+        ).limit(limit)
+    return [row[0] for row in rows]
@@ -0,0 +1,131 @@
+'''Local SMTP server for tests and benchmarks'''
+
+import time
+import threading
+import socketserver
+from email import message_from_bytes
+from types import SimpleNamespace
+
+
+# Speaks just enough SMTP for smtplib and Flask-Mail: EHLO/HELO, MAIL,
+# RCPT, DATA, RSET, NOOP and QUIT. Point MAIL_SERVER and MAIL_PORT at it
+# with MAIL_USE_SSL and MAIL_USE_TLS off.
+
+class StubSMTPServer:
+    '''SMTP server on localhost that records every message it receives
+
+    fail(count) makes the next count messages fail with a temporary 451
+    reply, delay adds latency before every reply, connect_delay adds the
+    cost of a TLS handshake and login to every new connection, and
+    drop_after closes each connection with a 421 after that many messages.
+    '''
+
+    def __init__(self, host='127.0.0.1', port=0, delay=0, connect_delay=0, drop_after=None):
+        self.messages = []
+        self.connections = 0
+        self.delay = delay
+        self.connect_delay = connect_delay
+        self.drop_after = drop_after
+        self._failures = 0
+        self._lock = threading.Lock()
+        self._server = socketserver.ThreadingTCPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self.host, self.port = self._server.server_address
+        self._thread = None
+
+    def start(self):
+        '''Serve in a background thread'''
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        '''Stop serving and close the socket'''
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def fail(self, count=1):
+        '''Reject the next count messages with a temporary error'''
+        with self._lock:
+            self._failures += count
+
+    def _take_failure(self):
+        with self._lock:
+            if self._failures:
+                self._failures -= 1
+                return True
+            return False
+
+    def _record(self, sender, recipients, data):
+        message = message_from_bytes(data)
+        with self._lock:
+            self.messages.append(SimpleNamespace(sender=sender, recipients=recipients,
+                                                 subject=message['Subject'], data=data))
+
+    def _handler(self):
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            disable_nagle_algorithm = True
+
+            def reply(self, line):
+                if server.delay:
+                    time.sleep(server.delay)
+                self.wfile.write(line.encode() + b'\r\n')
+
+            def handle(self):
+                with server._lock:
+                    server.connections += 1
+                if server.connect_delay:
+                    time.sleep(server.connect_delay)
+                self.reply('220 localhost stub SMTP ready')
+                sender, recipients = None, []
+                received = 0
+                for raw in self.rfile:
+                    command = raw.decode('utf-8', 'replace').strip()
+                    verb = command[:4].upper()
+                    if verb == 'EHLO':
+                        self.reply('250-localhost')
+                        self.reply('250 8BITMIME')
+                    elif verb == 'HELO':
+                        self.reply('250 localhost')
+                    elif verb == 'MAIL':
+                        if server.drop_after is not None and received >= server.drop_after:
+                            self.reply('421 Too many messages, closing connection')
+                            return
+                        if server._take_failure():
+                            self.reply('451 Temporary failure, try again later')
+                            continue
+                        sender, recipients = command[10:].strip(' <>').split('>')[0], []
+                        self.reply('250 OK')
+                    elif verb == 'RCPT':
+                        recipients.append(command[8:].strip(' <>'))
+                        self.reply('250 OK')
+                    elif verb == 'DATA':
+                        self.reply('354 End data with <CR><LF>.<CR><LF>')
+                        lines = []
+                        for line in self.rfile:
+                            if line in (b'.\r\n', b'.\n'):
+                                break
+                            lines.append(line[1:] if line.startswith(b'..') else line)
+                        server._record(sender, recipients, b''.join(lines))
+                        received += 1
+                        self.reply('250 OK')
+                    elif verb == 'RSET':
+                        sender, recipients = None, []
+                        self.reply('250 OK')
+                    elif verb == 'NOOP':
+                        self.reply('250 OK')
+                    elif verb == 'QUIT':
+                        self.reply('221 Bye')
+                        return
+                    else:
+                        self.reply('502 Command not implemented')
+
+        return Handler
@@ -0,0 +1,124 @@
+'''Timer-driven booking status transitions'''
+
+import heapq
+import threading
+from datetime import datetime, timedelta
+from app import app, metrics
+
+
+# Bookings change status at their check-in and check-out times. Instead of
+# rescanning the table, TransitionTimer keeps a heap of the (due, booking id)
+# deadlines in the next TRANSITION_HORIZON seconds and fires each one when
+# it's due. Every TRANSITION_REFRESH seconds the heap is refilled with the
+# deadlines from the previous refill onwards, which picks up bookings changed
+# by other processes, and changes committed in this process are pushed as
+# soon as they commit (see routes.py). The periodic update_bookings() sweep
+# reconciles anything the timer missed.
+
+class TransitionTimer:
+    '''Heap of booking deadlines fired from a background thread
+
+    load(start, end) returns the (due, booking id) deadlines in (start, end],
+    or every deadline up to end when start is None. fire(now, booking ids)
+    applies the transitions that are due.
+    '''
+
+    def __init__(self, load, fire, horizon=None, refresh=None):
+        self.load = load
+        self.fire = fire
+        self.horizon = timedelta(seconds=horizon or app.config['TRANSITION_HORIZON'])
+        self.refresh = timedelta(seconds=refresh or app.config['TRANSITION_REFRESH'])
+        self.loaded_until = None
+        self._refilled_at = None
+        self._heap = []
+        self._queued = set()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopped = False
+
+    def __len__(self):
+        return len(self._heap)
+
+    def add(self, due, booking_id):
+        '''Queue a deadline if it falls inside the loaded horizon'''
+        with self._condition:
+            if self.loaded_until is None or due > self.loaded_until or (due, booking_id) in self._queued:
+                return
+            self._queued.add((due, booking_id))
+            heapq.heappush(self._heap, (due, booking_id))
+            self._condition.notify()
+
+    def refill(self, now):
+        '''Load the deadlines from the last refill up to now + horizon'''
+        end = now + self.horizon
+        deadlines = self.load(self._refilled_at, end)
+        with self._condition:
+            self._refilled_at = now
+            self.loaded_until = end
+        for due, booking_id in deadlines:
+            self.add(due, booking_id)
+        metrics.set_gauge('transitions.queued', len(self._heap))
+
+    def pop_due(self, now):
+        '''Remove and return the deadlines due by now'''
+        due = []
+        with self._condition:
+            while self._heap and self._heap[0][0] <= now:
+                entry = heapq.heappop(self._heap)
+                self._queued.discard(entry)
+                due.append(entry)
+        return due
+
+    def run_due(self, now):
+        '''Fire every deadline due by now, returning the number fired'''
+        due = self.pop_due(now)
+        if not due:
+            return 0
+        for deadline, _ in due:
+            metrics.observe('transitions.lag', (now - deadline).total_seconds())
+        self.fire(now, sorted({booking_id for _, booking_id in due}))
+        metrics.increment('transitions.fired', len(due))
+        return len(due)
+
+    def _next_wake(self, now):
+        wake = self._refilled_at + self.refresh
+        if self._heap:
+            wake = min(wake, self._heap[0][0])
+        return max((wake - now).total_seconds(), 0)
+
+    def _run(self):
+        while not self._stopped:
+            now = datetime.now()
+            try:
+                if self._refilled_at is None or now >= self._refilled_at + self.refresh:
+                    self.refill(now)
+                self.run_due(now)
+            except Exception:
+                # The reconciliation sweep picks up whatever failed here
+                app.logger.exception('Booking transition timer failed')
+                if self._refilled_at is None:
+                    self._refilled_at = now
+            with self._condition:
+                if not self._stopped:
+                    self._condition.wait(self._next_wake(datetime.now()))
+
+    def start(self):
+        '''Run the timer in a daemon thread, loading every deadline afresh'''
+        if self._thread is not None:
+            return self
+        with self._condition:
+            self._stopped = False
+            self._heap, self._queued = [], set()
+            self.loaded_until = self._refilled_at = None
+        self._thread = threading.Thread(target=self._run, name='transition-timer', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        '''Stop the timer thread'''
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
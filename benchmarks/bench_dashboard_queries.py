@@ -0,0 +1,115 @@
+'''
+    Benchmark: dashboard booking queries with and without the composite indexes.
+    Prints the SQLite query plans and timings for the original three dog owner
+    queries, the single partitioned query, and the facility owner query.
+    Run from the project root with: python -m benchmarks.bench_dashboard_queries
+'''
+
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+os.environ.setdefault('FLASK_ENV', 'testing')
+
+from sqlalchemy import text
+from sqlalchemy.dialects import sqlite
+from app import app, db
+from app.models import Booking
+from app.routes import upcoming_booking_filter, history_booking_filter, ongoing_booking_filter
+
+
+USERS = 2_000
+FACILITIES = 200
+BOOKINGS = 200_000
+STATUSES = ['pending', 'accepted', 'declined', 'cancelled', 'ongoing', 'completed', 'expired']
+INDEXES = {
+    'ix_booking_issued_by_status_check_in': 'booking (issued_by, status, check_in)',
+    'ix_booking_facility_id_status_check_in': 'booking (facility_id, status, check_in)',
+}
+
+
+def populate(seed=42):
+    '''Insert random bookings spread over the last and next year'''
+    rng = random.Random(seed)
+    now = datetime.now()
+    rows = []
+    for _ in range(BOOKINGS):
+        check_in = now + timedelta(days=rng.uniform(-365, 365))
+        rows.append({'issued_by': rng.randint(1, USERS), 'facility_id': rng.randint(1, FACILITIES),
+                     'status': rng.choice(STATUSES), 'check_in': check_in,
+                     'check_out': check_in + timedelta(days=rng.randint(1, 14))})
+    db.session.execute(Booking.__table__.insert(), rows)
+    db.session.commit()
+
+
+def dog_owner_queries(user_id, now):
+    '''The original dashboard: one query per category'''
+    return [Booking.query.filter(Booking.issued_by == user_id, condition(now))
+            for condition in (upcoming_booking_filter, history_booking_filter, ongoing_booking_filter)]
+
+
+def dog_owner_query(user_id, now):
+    '''The partitioned dashboard: every category in one query'''
+    return [Booking.query.filter(Booking.issued_by == user_id,
+                                 db.or_(upcoming_booking_filter(now), history_booking_filter(now),
+                                        ongoing_booking_filter(now)))]
+
+
+def facility_owner_query(facility_id, now):
+    '''Pending requests for a facility'''
+    return [Booking.query.filter(Booking.facility_id == facility_id, Booking.status == 'pending')]
+
+
+def compile_query(query):
+    return str(query.statement.compile(dialect=sqlite.dialect(), compile_kwargs={'literal_binds': True}))
+
+
+def explain(queries):
+    '''Return the query plan of each query'''
+    plans = []
+    for query in queries:
+        rows = db.session.execute(text('EXPLAIN QUERY PLAN ' + compile_query(query))).all()
+        plans.append('; '.join(row[-1] for row in rows))
+    return plans
+
+
+def timed(build, ids, now):
+    '''Return the average wall time of running the queries for every id'''
+    start = time.perf_counter()
+    for id in ids:
+        for query in build(id, now):
+            query.all()
+    return (time.perf_counter() - start) / len(ids)
+
+
+def run(label, now, ids):
+    print(f'--- {label} ---')
+    for name, build in (('dog owner, 3 queries', dog_owner_queries),
+                        ('dog owner, 1 query', dog_owner_query),
+                        ('facility owner requests', facility_owner_query)):
+        for plan in explain(build(1, now)):
+            print(f'{name:>24}: {plan}')
+        print(f'{name:>24}: {timed(build, ids, now) * 1000:.3f} ms per dashboard')
+
+
+def main():
+    with app.app_context():
+        db.create_all()
+        populate()
+        now = datetime.now()
+        ids = random.Random(1).sample(range(1, FACILITIES + 1), 100)
+
+        for name in INDEXES:
+            db.session.execute(text(f'DROP INDEX {name}'))
+        db.session.execute(text('ANALYZE'))
+        run('without the composite indexes', now, ids)
+
+        for name, columns in INDEXES.items():
+            db.session.execute(text(f'CREATE INDEX {name} ON {columns}'))
+        db.session.execute(text('ANALYZE'))
+        run('with the composite indexes', now, ids)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+'''
+    Micro-benchmark: per-row geodesic distances vs the batch distance engine.
+    Run from the project root with: python -m benchmarks.bench_distance
+'''
+
+import os
+import random
+import time
+from types import SimpleNamespace
+
+os.environ.setdefault('FLASK_ENV', 'testing')
+
+from app.geo import batch_distances
+from app.routes import calculate_distance
+
+
+SIZES = [1_000, 10_000, 100_000]
+USER = SimpleNamespace(latitude=-26.2041, longitude=28.0473)
+
+
+def make_facilities(count, seed=42):
+    '''Create facilities scattered around the user'''
+    rng = random.Random(seed)
+    return [SimpleNamespace(latitude=USER.latitude + rng.uniform(-5, 5),
+                            longitude=USER.longitude + rng.uniform(-5, 5))
+            for _ in range(count)]
+
+
+def per_row(facilities):
+    '''The original path: one geopy geodesic call per facility'''
+    return [calculate_distance(facility, USER) for facility in facilities]
+
+
+def batched(facilities):
+    '''The batch path: one vectorized haversine over all facilities'''
+    latitudes = [facility.latitude for facility in facilities]
+    longitudes = [facility.longitude for facility in facilities]
+    return batch_distances(USER.latitude, USER.longitude, latitudes, longitudes)
+
+
+def best_of(func, facilities, repeat):
+    '''Return the best wall time of several runs'''
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(facilities)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    print(f'{"facilities":>10} {"per-row (s)":>12} {"batch (s)":>10} {"speed-up":>9}')
+    for size in SIZES:
+        facilities = make_facilities(size)
+        slow = best_of(per_row, facilities, repeat=1 if size >= 100_000 else 3)
+        fast = best_of(batched, facilities, repeat=5)
+        print(f'{size:>10} {slow:>12.4f} {fast:>10.4f} {slow / fast:>8.0f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+'''
+    Benchmark: one SMTP connection per message (mail.send) vs the batched
+    MailDispatcher reusing connections, against the local stub SMTP server.
+    connect_delay stands in for the TLS handshake and login of a real server.
+    Run from the project root with: python -m benchmarks.bench_mail_dispatch
+'''
+
+import os
+import time
+
+os.environ.setdefault('FLASK_ENV', 'testing')
+
+from app import app, mail, Message
+from app.mailer import MailDispatcher
+from app.smtp_stub import StubSMTPServer
+
+
+COUNTS = [100, 500]
+LATENCIES = [(0, 0), (0.0005, 0.02)]
+
+
+def messages(count):
+    return [Message(f'Message {number}', sender='noreply@example.com', html='<p>Hi</p>',
+                    recipients=[f'owner{number}@example.com']) for number in range(count)]
+
+
+def per_message(batch):
+    '''The original path: mail.send opens a connection for every message'''
+    with app.app_context():
+        for message in batch:
+            mail.send(message)
+
+
+def batched(batch):
+    '''The new path: messages share connections'''
+    MailDispatcher().send_all(batch)
+
+
+def timed(func, count, server):
+    batch = messages(count)
+    connections = server.connections
+    start = time.perf_counter()
+    func(batch)
+    return time.perf_counter() - start, server.connections - connections
+
+
+def main():
+    print(f'{"messages":>9} {"reply/connect (ms)":>19} {"per-message msg/s":>18} {"batched msg/s":>14} '
+          f'{"connections":>12} {"speed-up":>9}')
+    for delay, connect_delay in LATENCIES:
+        with StubSMTPServer(delay=delay, connect_delay=connect_delay) as server:
+            app.config.update(MAIL_SERVER=server.host, MAIL_PORT=server.port, MAIL_USE_SSL=False,
+                              MAIL_USE_TLS=False, MAIL_SUPPRESS_SEND=False)
+            mail.init_app(app)
+            for count in COUNTS:
+                slow, slow_connections = timed(per_message, count, server)
+                fast, fast_connections = timed(batched, count, server)
+                print(f'{count:>9} {f"{delay * 1000:g}/{connect_delay * 1000:g}":>19} {count / slow:>18.0f} '
+                      f'{count / fast:>14.0f} {f"{slow_connections}->{fast_connections}":>12} '
+                      f'{slow / fast:>8.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+'''
+    Benchmark: CPU time per completion email, for the original per-booking
+    path (ORM objects, inline f-strings, one outbox object per email) vs
+    notify_completed_bookings() (selected columns, precompiled templates
+    rendered in bulk, one INSERT per chunk).
+    Run from the project root with: python -m benchmarks.bench_notifications
+'''
+
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+os.environ.setdefault('FLASK_ENV', 'testing')
+
+from sqlalchemy.orm import joinedload
+from app import app, db
+from app.models import User, Facility, Booking, OutboxMessage
+from app.outbox import enqueue
+from app.routes import notify_completed_bookings
+
+
+SIZES = [1_000, 10_000]
+FACILITIES = 100
+
+
+def populate(count, seed=42):
+    '''Insert users, facilities and completed bookings'''
+    rng = random.Random(seed)
+    db.session.execute(User.__table__.insert(), [
+        {'first_name': f'User {number}', 'last_name': 'Smith', 'email': f'user{number}@example.com',
+         'user_type': 'facility_owner' if number < FACILITIES else 'dog_owner'}
+        for number in range(count // 10 + FACILITIES)
+    ])
+    db.session.execute(Facility.__table__.insert(), [
+        {'name': f'Facility {number}', 'owner_id': number + 1, 'location': 'Cape Town'} for number in range(FACILITIES)
+    ])
+    now = datetime.now()
+    db.session.execute(Booking.__table__.insert(), [
+        {'issued_by': rng.randint(FACILITIES + 1, count // 10 + FACILITIES), 'facility_id': rng.randint(1, FACILITIES),
+         'status': 'completed', 'booking_code': f'{number:08d}', 'number_of_dogs': rng.randint(1, 3),
+         'check_in': now - timedelta(days=3), 'check_out': now - timedelta(days=1), 'daycare': True}
+        for number in range(count)
+    ])
+    db.session.commit()
+    return [row[0] for row in db.session.query(Booking.id)]
+
+
+def original(booking_ids, chunk_size=500):
+    '''The old path: load every booking and build each body with f-strings'''
+    for start in range(0, len(booking_ids), chunk_size):
+        bookings = Booking.query.options(
+            joinedload(Booking.user), joinedload(Booking.facility).joinedload(Facility.owner)
+        ).filter(Booking.id.in_(booking_ids[start:start + chunk_size])).all()
+        for booking in bookings:
+            check_in = booking.check_in.strftime('%B %d, %Y')
+            check_out = booking.check_out.strftime('%B %d, %Y')
+            enqueue(booking.user.email, f'Your Booking #{booking.booking_code} is Now Complete - Thank you!',
+                    (f'<p> Hi {booking.user.first_name}, </p>'
+                     f'<p>We hope your furry friend enjoyed their stay with us! We are writing to let you know that your booking at {booking.facility.name} has been successfully completed. </p>'
+                     f'<p> Here are the datails of your booking: </p>'
+                     f'<p> <b>Check-in: </b> {check_in} </p>'
+                     f'<p> <b>Check-out: </b> {check_out} </p>'
+                     f'<p> <b>Number of dogs: </b>{booking.number_of_dogs} </p>'
+                     f'<p><b> Facility: </b>{booking.facility.name} </p>'
+                     f'<p>We would love to hear about your experience. Your feedback helps us improve and continue providing the best care for your beloved pet.</p>'
+                     f'<p> Thank you for using our services. We look forward to seeing you again soon! </p>'
+                     f'<p> Best regards, </p>'
+                     f'<p> The PawsitivelyBooked Team </p>'), sender='pawsitivelybookings@gmail.com')
+            enqueue(booking.facility.owner.email,
+                    'Booking Completion Notification - Booking Code #{}'.format(booking.booking_code),
+                    (f"<p> Hi {booking.facility.owner.first_name}, </p>"
+                     f'<p> This is a notification to inform you that the booking with Code #{booking.booking_code} for {booking.user.first_name }at your facility, {booking.facility.name}, has been successfully completed as of {booking.check_out}</p>'
+                     f'<p> Here are the details of the booking: </p>'
+                     f'<p> <b>Check-in: </b> {check_in} </p>'
+                     f'<p> <b>Check-out: </b> {check_out} </p>'
+                     f'<p> <b>Number of dogs: </b>{booking.number_of_dogs} </p>'
+                     f'<p><b> Facility: </b>{booking.facility.name} </p>'
+                     f'<p> Thank you for your attention to this booking. Your dedication to providing excellent service is greatly appreciated. </p>'
+                     f'<p> Best regards, </p>'
+                     f'<p> The PawsitivelyBooked Team </p>'), sender='pawsitivelybookings@gmail.com')
+
+
+def cpu_per_message(func, booking_ids):
+    '''Return the CPU microseconds per queued email, flush included'''
+    db.session.expunge_all()
+    start = time.process_time()
+    func(booking_ids)
+    db.session.flush()
+    elapsed = time.process_time() - start
+    messages = db.session.query(OutboxMessage).count()
+    db.session.rollback()
+    return elapsed / messages * 1e6
+
+
+def main():
+    print(f'{"bookings":>9} {"original (us/msg)":>18} {"templates (us/msg)":>19} {"speed-up":>9}')
+    for size in SIZES:
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+            booking_ids = populate(size)
+            slow = cpu_per_message(original, booking_ids)
+            fast = cpu_per_message(notify_completed_bookings, booking_ids)
+            print(f'{size:>9} {slow:>18.1f} {fast:>19.1f} {slow / fast:>8.1f}x')
+            db.session.remove()
+
+
+if __name__ == '__main__':
+    main()
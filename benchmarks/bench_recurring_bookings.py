@@ -0,0 +1,94 @@
+'''
+    Benchmark: booking a weekday daycare series one create_booking() POST
+    at a time vs a single POST to the recurring booking endpoint. Reports
+    the wall time, SQL statements, commits and queued emails per series.
+    Run from the project root with: python -m benchmarks.bench_recurring_bookings
+'''
+
+import os
+import time
+from datetime import date, timedelta
+
+os.environ.setdefault('FLASK_ENV', 'testing')
+
+from flask import g
+from sqlalchemy import event
+from app import app, db
+from app.models import DogOwner, FacilityOwner, Facility, Booking, OutboxMessage
+from app.schedules import occurrences
+
+
+WEEKS = [2, 8]
+
+
+def populate():
+    '''Insert a dog owner and a facility, returning their ids'''
+    owner = FacilityOwner(first_name='Alex', email='alex@example.com')
+    client = DogOwner(first_name='Sam', email='sam@example.com')
+    db.session.add_all([owner, client])
+    db.session.commit()
+    facility = Facility(name='Pet Palace', owner_id=owner.id, capacity=20, contact_email='palace@example.com')
+    db.session.add(facility)
+    db.session.commit()
+    return client.id, facility.id
+
+
+def login(test_client, user_id):
+    g.pop('_login_user', None)
+    with test_client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+
+
+def one_by_one(test_client, facility_id, start, weeks):
+    '''The old way: one form POST per day'''
+    for day in occurrences(start, [0, 1, 2, 3, 4], weeks):
+        test_client.post('/dog_owner/create_booking', data={
+            'facility': 'Pet Palace', 'check_in': day.isoformat(), 'check_out': day.isoformat(),
+            'daycare': 'y', 'number_of_dogs': '1'})
+
+
+def recurring(test_client, facility_id, start, weeks):
+    '''One POST for the whole series'''
+    test_client.post('/dog_owner/recurring_booking', json={
+        'facility_id': facility_id, 'start': start.isoformat(), 'days': 'mon-fri', 'weeks': weeks})
+
+
+def measure(func, weeks):
+    '''Return the seconds, statements, commits and emails of booking one series'''
+    db.drop_all()
+    db.create_all()
+    client_id, facility_id = populate()
+    test_client = app.test_client()
+    login(test_client, client_id)
+    start = date.today() + timedelta(days=7 - date.today().weekday() + 7)
+    counts = {'statements': 0, 'commits': 0}
+
+    def statement(*args):
+        counts['statements'] += 1
+
+    def commit(*args):
+        counts['commits'] += 1
+
+    event.listen(db.engine, 'before_cursor_execute', statement)
+    event.listen(db.engine, 'commit', commit)
+    begin = time.perf_counter()
+    func(test_client, facility_id, start, weeks)
+    elapsed = time.perf_counter() - begin
+    event.remove(db.engine, 'before_cursor_execute', statement)
+    event.remove(db.engine, 'commit', commit)
+    db.session.remove()
+    assert Booking.query.count() == weeks * 5
+    return elapsed, counts['statements'], counts['commits'], OutboxMessage.query.count()
+
+
+def main():
+    print(f'{"weeks":>5} {"method":>10} {"ms":>8} {"statements":>11} {"commits":>8} {"emails":>7}')
+    with app.app_context():
+        for weeks in WEEKS:
+            for name, func in (('one by one', one_by_one), ('recurring', recurring)):
+                elapsed, statements, commits, emails = measure(func, weeks)
+                print(f'{weeks:>5} {name:>10} {elapsed * 1000:>8.1f} {statements:>11} {commits:>8} {emails:>7}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+'''
+    Benchmark: row-by-row ORM status transitions vs the set-based UPDATEs
+    used by update_bookings(), and a following incremental run starting
+    from the watermark an hour later. Emails are left out, only the
+    database work is timed.
+    Run from the project root with: python -m benchmarks.bench_update_bookings
+'''
+
+import os
+import random
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+os.environ.setdefault('FLASK_ENV', 'testing')
+
+from sqlalchemy import and_
+from app import app, db
+from app.models import Booking, Facility
+from app.routes import transition_bookings, add_completed_bookings, apply_transitions
+from app import routes
+
+
+SIZES = [10_000, 100_000, 1_000_000]
+FACILITIES = 500
+STATUSES = ['pending', 'accepted', 'ongoing', 'completed', 'declined']
+
+
+def populate(count, seed=42):
+    '''Insert facilities and random bookings around now'''
+    rng = random.Random(seed)
+    now = datetime.now()
+    db.session.execute(Facility.__table__.insert(),
+                       [{'name': f'Facility {number}', 'completed_bookings': 0} for number in range(FACILITIES)])
+    rows = []
+    for _ in range(count):
+        check_in = now + timedelta(days=rng.uniform(-30, 30))
+        rows.append({'issued_by': rng.randint(1, 10_000), 'facility_id': rng.randint(1, FACILITIES),
+                     'status': rng.choice(STATUSES), 'check_in': check_in,
+                     'check_out': check_in + timedelta(days=rng.randint(1, 7))})
+    db.session.execute(Booking.__table__.insert(), rows)
+    db.session.commit()
+
+
+def per_row(now):
+    '''The original path: load and mutate every booking through the ORM'''
+    for booking in Booking.query.filter(Booking.check_in <= now, Booking.status == 'accepted').all():
+        booking.update_status()
+    for booking in Booking.query.filter(Booking.check_out <= now, Booking.status == 'pending').all():
+        booking.status = 'expired'
+    for booking in Booking.query.filter(Booking.check_out <= now, Booking.status == 'ongoing').all():
+        booking.status = 'completed'
+        booking.facility.completed_bookings = (booking.facility.completed_bookings or 0) + 1
+    db.session.commit()
+
+
+def set_based(now):
+    '''The new path: three UPDATE ... RETURNING statements and one grouped UPDATE'''
+    transition_bookings(and_(Booking.status == 'accepted', Booking.check_in <= now), 'ongoing')
+    transition_bookings(and_(Booking.status == 'pending', Booking.check_out <= now), 'expired')
+    completed = transition_bookings(and_(Booking.status == 'ongoing', Booking.check_out <= now), 'completed')
+    add_completed_bookings(Counter(row.facility_id for row in completed))
+    db.session.commit()
+
+
+def incremental(now):
+    '''A run an hour after a full one, only reading what crossed since'''
+    set_based(now)
+    start = time.perf_counter()
+    apply_transitions(now + timedelta(hours=1), since=now)
+    return time.perf_counter() - start
+
+
+def timed(func, size):
+    '''Return the wall time of func on a fresh database'''
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        populate(size)
+        db.session.remove()
+        start = time.perf_counter()
+        elapsed = func(datetime.now())
+        if elapsed is None:
+            elapsed = time.perf_counter() - start
+        db.session.remove()
+    return elapsed
+
+
+def main():
+    # Keep the completion emails out of the timings
+    routes.notify_completed_bookings = lambda booking_ids: None
+    print(f'{"bookings":>10} {"per-row (s)":>12} {"set-based (s)":>14} {"speed-up":>9} {"incremental (s)":>16}')
+    for size in SIZES:
+        fast = timed(set_based, size)
+        since = timed(incremental, size)
+        if size <= 100_000:
+            slow = timed(per_row, size)
+            print(f'{size:>10} {slow:>12.3f} {fast:>14.3f} {slow / fast:>8.0f}x {since:>16.4f}')
+        else:
+            print(f'{size:>10} {"-":>12} {fast:>14.3f} {"-":>9} {since:>16.4f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -21,6 +21,38 @@ class Config:
     MAIL_USE_SSL = os.getenv('MAIL_USE_SSL', 'True').lower() in ['true', '1', 't']
     GO_MAPS_API_KEY = os.getenv('GO_MAPS_API_KEY')
     SCHEDULER_API_ENABLED = True
+    GEOCODER_BACKEND = os.getenv('GEOCODER_BACKEND', 'gomaps')
+    GEOCODE_CACHE_TTL = int(os.getenv('GEOCODE_CACHE_TTL', 30 * 24 * 3600))
+    GEOCODE_NEGATIVE_TTL = int(os.getenv('GEOCODE_NEGATIVE_TTL', 24 * 3600))
+    GEOCODER_CONNECT_TIMEOUT = float(os.getenv('GEOCODER_CONNECT_TIMEOUT', 3.05))
+    GEOCODER_READ_TIMEOUT = float(os.getenv('GEOCODER_READ_TIMEOUT', 5))
+    GEOCODER_RETRIES = int(os.getenv('GEOCODER_RETRIES', 2))
+    GEOCODER_BACKOFF = float(os.getenv('GEOCODER_BACKOFF', 0.2))
+    GEOCODER_BREAKER_THRESHOLD = int(os.getenv('GEOCODER_BREAKER_THRESHOLD', 5))
+    GEOCODER_BREAKER_RESET = int(os.getenv('GEOCODER_BREAKER_RESET', 30))
+    # Index file built by `flask build-gazetteer`
+    GAZETTEER_PATH = os.getenv('GAZETTEER_PATH')
+    SEARCH_CACHE_SIZE = int(os.getenv('SEARCH_CACHE_SIZE', 1024))
+    SEARCH_CACHE_TTL = int(os.getenv('SEARCH_CACHE_TTL', 300))
+    DASHBOARD_CACHE_SIZE = int(os.getenv('DASHBOARD_CACHE_SIZE', 1024))
+    DASHBOARD_CACHE_TTL = int(os.getenv('DASHBOARD_CACHE_TTL', 600))
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'False').lower() in ['true', '1', 't']
+    OUTBOX_WORKER_ENABLED = os.getenv('OUTBOX_WORKER_ENABLED', 'True').lower() in ['true', '1', 't']
+    OUTBOX_POLL_INTERVAL = int(os.getenv('OUTBOX_POLL_INTERVAL', 10))
+    OUTBOX_WORKERS = int(os.getenv('OUTBOX_WORKERS', 4))
+    OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', 50))
+    OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', 6))
+    OUTBOX_BACKOFF = float(os.getenv('OUTBOX_BACKOFF', 30))
+    OUTBOX_MAX_BACKOFF = float(os.getenv('OUTBOX_MAX_BACKOFF', 3600))
+    OUTBOX_CLAIM_TIMEOUT = int(os.getenv('OUTBOX_CLAIM_TIMEOUT', 300))
+    MAIL_MAX_PER_CONNECTION = int(os.getenv('MAIL_MAX_PER_CONNECTION', 100))
+    TRANSITION_TIMER_ENABLED = os.getenv('TRANSITION_TIMER_ENABLED', 'True').lower() in ['true', '1', 't']
+    TRANSITION_HORIZON = int(os.getenv('TRANSITION_HORIZON', 3600))
+    TRANSITION_REFRESH = int(os.getenv('TRANSITION_REFRESH', 300))
+    SCHEDULER_LEASE_ENABLED = os.getenv('SCHEDULER_LEASE_ENABLED', 'True').lower() in ['true', '1', 't']
+    SCHEDULER_LEASE_TTL = int(os.getenv('SCHEDULER_LEASE_TTL', 30))
+    SCHEDULER_HEARTBEAT = int(os.getenv('SCHEDULER_HEARTBEAT', 10))
+    UPDATE_BOOKINGS_FULL_INTERVAL = int(os.getenv('UPDATE_BOOKINGS_FULL_INTERVAL', 24 * 3600))
 
 
 
@@ -34,4 +66,9 @@ class TestConfig(Config):
     SQLALCHEMY_DATABASE_URI = os.getenv('TEST_DATABASE_URL', 'sqlite:///:memory:')
     WTF_CSRF_ENABLED = False
     SCHEDULER_API_ENABLED = False
+    GEOCODER_BACKEND = 'stub'
+    METRICS_ENABLED = True
+    OUTBOX_WORKER_ENABLED = False
+    TRANSITION_TIMER_ENABLED = False
+    SCHEDULER_LEASE_ENABLED = False
 
@@ -0,0 +1,11 @@
+'''
+    Gunicorn settings, loaded by the Procfile.
+    Each worker starts the scheduled jobs after it is forked; the leader
+    lease makes sure only one of them runs them (see app/leader.py).
+'''
+
+
+def post_fork(server, worker):
+    '''Start the scheduled jobs in a new worker'''
+    from app.routes import start_scheduler
+    start_scheduler()
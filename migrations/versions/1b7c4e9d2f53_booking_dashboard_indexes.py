@@ -0,0 +1,28 @@
+"""booking dashboard indexes
+
+Revision ID: 1b7c4e9d2f53
+Revises: f18b4d6a9c27
+Create Date: 2026-10-18 13:24:41.508213
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1b7c4e9d2f53'
+down_revision = 'f18b4d6a9c27'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('booking', schema=None) as batch_op:
+        batch_op.create_index('ix_booking_issued_by_status_check_in', ['issued_by', 'status', 'check_in'], unique=False)
+        batch_op.create_index('ix_booking_facility_id_status_check_in', ['facility_id', 'status', 'check_in'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('booking', schema=None) as batch_op:
+        batch_op.drop_index('ix_booking_facility_id_status_check_in')
+        batch_op.drop_index('ix_booking_issued_by_status_check_in')
@@ -0,0 +1,28 @@
+"""cache version
+
+Revision ID: 2c8e5a7f1d94
+Revises: 1b7c4e9d2f53
+Create Date: 2026-10-18 14:02:16.730592
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2c8e5a7f1d94'
+down_revision = '1b7c4e9d2f53'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('cache_version',
+    sa.Column('name', sa.String(length=64), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade():
+    op.drop_table('cache_version')
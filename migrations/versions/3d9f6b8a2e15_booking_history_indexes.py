@@ -0,0 +1,28 @@
+"""booking history indexes
+
+Revision ID: 3d9f6b8a2e15
+Revises: 2c8e5a7f1d94
+Create Date: 2026-10-18 14:37:52.284106
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3d9f6b8a2e15'
+down_revision = '2c8e5a7f1d94'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('booking', schema=None) as batch_op:
+        batch_op.create_index('ix_booking_issued_by_check_out', ['issued_by', 'check_out'], unique=False)
+        batch_op.create_index('ix_booking_facility_id_check_out', ['facility_id', 'check_out'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('booking', schema=None) as batch_op:
+        batch_op.drop_index('ix_booking_facility_id_check_out')
+        batch_op.drop_index('ix_booking_issued_by_check_out')
@@ -0,0 +1,48 @@
+"""facility geohash
+
+Revision ID: 4f1c2a9b7e10
+Revises: 0eb402224340
+Create Date: 2026-10-18 09:12:41.204117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from app.geo import encode_geohash
+
+
+# revision identifiers, used by Alembic.
+revision = '4f1c2a9b7e10'
+down_revision = '0eb402224340'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('facility', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('geohash', sa.String(length=12), nullable=True))
+        batch_op.create_index(batch_op.f('ix_facility_geohash'), ['geohash'], unique=False)
+
+    # Backfill the geohash for facilities that already have coordinates
+    connection = op.get_bind()
+    facility = sa.table('facility',
+                        sa.column('id', sa.Integer),
+                        sa.column('latitude', sa.Float),
+                        sa.column('longitude', sa.Float),
+                        sa.column('geohash', sa.String))
+    rows = connection.execute(
+        sa.select(facility.c.id, facility.c.latitude, facility.c.longitude)
+        .where(facility.c.latitude.isnot(None), facility.c.longitude.isnot(None))
+    ).all()
+    for facility_id, latitude, longitude in rows:
+        connection.execute(
+            facility.update()
+            .where(facility.c.id == facility_id)
+            .values(geohash=encode_geohash(latitude, longitude))
+        )
+
+
+def downgrade():
+    with op.batch_alter_table('facility', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_facility_geohash'))
+        batch_op.drop_column('geohash')
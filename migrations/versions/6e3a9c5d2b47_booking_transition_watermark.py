@@ -0,0 +1,35 @@
+"""booking transition watermark
+
+Revision ID: 6e3a9c5d2b47
+Revises: 5b2d8f4c1a36
+Create Date: 2026-10-18 16:48:13.502716
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6e3a9c5d2b47'
+down_revision = '5b2d8f4c1a36'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('job_watermark',
+    sa.Column('name', sa.String(length=64), nullable=False),
+    sa.Column('value', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+    with op.batch_alter_table('booking', schema=None) as batch_op:
+        batch_op.create_index('ix_booking_status_check_in', ['status', 'check_in'], unique=False)
+        batch_op.create_index('ix_booking_status_check_out', ['status', 'check_out'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('booking', schema=None) as batch_op:
+        batch_op.drop_index('ix_booking_status_check_out')
+        batch_op.drop_index('ix_booking_status_check_in')
+
+    op.drop_table('job_watermark')
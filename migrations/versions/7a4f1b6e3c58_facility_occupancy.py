@@ -0,0 +1,54 @@
+"""facility occupancy
+
+Revision ID: 7a4f1b6e3c58
+Revises: 6e3a9c5d2b47
+Create Date: 2026-10-18 17:35:27.904113
+
+"""
+from collections import Counter
+from datetime import timedelta
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7a4f1b6e3c58'
+down_revision = '6e3a9c5d2b47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('facility_occupancy',
+    sa.Column('facility_id', sa.Integer(), nullable=False),
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('dogs', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['facility_id'], ['facility.id'], ),
+    sa.PrimaryKeyConstraint('facility_id', 'day')
+    )
+    # Fill it from the existing bookings, counting the days as booking_days()
+    # in availability.py does
+    booking = sa.table('booking', sa.column('facility_id', sa.Integer), sa.column('check_in', sa.DateTime),
+                       sa.column('check_out', sa.DateTime), sa.column('number_of_dogs', sa.Integer),
+                       sa.column('status', sa.String))
+    connection = op.get_bind()
+    rows = connection.execute(
+        sa.select(booking.c.facility_id, booking.c.check_in, booking.c.check_out, booking.c.number_of_dogs)
+        .where(booking.c.status.notin_(('cancelled', 'declined')), booking.c.facility_id.isnot(None),
+               booking.c.check_in.isnot(None), booking.c.check_out.isnot(None))
+    ).all()
+    occupancy = Counter()
+    for facility_id, check_in, check_out, dogs in rows:
+        first = check_in.date()
+        last = max(check_out.date() - timedelta(days=1), first)
+        for offset in range((last - first).days + 1):
+            occupancy[facility_id, first + timedelta(days=offset)] += int(dogs or 1)
+    values = [{'facility_id': facility_id, 'day': day, 'dogs': dogs} for (facility_id, day), dogs in occupancy.items()]
+    if values:
+        table = sa.table('facility_occupancy', sa.column('facility_id', sa.Integer), sa.column('day', sa.Date),
+                         sa.column('dogs', sa.Integer))
+        op.bulk_insert(table, values)
+
+
+def downgrade():
+    op.drop_table('facility_occupancy')
@@ -0,0 +1,51 @@
+"""unique booking code
+
+Revision ID: 8b5c2d7f4e69
+Revises: 7a4f1b6e3c58
+Create Date: 2026-10-18 18:12:41.520337
+
+"""
+import secrets
+import string
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b5c2d7f4e69'
+down_revision = '7a4f1b6e3c58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Codes were never checked for uniqueness, so give every duplicate but
+    # the oldest booking a new code before adding the unique index
+    booking = sa.table('booking', sa.column('id', sa.Integer), sa.column('booking_code', sa.String))
+    connection = op.get_bind()
+    duplicated = (sa.select(booking.c.booking_code).where(booking.c.booking_code.isnot(None))
+                  .group_by(booking.c.booking_code).having(sa.func.count() > 1))
+    rows = connection.execute(
+        sa.select(booking.c.id, booking.c.booking_code).where(booking.c.booking_code.in_(duplicated))
+        .order_by(booking.c.booking_code, booking.c.id)
+    ).all()
+    if rows:
+        codes = set(connection.execute(
+            sa.select(booking.c.booking_code).where(booking.c.booking_code.isnot(None))).scalars())
+        characters = string.ascii_uppercase + string.digits
+        seen = set()
+        for id, code in rows:
+            if code not in seen:
+                seen.add(code)
+                continue
+            while code in codes:
+                code = ''.join(secrets.choice(characters) for _ in range(8))
+            codes.add(code)
+            connection.execute(booking.update().where(booking.c.id == id).values(booking_code=code))
+    with op.batch_alter_table('booking', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_booking_booking_code'), ['booking_code'], unique=True)
+
+
+def downgrade():
+    with op.batch_alter_table('booking', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_booking_booking_code'))
@@ -0,0 +1,29 @@
+"""facility rating index
+
+Revision ID: 9a3e5d21c4b8
+Revises: 4f1c2a9b7e10
+Create Date: 2026-10-18 10:03:17.880342
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a3e5d21c4b8'
+down_revision = '4f1c2a9b7e10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute('UPDATE facility SET avg_rating = 0 WHERE avg_rating IS NULL')
+    with op.batch_alter_table('facility', schema=None) as batch_op:
+        batch_op.alter_column('avg_rating', existing_type=sa.Float(), nullable=False)
+        batch_op.create_index('ix_facility_avg_rating_id', ['avg_rating', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('facility', schema=None) as batch_op:
+        batch_op.drop_index('ix_facility_avg_rating_id')
+        batch_op.alter_column('avg_rating', existing_type=sa.Float(), nullable=True)
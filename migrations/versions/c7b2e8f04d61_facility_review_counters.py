@@ -0,0 +1,37 @@
+"""facility review counters
+
+Revision ID: c7b2e8f04d61
+Revises: 9a3e5d21c4b8
+Create Date: 2026-10-18 10:41:55.310674
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7b2e8f04d61'
+down_revision = '9a3e5d21c4b8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('facility', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('review_count', sa.Integer(), nullable=False, server_default='0'))
+        batch_op.add_column(sa.Column('rating_sum', sa.Float(), nullable=False, server_default='0'))
+
+    # Backfill the counters from the existing reviews
+    counted = 'review.facility_id = facility.id AND review.deleted IS NOT TRUE AND review.rating IS NOT NULL'
+    op.execute(
+        'UPDATE facility SET '
+        f'review_count = (SELECT count(review.id) FROM review WHERE {counted}), '
+        f'rating_sum = (SELECT coalesce(sum(review.rating), 0) FROM review WHERE {counted}), '
+        f'avg_rating = (SELECT coalesce(avg(review.rating), 0) FROM review WHERE {counted})'
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('facility', schema=None) as batch_op:
+        batch_op.drop_column('rating_sum')
+        batch_op.drop_column('review_count')
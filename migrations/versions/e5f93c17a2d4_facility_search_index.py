@@ -0,0 +1,28 @@
+"""facility search index
+
+Revision ID: e5f93c17a2d4
+Revises: d2a61f9e8b35
+Create Date: 2026-10-18 12:16:40.552190
+
+"""
+from alembic import op
+
+from app.search import create_search_index, drop_search_index, rebuild_search_index
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5f93c17a2d4'
+down_revision = 'd2a61f9e8b35'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # FTS5 table on SQLite, generated tsvector column and GIN index on Postgres
+    connection = op.get_bind()
+    create_search_index(connection)
+    rebuild_search_index(connection)
+
+
+def downgrade():
+    drop_search_index(op.get_bind())
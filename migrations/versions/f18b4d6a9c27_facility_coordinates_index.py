@@ -0,0 +1,26 @@
+"""facility coordinates index
+
+Revision ID: f18b4d6a9c27
+Revises: e5f93c17a2d4
+Create Date: 2026-10-18 12:58:03.117468
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f18b4d6a9c27'
+down_revision = 'e5f93c17a2d4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('facility', schema=None) as batch_op:
+        batch_op.create_index('ix_facility_latitude_longitude', ['latitude', 'longitude'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('facility', schema=None) as batch_op:
+        batch_op.drop_index('ix_facility_latitude_longitude')
@@ -3,7 +3,14 @@
     This file is used to run the application.
 '''
 
+import os
 from app import app
+from app.routes import start_scheduler
+
+# The debug reloader runs this file in a watcher process as well,
+# only the process serving requests runs the scheduled jobs
+if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+    start_scheduler()
 
 # run with debug mode on
-app.run(debug=True)
\ No newline at end of file
+app.run(debug=True)
@@ -0,0 +1,5 @@
+import os
+
+# Load TestConfig when the app is first imported, so settings read at
+# import time (such as the scheduler lease) are the test ones
+os.environ.setdefault('FLASK_ENV', 'testing')
@@ -0,0 +1,174 @@
+'''Tests for the capacity checks and occupancy counters'''
+
+import unittest
+from datetime import date, datetime, timedelta
+from flask import g
+from app import app, db
+from app.models import DogOwner, FacilityOwner, Facility, Booking, FacilityOccupancy, OutboxMessage
+from app.availability import (booking_days, reserve, change_status, rebuild_occupancy, FacilityFullError)
+
+
+class AvailabilityTestCase(unittest.TestCase):
+    def setUp(self):
+        app.config.from_object('config.TestConfig')
+        self.app_context = app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = app.test_client()
+
+        self.dog_owner = DogOwner(first_name='Sam', email='sam@example.com')
+        self.owner = FacilityOwner(first_name='Alex', email='alex@example.com')
+        db.session.add_all([self.dog_owner, self.owner])
+        db.session.commit()
+        self.facility = Facility(name='Pet Palace', owner_id=self.owner.id, capacity=3)
+        self.unlimited = Facility(name='Open Field', owner_id=self.owner.id)
+        db.session.add_all([self.facility, self.unlimited])
+        db.session.commit()
+        self.start = date.today() + timedelta(days=10)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def day(self, offset):
+        return self.start + timedelta(days=offset)
+
+    def occupancy(self, facility=None):
+        db.session.expire_all()
+        return {row.day: row.dogs for row in FacilityOccupancy.query.filter_by(
+            facility_id=(facility or self.facility).id).filter(FacilityOccupancy.dogs > 0)}
+
+    def add_booking(self, check_in, check_out, dogs, status='pending'):
+        reserve(self.facility, self.day(check_in), self.day(check_out), dogs)
+        booking = Booking(status=status, issued_by=self.dog_owner.id, facility_id=self.facility.id,
+                          check_in=datetime.combine(self.day(check_in), datetime.min.time()),
+                          check_out=datetime.combine(self.day(check_out), datetime.min.time()),
+                          number_of_dogs=dogs)
+        db.session.add(booking)
+        db.session.commit()
+        return booking
+
+    def test_booking_days(self):
+        self.assertEqual(booking_days(self.day(0), self.day(3)), [self.day(0), self.day(1), self.day(2)])
+        # Same-day daycare takes its one day
+        self.assertEqual(booking_days(datetime(2025, 3, 4, 8), datetime(2025, 3, 4, 17)), [date(2025, 3, 4)])
+
+    def test_reserve_within_capacity(self):
+        self.add_booking(0, 2, 2)
+        self.add_booking(1, 3, 1)
+        self.assertEqual(self.occupancy(), {self.day(0): 2, self.day(1): 3, self.day(2): 1})
+
+    def test_full_booking_changes_nothing(self):
+        self.add_booking(1, 2, 3)
+        with self.assertRaises(FacilityFullError) as caught:
+            reserve(self.facility, self.day(0), self.day(3), 1)
+        self.assertEqual(caught.exception.days, [self.day(1)])
+        db.session.commit()
+        self.assertEqual(self.occupancy(), {self.day(1): 3})
+
+        with self.assertRaises(FacilityFullError):
+            reserve(self.facility, self.day(5), self.day(6), 4)
+
+    def test_unlimited_facility_still_counted(self):
+        reserve(self.unlimited, self.day(0), self.day(1), 50)
+        db.session.commit()
+        self.assertEqual(self.occupancy(self.unlimited), {self.day(0): 50})
+
+    def test_status_changes_release_and_retake(self):
+        booking = self.add_booking(0, 2, 2)
+        change_status(booking, 'declined')
+        db.session.commit()
+        self.assertEqual(self.occupancy(), {})
+
+        other = self.add_booking(0, 1, 2)
+        with self.assertRaises(FacilityFullError):
+            change_status(booking, 'accepted')
+        db.session.rollback()
+        self.assertEqual(db.session.get(Booking, booking.id).status, 'declined')
+
+        change_status(other, 'cancelled')
+        change_status(booking, 'accepted')
+        db.session.commit()
+        self.assertEqual(self.occupancy(), {self.day(0): 2, self.day(1): 2})
+
+        # Moving between statuses that both hold places changes nothing
+        change_status(booking, 'ongoing')
+        db.session.commit()
+        self.assertEqual(self.occupancy(), {self.day(0): 2, self.day(1): 2})
+
+    def test_rebuild_matches_incremental(self):
+        self.add_booking(0, 2, 2)
+        cancelled = self.add_booking(1, 3, 1)
+        change_status(cancelled, 'cancelled')
+        self.add_booking(2, 4, 1)
+        db.session.commit()
+        expected = self.occupancy()
+
+        FacilityOccupancy.query.delete()
+        rebuild_occupancy()
+        db.session.commit()
+        self.assertEqual(self.occupancy(), expected)
+
+    def test_create_booking_rejected_when_full(self):
+        self.add_booking(0, 1, 2)
+        g.pop('_login_user', None)
+        with self.client.session_transaction() as session:
+            session['_user_id'] = str(self.dog_owner.id)
+        form = {'facility': 'Pet Palace', 'check_in': self.day(0).isoformat(), 'check_out': self.day(1).isoformat(),
+                'daycare': 'y', 'number_of_dogs': '2'}
+
+        response = self.client.post('/dog_owner/create_booking', data=form)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'No room left on', response.data)
+        self.assertEqual(Booking.query.count(), 1)
+        self.assertEqual(OutboxMessage.query.count(), 0)
+
+        form['number_of_dogs'] = '1'
+        response = self.client.post('/dog_owner/create_booking', data=form)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Booking.query.count(), 2)
+        self.assertEqual(self.occupancy(), {self.day(0): 3})
+
+    def get_availability(self, facility, headers=None, **args):
+        g.pop('_login_user', None)
+        with self.client.session_transaction() as session:
+            session['_user_id'] = str(self.dog_owner.id)
+        return self.client.get(f'/facility/{facility.id}/availability', query_string=args, headers=headers)
+
+    def test_availability_endpoint(self):
+        self.add_booking(0, 2, 2)
+        response = self.get_availability(self.facility, **{'from': self.day(0).isoformat(), 'to': self.day(2).isoformat()})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['capacity'], 3)
+        self.assertEqual([(day['date'], day['booked'], day['remaining']) for day in response.json['days']], [
+            (self.day(0).isoformat(), 2, 1), (self.day(1).isoformat(), 2, 1), (self.day(2).isoformat(), 0, 3)])
+
+        response = self.get_availability(self.unlimited, **{'from': self.day(0).isoformat()})
+        self.assertEqual(len(response.json['days']), 31)
+        self.assertIsNone(response.json['days'][0]['remaining'])
+
+        self.assertEqual(self.get_availability(self.facility, **{'from': 'soon'}).status_code, 400)
+        self.assertEqual(self.get_availability(self.facility, **{'from': self.day(2).isoformat(),
+                                                                   'to': self.day(0).isoformat()}).status_code, 400)
+
+    def test_availability_conditional_get(self):
+        args = {'from': self.day(0).isoformat(), 'to': self.day(6).isoformat()}
+        etag = self.get_availability(self.facility, **args).headers['ETag']
+        response = self.get_availability(self.facility, headers={'If-None-Match': etag}, **args)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+
+        # Any change to the facility's occupancy gives a new ETag
+        booking = self.add_booking(0, 2, 1)
+        response = self.get_availability(self.facility, headers={'If-None-Match': etag}, **args)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['days'][0]['remaining'], 2)
+        etag = response.headers['ETag']
+        change_status(booking, 'cancelled')
+        db.session.commit()
+        self.assertEqual(self.get_availability(self.facility, headers={'If-None-Match': etag}, **args).status_code, 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,9 @@
 import unittest
+from unittest import mock
 from datetime import datetime, timedelta
 from app import app, db
-from app.models import User, Facility, Booking
+from app.models import User, FacilityOwner, Facility, Booking, CacheVersion, OutboxMessage, JobWatermark
+from app.routes import update_bookings, add_with_booking_code
 
 class BookingModelTestCase(unittest.TestCase):
     def setUp(self):
@@ -98,5 +100,124 @@ class BookingModelTestCase(unittest.TestCase):
 
 
 
+class UpdateBookingsTestCase(unittest.TestCase):
+    def setUp(self):
+        app.config.from_object('config.TestConfig')
+        self.app_context = app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        self.user = User(first_name='Test', email='test@example.com')
+        self.owner = FacilityOwner(first_name='Owner', email='owner@example.com')
+        db.session.add_all([self.user, self.owner])
+        db.session.commit()
+        self.facility = Facility(name='Test Facility', owner_id=self.owner.id, completed_bookings=2)
+        self.other = Facility(name='Other Facility', owner_id=self.owner.id)
+        db.session.add_all([self.facility, self.other])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def add_booking(self, status, check_in, check_out, facility=None):
+        now = datetime.now()
+        booking = Booking(status=status, issued_by=self.user.id, facility_id=(facility or self.facility).id,
+                          check_in=now + timedelta(days=check_in), check_out=now + timedelta(days=check_out))
+        db.session.add(booking)
+        return booking
+
+    def test_update_bookings_transitions(self):
+        bookings = {
+            'starting': self.add_booking('accepted', -1, 2),
+            'future': self.add_booking('accepted', 1, 2),
+            'expiring': self.add_booking('pending', -3, -1),
+            'waiting': self.add_booking('pending', 1, 2),
+            'finishing': self.add_booking('ongoing', -3, -1),
+            'finishing_other': self.add_booking('ongoing', -3, -1, self.other),
+            'overdue': self.add_booking('accepted', -3, -1),
+        }
+        db.session.commit()
+        ids = {name: booking.id for name, booking in bookings.items()}
+        version = db.session.get(CacheVersion, f'user:{self.user.id}').version
+
+        update_bookings()
+        db.session.expire_all()
+
+        statuses = {name: db.session.get(Booking, id).status for name, id in ids.items()}
+        self.assertEqual(statuses, {
+            'starting': 'ongoing',
+            'future': 'accepted',
+            'expiring': 'expired',
+            'waiting': 'pending',
+            'finishing': 'completed',
+            'finishing_other': 'completed',
+            'overdue': 'completed',
+        })
+        self.assertEqual(db.session.get(Facility, self.facility.id).completed_bookings, 4)
+        self.assertEqual(db.session.get(Facility, self.other.id).completed_bookings, 1)
+
+        # One email to the dog owner and one to the facility owner per completed booking
+        self.assertEqual(OutboxMessage.query.filter_by(status='pending').count(), 6)
+        self.assertGreater(db.session.get(CacheVersion, f'user:{self.user.id}').version, version)
+
+    def test_update_bookings_from_watermark(self):
+        update_bookings()
+        watermark = db.session.get(JobWatermark, 'update_bookings').value
+        # Already past the watermark, e.g. accepted after it had ended
+        stale = self.add_booking('accepted', -3, -2)
+        late = self.add_booking('accepted', -3, 1)
+        finishing = self.add_booking('ongoing', -3, 0)
+        finishing.check_out = watermark + timedelta(microseconds=1)
+        db.session.commit()
+        ids = stale.id, late.id, finishing.id
+
+        update_bookings()
+        db.session.expire_all()
+        self.assertEqual([db.session.get(Booking, id).status for id in ids], ['accepted', 'ongoing', 'completed'])
+        self.assertGreater(db.session.get(JobWatermark, 'update_bookings').value, watermark)
+
+        # The next scheduled run after a day rescans everything and fixes it
+        last_full = db.session.get(JobWatermark, 'update_bookings_full')
+        last_full.value = datetime.now() - timedelta(days=1)
+        db.session.commit()
+        update_bookings()
+        db.session.expire_all()
+        self.assertEqual(db.session.get(Booking, stale.id).status, 'completed')
+        self.assertGreater(db.session.get(JobWatermark, 'update_bookings_full').value, watermark)
+
+    def test_update_bookings_full(self):
+        update_bookings()
+        stale = self.add_booking('accepted', -3, -2)
+        db.session.commit()
+        update_bookings(full=True)
+        db.session.expire_all()
+        self.assertEqual(db.session.get(Booking, stale.id).status, 'completed')
+
+    def test_update_bookings_nothing_to_do(self):
+        self.add_booking('accepted', 1, 2)
+        db.session.commit()
+        update_bookings()
+        self.assertEqual(OutboxMessage.query.count(), 0)
+        self.assertEqual(Booking.query.first().status, 'accepted')
+
+    def test_booking_code_collision_retried(self):
+        '''A new booking whose code is taken gets another one in the same transaction'''
+        db.session.add(Booking(booking_code='ABC12345', issued_by=self.user.id, facility_id=self.facility.id))
+        db.session.commit()
+        self.user.first_name = 'Changed'
+        booking = Booking(issued_by=self.user.id, facility_id=self.facility.id)
+        with mock.patch('app.routes.generate_booking_code', side_effect=['ABC12345', 'XYZ67890']):
+            add_with_booking_code(booking)
+        self.assertIsNotNone(booking.id)
+        db.session.commit()
+
+        db.session.expire_all()
+        self.assertEqual(sorted(code for code, in db.session.query(Booking.booking_code)), ['ABC12345', 'XYZ67890'])
+        # Work done before the collision is kept
+        self.assertEqual(db.session.get(User, self.user.id).first_name, 'Changed')
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,44 @@
+'''Tests for the in-process caches'''
+
+import time
+import unittest
+from app.cache import TTLCache
+
+
+class TTLCacheTestCase(unittest.TestCase):
+    def test_get_and_set(self):
+        '''Test values can be stored and read back'''
+        cache = TTLCache(maxsize=4, ttl=60)
+        cache.set('a', 1)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('missing'))
+
+    def test_expiry(self):
+        '''Test entries expire after their ttl'''
+        cache = TTLCache(maxsize=4, ttl=60)
+        cache.set('a', 1, ttl=0.01)
+        time.sleep(0.02)
+        self.assertIsNone(cache.get('a'))
+
+    def test_lru_eviction(self):
+        '''Test the least recently used entry is evicted first'''
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(len(cache), 2)
+
+    def test_get_or_set(self):
+        '''Test the factory is only called on a miss'''
+        cache = TTLCache()
+        calls = []
+        for _ in range(3):
+            cache.get_or_set('a', lambda: calls.append(1) or 'value')
+        self.assertEqual(len(calls), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,220 @@
+'''Tests for the dashboard pages'''
+
+import unittest
+from datetime import datetime, timedelta
+from flask import g
+from sqlalchemy import event
+from app import app, db
+from app.models import DogOwner, FacilityOwner, Dog, Facility, Booking, Review, CacheVersion
+from app.fragments import fragment_cache
+
+
+class DashboardTestCase(unittest.TestCase):
+    def setUp(self):
+        app.config.from_object('config.TestConfig')
+        self.app_context = app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        self.owner = DogOwner(username='owner', email='owner@example.com', first_name='Sam')
+        self.owner.set_password('password')
+        self.facility_owner = FacilityOwner(username='host', email='host@example.com', first_name='Alex')
+        self.facility_owner.set_password('password')
+        db.session.add_all([self.owner, self.facility_owner])
+        db.session.commit()
+        self.facility = Facility(name='Pet Palace', owner_id=self.facility_owner.id)
+        db.session.add(self.facility)
+        db.session.add(Dog(name='Rex', owner_id=self.owner.id))
+        db.session.commit()
+
+        self.client = app.test_client()
+        self.login(self.owner)
+        fragment_cache.clear()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def login(self, user):
+        # The app context outlives requests here, so drop the cached user
+        g.pop('_login_user', None)
+        with self.client.session_transaction() as session:
+            session['_user_id'] = str(user.id)
+            session['_fresh'] = True
+
+    def add_booking(self, code, status, check_in, check_out, facility=None):
+        now = datetime.now()
+        db.session.add(Booking(booking_code=code, status=status, issued_by=self.owner.id,
+                               facility_id=(facility or self.facility).id,
+                               check_in=now + timedelta(days=check_in),
+                               check_out=now + timedelta(days=check_out)))
+
+    def count_queries(self, func):
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            func()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+        return statements
+
+    def get_page(self, url):
+        responses = []
+        queries = self.count_queries(lambda: responses.append(self.client.get(url)))
+        return responses[0], queries
+
+    def test_dog_owner_dashboard_partitions_bookings(self):
+        self.add_booking('UP-PENDING', 'pending', 2, 4)
+        self.add_booking('UP-ACCEPTED', 'accepted', 3, 5)
+        self.add_booking('ONGOING', 'ongoing', -1, 1)
+        self.add_booking('COMPLETED', 'completed', -5, -3)
+        self.add_booking('CANCELLED', 'cancelled', 2, 4)
+        self.add_booking('STALE-PENDING', 'pending', -2, -1)
+        db.session.commit()
+
+        response, queries = self.get_page('/dashboard/dog_owner')
+        self.assertEqual(response.status_code, 200)
+        for code in (b'UP-PENDING', b'UP-ACCEPTED', b'ONGOING'):
+            self.assertIn(code, response.data)
+        for code in (b'COMPLETED', b'CANCELLED', b'STALE-PENDING'):
+            self.assertNotIn(code, response.data)
+
+        # One query loads the bookings with their facilities, one counts the history
+        booking_queries = [query for query in queries if 'FROM booking' in query]
+        self.assertEqual(len(booking_queries), 2)
+        self.assertIn('JOIN facility', booking_queries[0])
+
+        history = self.client.get('/dog_owner/booking_history').get_json()
+        self.assertEqual([booking['booking_code'] for booking in history['bookings']],
+                         ['CANCELLED', 'COMPLETED'])
+        self.assertIsNone(history['next_cursor'])
+
+    def test_facility_owner_dashboard_constant_queries(self):
+        self.login(self.facility_owner)
+        self.add_booking('REQUEST-1', 'pending', 2, 4)
+        self.add_booking('ONGOING-1', 'ongoing', -1, 1)
+        db.session.add(Review(rating=4, user_id=self.owner.id, facility_id=self.facility.id))
+        db.session.commit()
+        response, queries = self.get_page('/dashboard/facility_owner')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data.count(b'/facility_owner/view_booking/'), 2)
+
+        # Adding facilities, bookings and reviews doesn't add queries
+        for number in range(2, 6):
+            facility = Facility(name=f'Pet Palace {number}', owner_id=self.facility_owner.id)
+            db.session.add(facility)
+            db.session.flush()
+            self.add_booking(f'REQUEST-{number}', 'pending', 2, 4, facility)
+            self.add_booking(f'UPCOMING-{number}', 'accepted', 3, 5, facility)
+            self.add_booking(f'HISTORY-{number}', 'completed', -5, -3, facility)
+            db.session.add(Review(rating=5, user_id=self.owner.id, facility_id=facility.id))
+        db.session.commit()
+        response, more_queries = self.get_page('/dashboard/facility_owner')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(more_queries), len(queries))
+        self.assertEqual(response.data.count(b'/facility_owner/view_booking/'), 10)
+
+    def test_dashboard_cached_until_bookings_change(self):
+        self.add_booking('UP-PENDING', 'pending', 2, 4)
+        db.session.commit()
+        response, queries = self.get_page('/dashboard/dog_owner')
+        self.assertIn(b'UP-PENDING', response.data)
+
+        # A repeat load only reads the version counters
+        response, queries = self.get_page('/dashboard/dog_owner')
+        self.assertIn(b'UP-PENDING', response.data)
+        self.assertFalse([query for query in queries if 'FROM booking' in query])
+        self.assertTrue([query for query in queries if 'FROM cache_version' in query])
+
+        booking = Booking.query.filter_by(booking_code='UP-PENDING').first()
+        booking.status = 'cancelled'
+        db.session.commit()
+        response, queries = self.get_page('/dashboard/dog_owner')
+        self.assertNotIn(b'UP-PENDING', response.data)
+        self.assertTrue([query for query in queries if 'FROM booking' in query])
+
+    def test_changes_bump_versions(self):
+        versions = lambda: dict(db.session.query(CacheVersion.name, CacheVersion.version).all())
+        before = versions()
+        self.add_booking('UP-PENDING', 'pending', 2, 4)
+        db.session.commit()
+        after = versions()
+        self.assertEqual(after[f'user:{self.owner.id}'], before[f'user:{self.owner.id}'] + 1)
+        self.assertEqual(after[f'facility:{self.facility.id}'], before[f'facility:{self.facility.id}'] + 1)
+
+        db.session.add(Review(rating=5, user_id=self.owner.id, facility_id=self.facility.id))
+        db.session.commit()
+        self.assertEqual(versions()[f'facility:{self.facility.id}'], after[f'facility:{self.facility.id}'] + 1)
+
+    def test_only_shown_changes_bump_versions(self):
+        versions = lambda: dict(db.session.query(CacheVersion.name, CacheVersion.version).all())
+        self.add_booking('UP-PENDING', 'pending', 2, 4)
+        db.session.commit()
+        before = versions()
+        self.owner.location, self.owner.latitude, self.owner.longitude = 'Stellenbosch', -33.9, 18.9
+        db.session.commit()
+        self.assertEqual(versions(), before)
+
+        # The facility owner's dashboard shows the first names of clients
+        self.owner.first_name = 'Samantha'
+        db.session.commit()
+        after = versions()
+        self.assertEqual(after[f'user:{self.owner.id}'], before[f'user:{self.owner.id}'] + 1)
+        self.assertEqual(after[f'facility:{self.facility.id}'], before[f'facility:{self.facility.id}'] + 1)
+
+        # Moving a booking bumps the facility it left as well
+        other = Facility(name='Dog Den', owner_id=self.facility_owner.id)
+        db.session.add(other)
+        db.session.commit()
+        before = versions()
+        Booking.query.filter_by(booking_code='UP-PENDING').one().facility_id = other.id
+        db.session.commit()
+        after = versions()
+        self.assertEqual(after[f'facility:{self.facility.id}'], before[f'facility:{self.facility.id}'] + 1)
+        self.assertEqual(after[f'facility:{other.id}'], before[f'facility:{other.id}'] + 1)
+
+    def test_cached_dashboard_shows_flashed_messages(self):
+        self.get_page('/dashboard/dog_owner')
+        with self.client.session_transaction() as session:
+            session['_flashes'] = [('success', 'Booking successfully cancelled.')]
+        response, queries = self.get_page('/dashboard/dog_owner')
+        self.assertIn(b'Booking successfully cancelled.', response.data)
+
+    def test_history_pages(self):
+        for number in range(5):
+            self.add_booking(f'DONE-{number}', 'completed', -10, -5)
+        self.add_booking('DECLINED', 'declined', 2, 4)
+        self.add_booking('UPCOMING', 'accepted', 2, 4)
+        db.session.commit()
+
+        codes, cursor = [], None
+        while True:
+            url = '/dog_owner/booking_history?limit=2' + (f'&after={cursor}' if cursor else '')
+            page = self.client.get(url).get_json()
+            self.assertLessEqual(len(page['bookings']), 2)
+            codes += [booking['booking_code'] for booking in page['bookings']]
+            cursor = page['next_cursor']
+            if not cursor:
+                break
+        # Newest check-out first, ties broken by id
+        self.assertEqual(codes, ['DECLINED'] + [f'DONE-{number}' for number in range(4, -1, -1)])
+
+        page = self.client.get('/dog_owner/booking_history?after=not-a-cursor').get_json()
+        self.assertEqual(len(page['bookings']), 6)
+
+    def test_facility_history_requires_owner(self):
+        self.add_booking('DONE', 'completed', -10, -5)
+        db.session.commit()
+        url = f'/facility_owner/{self.facility.id}/booking_history'
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+        self.login(self.facility_owner)
+        page = self.client.get(url).get_json()
+        self.assertEqual(page['bookings'][0]['client'], 'Sam')
+        self.assertEqual(page['bookings'][0]['facility'], 'Pet Palace')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+'''Tests for the notification email templates'''
+
+import unittest
+from datetime import datetime
+from types import SimpleNamespace
+from app import app, db, metrics
+from app.emails import EMAIL_TEMPLATES, render_email, render_emails, booking_context, series_context, services_requested
+from app.models import User, FacilityOwner, Facility, Booking, OutboxMessage
+from app.routes import notify_completed_bookings
+
+
+def make_booking(**changes):
+    user = SimpleNamespace(first_name='Sam', last_name='Lee', email='sam@example.com', phone_number='0123')
+    facility = SimpleNamespace(name='Pet Palace', location='Cape Town')
+    values = dict(booking_code='ABC123', check_in=datetime(2025, 3, 4), check_out=datetime(2025, 3, 6),
+                  number_of_dogs=2, notes='Feeds twice a day', daycare=True, boarding=True,
+                  user=user, facility=facility)
+    values.update(changes)
+    return SimpleNamespace(**values)
+
+
+class EmailTemplateTestCase(unittest.TestCase):
+    def test_every_template_renders(self):
+        booking = booking_context(make_booking())
+        for name in EMAIL_TEMPLATES:
+            if name.startswith('booking_series'):
+                continue
+            subject, html = render_email(name, 'Sam', booking)
+            self.assertIn('ABC123', subject, name)
+            self.assertIn('<p> Hi Sam, </p>', html, name)
+            self.assertIn('March 04, 2025', html, name)
+            self.assertIn('The PawsitivelyBooked Team', html, name)
+
+    def test_series_emails(self):
+        booking = make_booking()
+        context = series_context(booking.facility, booking.user,
+                                 [('ABC123', datetime(2025, 3, 4), datetime(2025, 3, 4)),
+                                  ('DEF456', datetime(2025, 3, 5), datetime(2025, 3, 5))],
+                                 1, '<b>early</b>', True, False)
+        for name in ('booking_series_owner', 'booking_series_facility'):
+            subject, html = render_email(name, 'Sam', context)
+            self.assertIn('2 Bookings', subject, name)
+            self.assertIn('<td>DEF456</td><td>March 05, 2025</td>', html, name)
+            self.assertIn('&lt;b&gt;early&lt;/b&gt;', html, name)
+            self.assertIn('<b>Service Requested:</b> Daycare', html, name)
+
+    def test_created_email_details(self):
+        subject, html = render_email('booking_created_facility', 'Alex',
+                                     booking_context(make_booking(notes=None, boarding=False)))
+        self.assertEqual(subject, 'New Booking Request - Booking Code #ABC123')
+        self.assertIn('<b>Name:</b> Sam Lee', html)
+        self.assertIn('<b>Service Requested:</b> Daycare', html)
+        self.assertNotIn('None', html)
+
+    def test_values_are_escaped(self):
+        booking = booking_context(make_booking(booking_code='A&B', notes='<script>x</script>'))
+        subject, html = render_email('booking_created_owner', 'Sam', booking)
+        self.assertIn('&lt;script&gt;', html)
+        self.assertNotIn('<script>', html)
+        self.assertEqual(subject, 'Booking Created Successfully! Code #A&B')
+
+    def test_bulk_matches_single(self):
+        messages = [(name, booking_context(make_booking(booking_code=name))) for name in ('A1', 'B2', 'C3')]
+        self.assertEqual(render_emails('booking_completed_owner', messages),
+                         [render_email('booking_completed_owner', *message) for message in messages])
+
+    def test_services_requested(self):
+        self.assertEqual(services_requested(True, True), 'Daycare, Boarding')
+        self.assertEqual(services_requested(False, True), 'Boarding')
+        self.assertEqual(services_requested(None, None), '')
+
+
+class CompletedNotificationTestCase(unittest.TestCase):
+    def setUp(self):
+        app.config.from_object('config.TestConfig')
+        self.app_context = app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_completed_emails_queued_in_bulk(self):
+        client = User(first_name='Sam', email='sam@example.com')
+        owner = FacilityOwner(first_name='Alex', email='alex@example.com')
+        db.session.add_all([client, owner])
+        db.session.commit()
+        facility = Facility(name='Pet Palace', owner_id=owner.id)
+        db.session.add(facility)
+        db.session.commit()
+        booking = Booking(status='completed', issued_by=client.id, facility_id=facility.id, booking_code='XYZ789',
+                          check_in=datetime(2025, 3, 4), check_out=datetime(2025, 3, 6), number_of_dogs=1)
+        db.session.add(booking)
+        db.session.commit()
+
+        notify_completed_bookings([booking.id])
+        db.session.commit()
+        messages = {message.recipient: message for message in OutboxMessage.query.all()}
+        self.assertEqual(set(messages), {'sam@example.com', 'alex@example.com'})
+        self.assertEqual(messages['sam@example.com'].subject, 'Your Booking #XYZ789 is Now Complete - Thank you!')
+        self.assertIn('Hi Alex,', messages['alex@example.com'].html)
+        self.assertIn('for Sam at your facility, Pet Palace', messages['alex@example.com'].html)
+        self.assertEqual(messages['alex@example.com'].status, 'pending')
+
+    def test_unresolved_recipients_skipped(self):
+        client = User(first_name='Sam', email='sam@example.com')
+        db.session.add(client)
+        db.session.commit()
+        facility = Facility(name='No Owner Kennels')
+        db.session.add(facility)
+        db.session.commit()
+        with_client = Booking(status='completed', issued_by=client.id, facility_id=facility.id, booking_code='A1',
+                              check_in=datetime(2025, 3, 4), check_out=datetime(2025, 3, 6), number_of_dogs=1)
+        orphan = Booking(status='completed', facility_id=facility.id, booking_code='B2',
+                         check_in=datetime(2025, 3, 4), check_out=datetime(2025, 3, 6), number_of_dogs=1)
+        db.session.add_all([with_client, orphan])
+        db.session.commit()
+        metrics.reset()
+
+        with self.assertLogs(app.logger, 'WARNING'):
+            notify_completed_bookings([with_client.id, orphan.id])
+        db.session.commit()
+        self.assertEqual([message.recipient for message in OutboxMessage.query.all()], ['sam@example.com'])
+        # No facility owner for either booking and no client for the orphan
+        self.assertEqual(metrics.get_counter('notifications.unresolved'), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
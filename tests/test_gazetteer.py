@@ -0,0 +1,96 @@
+'''Tests for the offline gazetteer'''
+
+import os
+import tempfile
+import unittest
+from app import app, db, metrics
+from app.gazetteer import Gazetteer, build_gazetteer, reset_gazetteer
+from app.geocoding import geocode, stub_geocoder, clear_memory_cache
+
+
+POSTAL_CODES = (
+    'ZA\t8001\tCape Town\tWestern Cape\t\t\t\t\t\t-33.9249\t18.4241\t4\n'
+    'ZA\t2000\tJohannesburg\tGauteng\t\t\t\t\t\t-26.2041\t28.0473\t4\n'
+    'ZA\t2001\tJohannesburg\tGauteng\t\t\t\t\t\t-26.2000\t28.0400\t4\n'
+    'GB\tSW1A\tLondon\tEngland\t\t\t\t\t\t51.5010\t-0.1416\t4\n'
+)
+COUNTRIES = (
+    '#ISO\tISO3\tISO-Numeric\tfips\tCountry\n'
+    'ZA\tZAF\t710\tSF\tSouth Africa\n'
+)
+
+
+class GazetteerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.postal_path = os.path.join(self.directory.name, 'postal.txt')
+        self.countries_path = os.path.join(self.directory.name, 'countries.txt')
+        self.index_path = os.path.join(self.directory.name, 'gazetteer.sqlite')
+        with open(self.postal_path, 'w') as dump:
+            dump.write(POSTAL_CODES)
+        with open(self.countries_path, 'w') as info:
+            info.write(COUNTRIES)
+
+        build_gazetteer(self.index_path, self.postal_path, self.countries_path)
+        self.gazetteer = Gazetteer(self.index_path)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_load(self):
+        self.assertEqual(len(self.gazetteer), 4)
+
+    def test_rebuild_replaces_index(self):
+        with open(self.postal_path, 'a') as dump:
+            dump.write('ZA\t4001\tDurban\tKwaZulu-Natal\t\t\t\t\t\t-29.8587\t31.0218\t4\n')
+        self.assertEqual(build_gazetteer(self.index_path, self.postal_path), 5)
+        self.assertEqual(Gazetteer(self.index_path).lookup('Durban'), (-29.8587, 31.0218))
+        self.assertFalse(os.path.exists(self.index_path + '.partial'))
+
+    def test_lookup_by_postal_code(self):
+        self.assertEqual(self.gazetteer.lookup('1 Main Road, Johannesburg, 2001, South Africa'),
+                         (-26.2, 28.04))
+
+    def test_lookup_by_postal_code_and_place_without_country(self):
+        self.assertEqual(self.gazetteer.lookup('1 Main Road, Johannesburg, 2001, Atlantis'),
+                         (-26.2, 28.04))
+
+    def test_lookup_by_place(self):
+        self.assertEqual(self.gazetteer.lookup('Cape Town'), (-33.9249, 18.4241))
+        self.assertEqual(self.gazetteer.lookup('London, GB'), (51.501, -0.1416))
+
+    def test_miss(self):
+        self.assertIsNone(self.gazetteer.lookup('Durban, 4001, South Africa'))
+
+    def test_unknown_two_letter_part_is_not_a_country(self):
+        self.assertEqual(self.gazetteer.country_code('za'), 'ZA')
+        self.assertIsNone(self.gazetteer.country_code('NY'))
+        # Found by place name in any country instead of in a country "NY"
+        self.assertEqual(self.gazetteer.lookup('Cape Town, NY'), (-33.9249, 18.4241))
+
+    def test_geocode_uses_gazetteer(self):
+        app.config.from_object('config.TestConfig')
+        app.config['GAZETTEER_PATH'] = self.index_path
+        reset_gazetteer()
+        clear_memory_cache()
+        metrics.reset()
+        stub_geocoder.calls = 0
+        try:
+            with app.app_context():
+                db.create_all()
+                self.assertEqual(geocode('Cape Town, 8001, ZA', approximate=True), (-33.9249, 18.4241))
+                self.assertIsNone(geocode('Durban, 4001, ZA', approximate=True))
+                # Street addresses are saved, so they are never given a centroid
+                stub_geocoder.add('1 Beach Road, Cape Town, 8001, ZA', -33.91, 18.41)
+                self.assertEqual(geocode('1 Beach Road, Cape Town, 8001, ZA'), (-33.91, 18.41))
+                self.assertEqual(geocode('Cape Town, 8001, ZA', approximate=True), (-33.9249, 18.4241))
+                db.drop_all()
+        finally:
+            app.config['GAZETTEER_PATH'] = None
+            reset_gazetteer()
+        self.assertEqual(metrics.get_counter('gazetteer.hit'), 2)
+        self.assertEqual(stub_geocoder.calls, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
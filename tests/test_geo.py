@@ -0,0 +1,142 @@
+'''Tests for the geohash index and nearest facility lookup'''
+
+import random
+import unittest
+from types import SimpleNamespace
+from app import app, db
+from app.models import Facility
+from app.geo import encode_geohash, neighbour_cells, covered_radius, batch_distances, bounding_box
+from app.routes import get_nearest_facilities, rank_by_distance, get_facilities_within, listing_cache
+
+
+class GeohashTestCase(unittest.TestCase):
+    def test_encode_geohash(self):
+        '''Test encoding against a known geohash'''
+        self.assertEqual(encode_geohash(57.64911, 10.40744, 11), 'u4pruydqqvj')
+
+    def test_neighbour_cells(self):
+        '''Test the point's own cell is among its neighbours'''
+        cells = neighbour_cells(51.5074, -0.1278, 5)
+        self.assertEqual(len(cells), 9)
+        self.assertIn(encode_geohash(51.5074, -0.1278, 5), cells)
+
+    def test_covered_radius_shrinks_with_precision(self):
+        '''Test finer cells cover a smaller radius'''
+        self.assertGreater(covered_radius(0, 4), covered_radius(0, 5))
+
+    def test_bounding_box(self):
+        '''Test the box encloses the radius and wraps at the antimeridian'''
+        min_lat, max_lat, lon_ranges = bounding_box(0, 0, 111.2)
+        self.assertAlmostEqual(min_lat, -1.006, places=2)
+        self.assertAlmostEqual(max_lat, 1.006, places=2)
+        self.assertEqual(len(lon_ranges), 1)
+
+        _, _, lon_ranges = bounding_box(0, 179.5, 111.2)
+        self.assertEqual(len(lon_ranges), 2)
+        self.assertEqual(lon_ranges[1][0], -180.0)
+
+        _, _, lon_ranges = bounding_box(89.9, 0, 50)
+        self.assertEqual(lon_ranges, [(-180.0, 180.0)])
+
+    def test_batch_distances_close_to_geodesic(self):
+        '''Test the haversine distances are within 0.5% of the geodesic'''
+        latitudes = [-33.92, -29.86, 51.5074, 40.7128]
+        longitudes = [18.42, 31.02, -0.1278, -74.006]
+        fast = batch_distances(-26.2, 28.04, latitudes, longitudes)
+        exact = batch_distances(-26.2, 28.04, latitudes, longitudes, exact=True)
+        for approximate, geodesic in zip(fast, exact):
+            self.assertAlmostEqual(approximate / geodesic, 1, delta=0.005)
+
+
+class NearestFacilitiesTestCase(unittest.TestCase):
+    def setUp(self):
+        app.config.from_object('config.TestConfig')
+        self.app_context = app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        rng = random.Random(42)
+        for i in range(60):
+            db.session.add(Facility(name=f'Facility {i}',
+                                    latitude=-26.2 + rng.uniform(-2, 2),
+                                    longitude=28.04 + rng.uniform(-2, 2)))
+        db.session.add(Facility(name='No coordinates'))
+        db.session.commit()
+        self.user = SimpleNamespace(latitude=-26.2, longitude=28.04)
+        listing_cache.clear()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_geohash_set_on_insert(self):
+        '''Test the geohash is kept in sync with the coordinates'''
+        facility = Facility.query.filter_by(name='Facility 0').first()
+        self.assertEqual(facility.geohash, encode_geohash(facility.latitude, facility.longitude))
+        facility.latitude = 10.0
+        db.session.commit()
+        self.assertEqual(facility.geohash, encode_geohash(10.0, facility.longitude))
+
+    def test_matches_full_scan(self):
+        '''Test every page matches ranking all facilities by distance'''
+        located = Facility.query.filter(Facility.latitude.isnot(None)).all()
+        expected = [facility.id for facility, _ in rank_by_distance(located, self.user)]
+        for offset in range(0, 60, 5):
+            nearest, total = get_nearest_facilities(self.user, limit=5, offset=offset)
+            self.assertEqual(total, 60)
+            # Within a page the rows are in the order of their exact distances
+            self.assertEqual({facility.id for facility, _ in nearest}, set(expected[offset:offset + 5]))
+            distances = [distance for _, distance in nearest]
+            self.assertEqual(distances, sorted(distances))
+
+    def test_total_cached(self):
+        '''Test the number of located facilities is only counted once'''
+        get_nearest_facilities(self.user, limit=5)
+        self.assertEqual(listing_cache.get('located_facility_count'), 60)
+        db.session.add(Facility(name='Unlisted', latitude=-26.2, longitude=28.04))
+        db.session.commit()
+        _, total = get_nearest_facilities(self.user, limit=5)
+        self.assertEqual(total, 60)
+
+    def test_page_sorted_by_exact_distance(self):
+        '''Test the rows of a page are in the order of their displayed distances'''
+        # Ranked the other way round by the haversine distance
+        north = Facility(name='North', latitude=0.9, longitude=0)
+        east = Facility(name='East', latitude=0, longitude=0.899)
+        db.session.add_all([north, east])
+        db.session.commit()
+        user = SimpleNamespace(latitude=0, longitude=0)
+        ranked = rank_by_distance([north, east], user)
+        self.assertEqual([facility.name for facility, _ in ranked], ['East', 'North'])
+
+        nearest, _ = get_nearest_facilities(user, limit=2)
+        self.assertEqual([facility.name for facility, _ in nearest], ['North', 'East'])
+        self.assertLess(nearest[0][1], nearest[1][1])
+
+    def test_facilities_within_radius(self):
+        '''Test the radius search matches filtering every facility'''
+        located = Facility.query.filter(Facility.latitude.isnot(None)).all()
+        ranked = rank_by_distance(located, self.user)
+        expected = [facility.id for facility, distance in ranked if distance <= 100]
+
+        within = get_facilities_within(self.user.latitude, self.user.longitude, 100)
+        self.assertEqual([facility_id for facility_id, _ in within], expected)
+        self.assertTrue(0 < len(within) < 60)
+
+        nearest = get_facilities_within(self.user.latitude, self.user.longitude, 100, limit=3)
+        self.assertEqual(nearest, within[:3])
+
+    def test_facility_at_box_edge(self):
+        '''Test a facility inside the radius but beyond the spherical box is found'''
+        # 19.96 km along the geodesic, but 20.07 km on the sphere
+        edge = Facility(name='Edge', latitude=0.1805, longitude=10)
+        db.session.add(edge)
+        db.session.commit()
+        within = get_facilities_within(0, 10, 20)
+        self.assertEqual([facility_id for facility_id, _ in within], [edge.id])
+        self.assertLess(within[0][1], 20)
+
+
+if __name__ == '__main__':
+    unittest.main()
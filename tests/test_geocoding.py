@@ -0,0 +1,150 @@
+'''Tests for geocoding and the geocode cache'''
+
+import unittest
+from unittest import mock
+import requests
+from datetime import datetime, timedelta
+from app import app, db, metrics
+from app.models import GeocodeCache
+from app.geocoding import geocode, normalize_address, stub_geocoder, clear_memory_cache
+from app.geocoding import CircuitBreaker, GeocodingClient, GeocodingError, CircuitOpenError
+
+
+class GeocodingTestCase(unittest.TestCase):
+    def setUp(self):
+        app.config.from_object('config.TestConfig')
+        self.app_context = app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        clear_memory_cache()
+        metrics.reset()
+        stub_geocoder.addresses.clear()
+        stub_geocoder.calls = 0
+        stub_geocoder.add('1 Main Road, Cape Town, 8001, South Africa', -33.92, 18.42)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_normalize_address(self):
+        self.assertEqual(normalize_address(' 1  Main Road,Cape Town , 8001,, South Africa '),
+                         '1 main road, cape town, 8001, south africa')
+
+    def test_repeat_lookup_is_cached(self):
+        self.assertEqual(geocode('1 Main Road, Cape Town, 8001, South Africa'), (-33.92, 18.42))
+        self.assertEqual(geocode('1 main road,  cape town, 8001, south africa'), (-33.92, 18.42))
+        self.assertEqual(stub_geocoder.calls, 1)
+        self.assertEqual(metrics.get_counter('geocode_cache.miss'), 1)
+        self.assertEqual(metrics.get_counter('geocode_cache.hit'), 1)
+
+    def test_cache_is_persistent(self):
+        geocode('1 Main Road, Cape Town, 8001, South Africa')
+        clear_memory_cache()
+        self.assertEqual(geocode('1 Main Road, Cape Town, 8001, South Africa'), (-33.92, 18.42))
+        self.assertEqual(stub_geocoder.calls, 1)
+        self.assertEqual(GeocodeCache.query.one().hits, 1)
+
+    def test_negative_caching(self):
+        self.assertIsNone(geocode('Nowhere'))
+        self.assertIsNone(geocode('Nowhere'))
+        self.assertEqual(stub_geocoder.calls, 1)
+        self.assertIsNone(GeocodeCache.query.one().latitude)
+
+    def test_expired_entry_is_refreshed(self):
+        geocode('1 Main Road, Cape Town, 8001, South Africa')
+        entry = GeocodeCache.query.one()
+        entry.expires_at = datetime.now() - timedelta(seconds=1)
+        db.session.commit()
+        clear_memory_cache()
+
+        geocode('1 Main Road, Cape Town, 8001, South Africa')
+        self.assertEqual(stub_geocoder.calls, 2)
+        self.assertEqual(GeocodeCache.query.count(), 1)
+
+    def test_metrics_endpoint(self):
+        geocode('Nowhere')
+        response = app.test_client().get('/metrics')
+        self.assertEqual(response.json['counters']['geocode_cache.miss'], 1)
+
+    def test_stale_entry_served_when_provider_fails(self):
+        geocode('1 Main Road, Cape Town, 8001, South Africa')
+        entry = GeocodeCache.query.one()
+        entry.expires_at = datetime.now() - timedelta(seconds=1)
+        db.session.commit()
+        clear_memory_cache()
+
+        with mock.patch.object(stub_geocoder, 'lookup', side_effect=CircuitOpenError('open')):
+            self.assertEqual(geocode('1 Main Road, Cape Town, 8001, South Africa'), (-33.92, 18.42))
+            with self.assertRaises(GeocodingError):
+                geocode('Somewhere never cached')
+        self.assertEqual(metrics.get_counter('geocode_cache.stale'), 1)
+
+
+class CircuitBreakerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.now = 0
+        self.breaker = CircuitBreaker(threshold=2, reset_timeout=30, clock=lambda: self.now)
+
+    def test_opens_after_threshold(self):
+        self.breaker.record_failure()
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, 'open')
+        self.assertFalse(self.breaker.allow())
+
+    def test_half_open_trial(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.now = 31
+        self.assertTrue(self.breaker.allow())
+        self.assertFalse(self.breaker.allow())
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, 'open')
+
+        self.now = 62
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, 'closed')
+        self.assertTrue(self.breaker.allow())
+
+
+class GeocodingClientTestCase(unittest.TestCase):
+    def setUp(self):
+        metrics.reset()
+        self.client = GeocodingClient(retries=2, backoff=0, breaker=CircuitBreaker(threshold=1))
+
+    def response(self, status_code, data=None):
+        response = mock.Mock(status_code=status_code)
+        response.json.return_value = data
+        return response
+
+    def test_retries_then_succeeds(self):
+        with mock.patch.object(self.client.session, 'get', side_effect=[
+            requests.ConnectionError('refused'), self.response(503), self.response(200, {'ok': 1})
+        ]) as get:
+            self.assertEqual(self.client.get_json('https://geo.example', 'Test'), {'ok': 1})
+        self.assertEqual(get.call_count, 3)
+        self.assertEqual(get.call_args.kwargs['timeout'], self.client.timeout)
+        self.assertEqual(metrics.snapshot()['timings']['geocoding.upstream_latency']['count'], 3)
+
+    def test_client_error_is_not_retried(self):
+        with mock.patch.object(self.client.session, 'get', return_value=self.response(403)) as get:
+            with self.assertRaises(GeocodingError):
+                self.client.get_json('https://geo.example', 'Test')
+        self.assertEqual(get.call_count, 1)
+        self.assertEqual(self.client.breaker.state, 'closed')
+
+    def test_fails_fast_when_open(self):
+        with mock.patch.object(self.client.session, 'get', side_effect=requests.Timeout('slow')) as get:
+            with self.assertRaises(GeocodingError):
+                self.client.get_json('https://geo.example', 'Test')
+            with self.assertRaises(CircuitOpenError):
+                self.client.get_json('https://geo.example', 'Test')
+        self.assertEqual(get.call_count, 3)
+        self.assertEqual(metrics.get_counter('geocoding.circuit_rejected'), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,10 @@
 '''Test the home page'''
 
+from sqlalchemy import event
 from app import app, db
+from app.models import DogOwner, Facility
+from urllib.parse import unquote
+import re
 import unittest
 
 class BasicTestCase(unittest.TestCase):
@@ -28,6 +32,50 @@ class BasicTestCase(unittest.TestCase):
         response = self.app.get('/index')
         self.assertEqual(response.status_code, 200)
 
+    def test_index_page_anonymous_skips_listing(self):
+        '''Test the landing page doesn't query the facilities for visitors'''
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        with app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', listener)
+            try:
+                response = self.app.get('/index')
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', listener)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([statement for statement in statements if 'FROM facility' in statement])
+
+    def test_index_page_cursor(self):
+        '''Test the index page with valid and invalid keyset cursors'''
+        for cursor in ('4.5:12', 'not-a-cursor'):
+            response = self.app.get(f'/index?after={cursor}')
+            self.assertEqual(response.status_code, 200)
+        for cursor in ('nan:12', 'inf:12', '-inf:3'):
+            response = self.app.get(f'/index?after={cursor}')
+            self.assertEqual(response.status_code, 400)
+
+    def test_index_next_link(self):
+        '''Test that the listing without a location links to the next page by cursor'''
+        with app.app_context():
+            user = DogOwner(first_name='Sam', email='sam@example.com')
+            db.session.add(user)
+            db.session.add_all([Facility(name=f'Facility {number}', avg_rating=number) for number in range(7)])
+            db.session.commit()
+            user_id = user.id
+        with self.app.session_transaction() as session:
+            session['_user_id'] = str(user_id)
+
+        html = self.app.get('/index').get_data(as_text=True)
+        self.assertIn('Facility 6', html)
+        self.assertNotIn('Facility 1<', html)
+        after = unquote(re.search(r'href="/index\?after=([^"]+)"', html).group(1))
+        self.assertEqual(after, '2.0:3')
+
+        html = self.app.get(f'/index?after={after}').get_data(as_text=True)
+        self.assertIn('Facility 1', html)
+        self.assertNotIn('Facility 2', html)
+        self.assertNotIn('/index?after=', html)
+
     def test_login_page(self):
         '''Test the login page'''
         response = self.app.get('/login')
@@ -0,0 +1,121 @@
+'''Tests for the scheduler leader lease'''
+
+import unittest
+from datetime import datetime, timedelta
+from app import app, db, metrics, scheduler
+from app.models import SchedulerLease
+from app.leader import LeaderLease
+
+
+class LeaderLeaseTestCase(unittest.TestCase):
+    def setUp(self):
+        app.config.from_object('config.TestConfig')
+        self.app_context = app.app_context()
+        self.app_context.push()
+        db.create_all()
+        metrics.reset()
+        self.events = []
+        self.first = self.lease('first')
+        self.second = self.lease('second')
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def lease(self, name):
+        lease = LeaderLease('scheduler', ttl=30, on_elected=lambda: self.events.append((name, 'elected')),
+                            on_deposed=lambda: self.events.append((name, 'deposed')))
+        lease.holder = name
+        return lease
+
+    def stored(self):
+        db.session.expire_all()
+        return db.session.get(SchedulerLease, 'scheduler')
+
+    def test_one_holder_at_a_time(self):
+        now = datetime.now()
+        self.assertTrue(self.first.try_acquire(now))
+        self.assertFalse(self.second.try_acquire(now))
+        self.assertTrue(self.first.try_acquire(now + timedelta(seconds=10)))
+        self.assertTrue(self.first.is_leader())
+        self.assertFalse(self.second.is_leader())
+        lease = self.stored()
+        self.assertEqual((lease.holder, lease.term), ('first', 1))
+        self.assertEqual(lease.expires_at, now + timedelta(seconds=40))
+
+    def test_failover_after_expiry(self):
+        now = datetime.now()
+        self.first.try_acquire(now)
+        self.assertFalse(self.second.try_acquire(now + timedelta(seconds=29)))
+        self.assertTrue(self.second.try_acquire(now + timedelta(seconds=31)))
+        self.assertEqual((self.stored().holder, self.stored().term), ('second', 2))
+
+        # The old leader can't renew once the lease has moved on
+        self.assertFalse(self.first.try_acquire(now + timedelta(seconds=32)))
+        self.assertFalse(self.first.is_leader())
+
+    def test_release_hands_over_at_once(self):
+        self.first.try_acquire()
+        self.first.release()
+        self.assertFalse(self.first.is_leader())
+        self.assertTrue(self.second.try_acquire())
+
+    def test_heartbeat_reports_changes(self):
+        self.first.heartbeat()
+        self.second.heartbeat()
+        self.first.heartbeat()
+        self.assertEqual(self.events, [('first', 'elected')])
+        self.assertEqual(metrics.snapshot()['gauges']['scheduler.leader'], 1)
+
+        # first stalls past the lease and second takes over
+        self.assertTrue(self.second.try_acquire(datetime.now() + timedelta(seconds=31)))
+        self.first.heartbeat()
+        self.assertEqual(self.events, [('first', 'elected'), ('first', 'deposed')])
+        self.assertEqual(metrics.snapshot()['gauges']['scheduler.leader'], 0)
+        self.assertEqual(metrics.get_counter('scheduler.deposed'), 1)
+
+    def test_leader_only_jobs(self):
+        runs = []
+        job = self.second.leader_only(lambda: runs.append('ran'))
+        self.first.try_acquire()
+        self.second.try_acquire()
+        job()
+        self.assertEqual(runs, [])
+        self.assertEqual(metrics.get_counter('scheduler.skipped'), 1)
+
+        self.first.release()
+        self.second.try_acquire()
+        job()
+        self.assertEqual(runs, ['ran'])
+
+    def test_release_without_lease_table(self):
+        self.assertTrue(self.first.try_acquire())
+        SchedulerLease.__table__.drop(db.engine)
+        with self.assertLogs(app.logger, 'WARNING'):
+            self.first.release()
+        self.assertFalse(self.first.is_leader())
+        SchedulerLease.__table__.create(db.engine)
+
+    def test_scheduler_started_explicitly(self):
+        from app.routes import start_scheduler
+        # Importing the routes doesn't start anything
+        self.assertFalse(scheduler.running)
+        self.assertEqual(scheduler.get_jobs(), [])
+        start_scheduler()
+        try:
+            self.assertTrue(scheduler.running)
+            self.assertEqual([job.id for job in scheduler.get_jobs()], ['update_bookings'])
+        finally:
+            scheduler.shutdown(wait=False)
+            scheduler.remove_all_jobs()
+
+    def test_disabled_lease_always_leads(self):
+        lease = LeaderLease('scheduler', enabled=False)
+        self.assertTrue(lease.is_leader())
+        lease.heartbeat()
+        self.assertIsNone(self.stored())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+'''Tests for the batched mail dispatcher'''
+
+import unittest
+from app import app, mail, metrics, Message
+from app.mailer import MailDispatcher
+from app.smtp_stub import StubSMTPServer
+
+
+class MailDispatcherTestCase(unittest.TestCase):
+    def setUp(self):
+        app.config.from_object('config.TestConfig')
+        self.app_context = app.app_context()
+        self.app_context.push()
+        metrics.reset()
+
+        self.smtp = StubSMTPServer().start()
+        self.saved_config = {key: app.config.get(key) for key in
+                             ('MAIL_SERVER', 'MAIL_PORT', 'MAIL_USE_SSL', 'MAIL_USE_TLS', 'MAIL_SUPPRESS_SEND')}
+        app.config.update(MAIL_SERVER=self.smtp.host, MAIL_PORT=self.smtp.port, MAIL_USE_SSL=False,
+                          MAIL_USE_TLS=False, MAIL_SUPPRESS_SEND=False)
+        mail.init_app(app)
+
+    def tearDown(self):
+        self.smtp.stop()
+        app.config.update(self.saved_config)
+        if self.saved_config['MAIL_SUPPRESS_SEND'] is None:
+            app.config.pop('MAIL_SUPPRESS_SEND')
+        mail.init_app(app)
+        self.app_context.pop()
+
+    def messages(self, count):
+        return [Message(f'Message {number}', sender='noreply@example.com', html='<p>Hi</p>',
+                        recipients=[f'owner{number}@example.com']) for number in range(count)]
+
+    def test_one_connection_for_many_messages(self):
+        dispatcher = MailDispatcher()
+        self.assertEqual(dispatcher.send_all(self.messages(20)), [None] * 20)
+        self.assertEqual(self.smtp.connections, 1)
+        self.assertEqual([message.subject for message in self.smtp.messages],
+                         [f'Message {number}' for number in range(20)])
+        self.assertEqual((dispatcher.stats.sent, dispatcher.stats.connections), (20, 1))
+        self.assertGreater(dispatcher.stats.throughput, 0)
+
+    def test_messages_per_connection_capped(self):
+        dispatcher = MailDispatcher(max_per_connection=3)
+        dispatcher.send_all(self.messages(10))
+        self.assertEqual(self.smtp.connections, 4)
+        self.assertEqual(len(self.smtp.messages), 10)
+        self.assertEqual(metrics.get_counter('mail.connections'), 4)
+
+    def test_reconnects_when_server_drops_connection(self):
+        self.smtp.drop_after = 4
+        dispatcher = MailDispatcher()
+        self.assertEqual(dispatcher.send_all(self.messages(10)), [None] * 10)
+        self.assertEqual(len(self.smtp.messages), 10)
+        self.assertEqual(self.smtp.connections, 3)
+        self.assertEqual(dispatcher.stats.reconnects, 2)
+        self.assertEqual(metrics.get_counter('mail.reconnects'), 2)
+
+    def test_message_error_keeps_connection(self):
+        self.smtp.fail(1)
+        dispatcher = MailDispatcher()
+        errors = dispatcher.send_all(self.messages(3))
+        self.assertIn('451', errors[0])
+        self.assertEqual(errors[1:], [None, None])
+        self.assertEqual(self.smtp.connections, 1)
+        self.assertEqual((dispatcher.stats.sent, dispatcher.stats.failed), (2, 1))
+
+    def test_server_down(self):
+        self.smtp.stop()
+        errors = MailDispatcher().send_all(self.messages(2))
+        self.assertTrue(all(errors))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+'''Tests for the email outbox'''
+
+import unittest
+from datetime import datetime, timedelta
+from flask import g
+from app import app, db, mail
+from app.models import DogOwner, FacilityOwner, Facility, Booking, OutboxMessage
+from app.outbox import enqueue, drain_outbox
+from app.smtp_stub import StubSMTPServer
+
+
+class OutboxTestCase(unittest.TestCase):
+    def setUp(self):
+        app.config.from_object('config.TestConfig')
+        self.app_context = app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        # Deliver to a local SMTP server instead of suppressing mail
+        self.smtp = StubSMTPServer().start()
+        self.saved_config = {key: app.config.get(key) for key in
+                             ('MAIL_SERVER', 'MAIL_PORT', 'MAIL_USE_SSL', 'MAIL_USE_TLS', 'MAIL_SUPPRESS_SEND')}
+        app.config.update(MAIL_SERVER=self.smtp.host, MAIL_PORT=self.smtp.port, MAIL_USE_SSL=False,
+                          MAIL_USE_TLS=False, MAIL_SUPPRESS_SEND=False)
+        mail.init_app(app)
+
+    def tearDown(self):
+        self.smtp.stop()
+        app.config.update(self.saved_config)
+        if self.saved_config['MAIL_SUPPRESS_SEND'] is None:
+            app.config.pop('MAIL_SUPPRESS_SEND')
+        mail.init_app(app)
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def make_due(self):
+        OutboxMessage.query.update({'next_attempt_at': datetime.now() - timedelta(seconds=1)})
+        db.session.commit()
+
+    def test_enqueued_with_the_transaction(self):
+        enqueue('rolled@example.com', 'Rolled back', '<p>No</p>')
+        db.session.rollback()
+        enqueue('owner@example.com', 'Booking created', '<p>Hi</p>', sender='noreply@example.com')
+        db.session.commit()
+
+        self.assertEqual(drain_outbox(), {'sent': 1})
+        self.assertEqual([message.subject for message in self.smtp.messages], ['Booking created'])
+        self.assertEqual(self.smtp.messages[0].recipients, ['owner@example.com'])
+        message = OutboxMessage.query.one()
+        self.assertEqual((message.status, message.attempts), ('sent', 1))
+        self.assertIsNotNone(message.sent_at)
+        self.assertEqual(drain_outbox(), {})
+
+    def test_failed_delivery_retried_with_backoff(self):
+        enqueue('owner@example.com', 'Retry me', '<p>Hi</p>', sender='noreply@example.com')
+        db.session.commit()
+        self.smtp.fail(1)
+
+        self.assertEqual(drain_outbox(), {'failed': 1})
+        message = OutboxMessage.query.one()
+        self.assertEqual((message.status, message.attempts), ('pending', 1))
+        self.assertIn('451', message.last_error)
+        self.assertGreater(message.next_attempt_at, datetime.now())
+
+        # Not due yet, then delivered once the backoff has passed
+        self.assertEqual(drain_outbox(), {})
+        self.make_due()
+        self.assertEqual(drain_outbox(), {'sent': 1})
+        self.assertEqual(len(self.smtp.messages), 1)
+
+    def test_dead_letter_after_max_attempts(self):
+        app.config['OUTBOX_MAX_ATTEMPTS'] = 2
+        enqueue('owner@example.com', 'Give up', '<p>Hi</p>', sender='noreply@example.com')
+        enqueue(None, 'Nobody', '<p>Hi</p>', sender='noreply@example.com')
+        db.session.commit()
+        self.smtp.fail(2)
+
+        drain_outbox()
+        self.make_due()
+        drain_outbox()
+        statuses = dict(db.session.query(OutboxMessage.subject, OutboxMessage.status).all())
+        self.assertEqual(statuses, {'Give up': 'dead', 'Nobody': 'dead'})
+        self.assertEqual(self.smtp.messages, [])
+
+    def test_stale_claim_is_taken_over(self):
+        message = enqueue('owner@example.com', 'Stuck', '<p>Hi</p>', sender='noreply@example.com')
+        message.status, message.claimed_by = 'sending', 'crashed-worker'
+        message.claimed_at = datetime.now() - timedelta(seconds=app.config['OUTBOX_CLAIM_TIMEOUT'] + 1)
+        db.session.commit()
+        self.assertEqual(drain_outbox(), {'sent': 1})
+
+    def test_batch_shares_connections(self):
+        app.config['OUTBOX_WORKERS'] = 2
+        for number in range(10):
+            enqueue(f'owner{number}@example.com', f'Message {number}', '<p>Hi</p>', sender='noreply@example.com')
+        db.session.commit()
+
+        self.assertEqual(drain_outbox(), {'sent': 10})
+        self.assertEqual(len(self.smtp.messages), 10)
+        self.assertEqual(self.smtp.connections, 2)
+
+    def test_booking_change_and_emails_committed_together(self):
+        dog_owner = DogOwner(first_name='Sam', email='sam@example.com')
+        facility_owner = FacilityOwner(first_name='Alex', email='alex@example.com')
+        db.session.add_all([dog_owner, facility_owner])
+        db.session.commit()
+        facility = Facility(name='Pet Palace', owner_id=facility_owner.id, contact_email='palace@example.com')
+        db.session.add(facility)
+        db.session.commit()
+        booking = Booking(status='pending', issued_by=dog_owner.id, facility_id=facility.id, booking_code='ABC123',
+                          check_in=datetime.now() + timedelta(days=1), check_out=datetime.now() + timedelta(days=2))
+        db.session.add(booking)
+        db.session.commit()
+
+        client = app.test_client()
+        g.pop('_login_user', None)
+        with client.session_transaction() as session:
+            session['_user_id'] = str(facility_owner.id)
+        response = client.get(f'/facility_owner/accept_booking/{booking.id}')
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(OutboxMessage.query.count(), 2)
+        self.assertEqual(self.smtp.messages, [])
+
+        drain_outbox()
+        self.assertEqual(sorted(message.recipients[0] for message in self.smtp.messages),
+                         ['palace@example.com', 'sam@example.com'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+'''Tests for the schedule rules and the recurring booking endpoint'''
+
+import unittest
+from datetime import date, datetime, timedelta
+from flask import g
+from app import app, db
+from app.models import DogOwner, FacilityOwner, Facility, Booking, FacilityOccupancy, OutboxMessage, CacheVersion
+from app.schedules import parse_weekdays, occurrences, ScheduleError
+
+
+class ScheduleTestCase(unittest.TestCase):
+    def test_parse_weekdays(self):
+        self.assertEqual(parse_weekdays('mon-fri'), [0, 1, 2, 3, 4])
+        self.assertEqual(parse_weekdays(['Monday', 'wed', 'fri']), [0, 2, 4])
+        self.assertEqual(parse_weekdays('sat-sun,mon'), [0, 5, 6])
+        for days in ('fri-mon', 'someday', [1], [], 5, None, {'mon': True}):
+            with self.assertRaises(ScheduleError):
+                parse_weekdays(days)
+
+    def test_occurrences(self):
+        # 2025-03-05 is a Wednesday
+        days = occurrences(date(2025, 3, 5), [0, 1, 2, 3, 4], 2)
+        self.assertEqual(len(days), 10)
+        self.assertEqual(days[0], date(2025, 3, 5))
+        self.assertEqual(days[-1], date(2025, 3, 18))
+        self.assertTrue(all(day.weekday() < 5 for day in days))
+
+
+class RecurringBookingTestCase(unittest.TestCase):
+    def setUp(self):
+        app.config.from_object('config.TestConfig')
+        self.app_context = app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = app.test_client()
+
+        self.dog_owner = DogOwner(first_name='Sam', email='sam@example.com')
+        self.owner = FacilityOwner(first_name='Alex', email='alex@example.com')
+        db.session.add_all([self.dog_owner, self.owner])
+        db.session.commit()
+        self.facility = Facility(name='Pet Palace', owner_id=self.owner.id, capacity=3,
+                                 contact_email='palace@example.com')
+        db.session.add(self.facility)
+        db.session.commit()
+        # A Monday at least a week away
+        self.start = date.today() + timedelta(days=7 - date.today().weekday() + 7)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def post(self, **data):
+        g.pop('_login_user', None)
+        with self.client.session_transaction() as session:
+            session['_user_id'] = str(self.dog_owner.id)
+        return self.client.post('/dog_owner/recurring_booking', json={
+            'facility_id': self.facility.id, 'start': self.start.isoformat(), **data})
+
+    def test_weekday_series(self):
+        response = self.post(days='mon-fri', weeks=2, number_of_dogs=2, notes='Lunch at noon')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json['count'], 10)
+
+        bookings = Booking.query.order_by(Booking.check_in).all()
+        self.assertEqual(len(bookings), 10)
+        self.assertEqual(len({booking.booking_code for booking in bookings}), 10)
+        self.assertTrue(all(booking.check_in == booking.check_out and booking.check_in.weekday() < 5
+                            and booking.status == 'pending' and booking.number_of_dogs == 2 for booking in bookings))
+        self.assertEqual(bookings[0].check_in, datetime.combine(self.start, datetime.min.time()))
+        self.assertEqual(FacilityOccupancy.query.filter_by(dogs=2).count(), 10)
+        self.assertIsNotNone(db.session.get(CacheVersion, f'facility:{self.facility.id}'))
+
+        # One summary email to each side
+        messages = OutboxMessage.query.order_by(OutboxMessage.recipient).all()
+        self.assertEqual([message.recipient for message in messages], ['palace@example.com', 'sam@example.com'])
+        self.assertIn('10 Bookings', messages[1].subject)
+        self.assertTrue(all(booking.booking_code in messages[0].html for booking in bookings))
+
+    def test_series_rejected_when_any_day_is_full(self):
+        self.assertEqual(self.post(days='wed', weeks=1, number_of_dogs=2).status_code, 201)
+        response = self.post(days='mon-fri', weeks=1, number_of_dogs=2)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json['full_days'], [(self.start + timedelta(days=2)).isoformat()])
+        # Nothing of the rejected series is kept
+        self.assertEqual(Booking.query.count(), 1)
+        self.assertEqual(OutboxMessage.query.count(), 2)
+        self.assertEqual(FacilityOccupancy.query.filter(FacilityOccupancy.dogs > 0).count(), 1)
+
+    def test_boarding_nights(self):
+        response = self.post(days='fri', weeks=2, nights=2)
+        self.assertEqual(response.status_code, 201)
+        booking = Booking.query.order_by(Booking.check_in).first()
+        self.assertEqual((booking.check_out - booking.check_in).days, 2)
+        self.assertEqual(FacilityOccupancy.query.filter_by(dogs=1).count(), 4)
+
+    def test_invalid_schedules(self):
+        self.assertEqual(self.post(days='someday').status_code, 400)
+        self.assertEqual(self.post(weeks='many').status_code, 400)
+        self.assertEqual(self.post(weeks=52).status_code, 400)
+        self.assertEqual(self.post(start=(date.today() - timedelta(days=1)).isoformat()).status_code, 400)
+        self.assertEqual(self.post(facility_id=999).status_code, 404)
+        self.assertEqual(self.post(days=5).status_code, 400)
+        self.assertEqual(self.post(days=None).status_code, 400)
+        self.assertEqual(self.post(daycare='false').status_code, 400)
+        self.assertEqual(self.post(notes=['x']).status_code, 400)
+        self.assertEqual(self.post(daycare=False, boarding=False).status_code, 400)
+        for value in (True, 1.9, '2'):
+            self.assertEqual(self.post(weeks=value).status_code, 400)
+            self.assertEqual(self.post(nights=value).status_code, 400)
+            self.assertEqual(self.post(number_of_dogs=value).status_code, 400)
+        response = self.client.post('/dog_owner/recurring_booking', json=[self.facility.id])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Booking.query.count(), 0)
+
+    def test_overlapping_stays_rejected(self):
+        response = self.post(days='mon-fri', weeks=1, nights=3)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('overlap', response.json['error'])
+        # Nor across the weeks, Sunday to the next Monday is one night
+        self.assertEqual(self.post(days='mon,sun', weeks=2, nights=2).status_code, 400)
+        self.assertEqual(Booking.query.count(), 0)
+        self.assertEqual(FacilityOccupancy.query.filter(FacilityOccupancy.dogs > 0).count(), 0)
+
+        # Checking out on the day of the next check-in is fine
+        self.assertEqual(self.post(days='mon,wed', weeks=1, nights=2).status_code, 201)
+        self.assertEqual(FacilityOccupancy.query.filter(FacilityOccupancy.dogs > 1).count(), 0)
+
+    def test_facility_without_owner(self):
+        self.facility.owner_id = None
+        db.session.commit()
+        response = self.post(days='mon', weeks=1)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(Booking.query.count(), 0)
+        self.assertEqual(FacilityOccupancy.query.filter(FacilityOccupancy.dogs > 0).count(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -43,6 +43,44 @@ class ReviewModelTestCase(unittest.TestCase):
         db.session.delete(review)
         db.session.commit()
         self.assertIsNone(Review.query.first())
+        self.assertEqual(self.facility.review_count, 0)
+
+    def add_reviews(self, *ratings):
+        reviews = [Review(rating=rating, user_id=self.user.id, facility_id=self.facility.id) for rating in ratings]
+        db.session.add_all(reviews)
+        db.session.commit()
+        return reviews
+
+    def test_rating_counters(self):
+        self.add_reviews(5.0, 4.0, 3.0)
+        self.assertEqual(self.facility.review_count, 3)
+        self.assertEqual(self.facility.rating_sum, 12.0)
+        self.assertEqual(self.facility.avg_rating, 4.0)
+
+    def test_soft_delete_updates_counters(self):
+        reviews = self.add_reviews(5.0, 2.0)
+        reviews[1].soft_delete()
+        db.session.commit()
+        self.assertEqual(self.facility.review_count, 1)
+        self.assertEqual(self.facility.avg_rating, 5.0)
+
+        reviews[0].soft_delete()
+        db.session.commit()
+        self.assertEqual(self.facility.review_count, 0)
+        self.assertEqual(self.facility.avg_rating, 0)
+
+    def test_rebuild_ratings_command(self):
+        self.add_reviews(5.0, 3.0)
+        self.facility.review_count = 0
+        self.facility.rating_sum = 0
+        self.facility.avg_rating = 0
+        db.session.commit()
+
+        result = app.test_cli_runner().invoke(args=['rebuild-ratings'])
+        self.assertIn('Rebuilt ratings for 1 facilities.', result.output)
+        db.session.expire_all()
+        self.assertEqual(self.facility.review_count, 2)
+        self.assertEqual(self.facility.avg_rating, 4.0)
 
 if __name__ == '__main__':
     unittest.main()
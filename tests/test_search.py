@@ -0,0 +1,106 @@
+'''Tests for the facility full-text search'''
+
+import unittest
+from app import app, db
+from app.models import Facility
+from app.search import search_facility_ids
+from app.geocoding import stub_geocoder
+from app.routes import search_cache
+
+
+class SearchTestCase(unittest.TestCase):
+    def setUp(self):
+        app.config.from_object('config.TestConfig')
+        self.app_context = app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        self.pool = Facility(name='Splash Dog Hotel', description='Boarding with a heated pool',
+                             location='1 Beach Road, Cape Town, 8001, South Africa',
+                             latitude=-33.92, longitude=18.42)
+        self.daycare = Facility(name='Happy Paws Daycare', description='Daycare and grooming',
+                                amenities='Swimming pool', location='5 Long Street, Johannesburg, 2000, South Africa',
+                                latitude=-26.20, longitude=28.04)
+        db.session.add_all([self.pool, self.daycare])
+        db.session.commit()
+        search_cache.clear()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_search_ranks_matches(self):
+        self.assertEqual(search_facility_ids('pool'), [self.pool.id, self.daycare.id])
+        self.assertEqual(search_facility_ids('daycare'), [self.daycare.id])
+        self.assertEqual(search_facility_ids('cape town'), [self.pool.id])
+
+    def test_search_matches_prefixes_and_ignores_syntax(self):
+        self.assertEqual(search_facility_ids('groom'), [self.daycare.id])
+        self.assertEqual(search_facility_ids('"paws" (*'), [self.daycare.id])
+        self.assertEqual(search_facility_ids('!!!'), [])
+
+    def test_index_follows_updates_and_deletes(self):
+        self.daycare.description = 'Agility training'
+        db.session.commit()
+        self.assertEqual(search_facility_ids('grooming'), [])
+        self.assertEqual(search_facility_ids('agility'), [self.daycare.id])
+
+        db.session.delete(self.daycare)
+        db.session.commit()
+        self.assertEqual(search_facility_ids('agility'), [])
+
+    def test_search_route(self):
+        client = app.test_client()
+        response = client.post('/search_facility', data={'location': 'pool'})
+        self.assertEqual(response.status_code, 302)
+        with client.session_transaction() as session:
+            self.assertEqual(session['search'], 'text:pool')
+        self.assertEqual(search_cache.get('text:pool'), [self.pool.id, self.daycare.id])
+
+        response = client.get('/search_results')
+        self.assertEqual(response.status_code, 200)
+        self.assertLess(response.data.index(b'Splash Dog Hotel'), response.data.index(b'Happy Paws Daycare'))
+
+    def test_search_results_shared_and_rerun_on_miss(self):
+        client = app.test_client()
+        client.post('/search_facility', data={'location': '  POOL '})
+        search_cache.clear()
+        with client.session_transaction() as session:
+            session['search'] = 'text:pool'
+        response = client.get('/search_results?page=1')
+        self.assertIn(b'Splash Dog Hotel', response.data)
+        self.assertEqual(search_cache.get('text:pool'), [self.pool.id, self.daycare.id])
+
+    def test_radius_search_route(self):
+        stub_geocoder.add('Stellenbosch', -33.93, 18.86)
+        client = app.test_client()
+        response = client.post('/search_facility', data={'location': 'Stellenbosch', 'radius': '100'})
+        self.assertEqual(response.status_code, 302)
+        with client.session_transaction() as session:
+            self.assertEqual(session['search'], 'radius:100:stellenbosch')
+        self.assertEqual(search_cache.get('radius:100:stellenbosch'), [self.pool.id])
+
+    def test_radius_validated(self):
+        client = app.test_client()
+        self.assertIn(b'name="radius"', client.get('/search_facility').data)
+        for radius in ('900', '0', 'far'):
+            response = client.post('/search_facility', data={'location': 'pool', 'radius': radius})
+            self.assertEqual(response.status_code, 302)
+            with client.session_transaction() as session:
+                self.assertNotIn('search', session)
+                self.assertTrue(any(message.startswith('Within (km)') for _, message in session['_flashes']))
+                session.pop('_flashes')
+
+    def test_long_query_rejected(self):
+        client = app.test_client()
+        response = client.post('/search_facility', data={'location': 'pool ' + 'x' * 100})
+        self.assertEqual(response.status_code, 302)
+        with client.session_transaction() as session:
+            self.assertNotIn('search', session)
+            self.assertTrue(any(message.startswith('Location') for _, message in session['_flashes']))
+        self.assertEqual(len(search_cache), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
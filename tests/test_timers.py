@@ -0,0 +1,142 @@
+'''Tests for the booking transition timer'''
+
+import threading
+import unittest
+from datetime import datetime, timedelta
+from app import app, db
+from app.models import User, FacilityOwner, Facility, Booking, OutboxMessage
+from app.routes import load_deadlines, fire_transitions
+from app.timers import TransitionTimer
+from app import routes
+
+
+class TransitionTimerTestCase(unittest.TestCase):
+    def setUp(self):
+        app.config.from_object('config.TestConfig')
+        self.app_context = app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        self.user = User(first_name='Test', email='test@example.com')
+        self.owner = FacilityOwner(first_name='Owner', email='owner@example.com')
+        db.session.add_all([self.user, self.owner])
+        db.session.commit()
+        self.facility = Facility(name='Test Facility', owner_id=self.owner.id, completed_bookings=0)
+        db.session.add(self.facility)
+        db.session.commit()
+
+        self.timer = TransitionTimer(load_deadlines, fire_transitions, horizon=3600, refresh=300)
+        self.saved_timer, routes.transition_timer = routes.transition_timer, self.timer
+
+    def tearDown(self):
+        routes.transition_timer = self.saved_timer
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def add_booking(self, status, check_in, check_out):
+        now = datetime.now()
+        booking = Booking(status=status, issued_by=self.user.id, facility_id=self.facility.id,
+                          check_in=now + timedelta(minutes=check_in), check_out=now + timedelta(minutes=check_out))
+        db.session.add(booking)
+        return booking
+
+    def status(self, booking_id):
+        db.session.expire_all()
+        return db.session.get(Booking, booking_id).status
+
+    def test_refill_loads_deadlines_inside_horizon(self):
+        starting = self.add_booking('accepted', 10, 2000)
+        ending = self.add_booking('ongoing', -100, 30)
+        later = self.add_booking('accepted', 120, 200)
+        self.add_booking('completed', -100, 30)
+        db.session.commit()
+
+        self.timer.refill(datetime.now())
+        self.assertEqual(sorted(booking_id for _, booking_id in self.timer._heap),
+                         sorted([starting.id, ending.id]))
+        self.assertNotIn(later.id, [booking_id for _, booking_id in self.timer._heap])
+
+    def test_due_deadlines_fire_transitions(self):
+        starting = self.add_booking('accepted', 10, 2000)
+        ending = self.add_booking('ongoing', -100, 30)
+        overdue = self.add_booking('pending', -100, -10)
+        db.session.commit()
+        ids = starting.id, ending.id, overdue.id
+        now = datetime.now()
+        self.timer.refill(now)
+
+        # Overdue bookings found at startup fire straight away
+        self.assertEqual(self.timer.run_due(now), 1)
+        self.assertEqual([self.status(id) for id in ids], ['accepted', 'ongoing', 'expired'])
+
+        self.assertEqual(self.timer.run_due(now + timedelta(minutes=11)), 1)
+        self.assertEqual([self.status(id) for id in ids], ['ongoing', 'ongoing', 'expired'])
+
+        self.assertEqual(self.timer.run_due(now + timedelta(minutes=31)), 1)
+        self.assertEqual([self.status(id) for id in ids], ['ongoing', 'completed', 'expired'])
+        self.assertEqual(db.session.get(Facility, self.facility.id).completed_bookings, 1)
+        self.assertEqual(OutboxMessage.query.count(), 2)
+
+    def test_committed_bookings_queued_without_refill(self):
+        self.timer.refill(datetime.now())
+        self.assertEqual(len(self.timer), 0)
+
+        booking = self.add_booking('pending', 10, 20)
+        db.session.commit()
+        self.assertEqual(len(self.timer), 1)
+
+        booking.status = 'accepted'
+        db.session.commit()
+        self.assertEqual(sorted(self.timer._heap), [(booking.check_in, booking.id), (booking.check_out, booking.id)])
+
+        self.add_booking('accepted', 10, 20)
+        db.session.rollback()
+        self.assertEqual(len(self.timer), 2)
+
+    def test_cancelled_booking_not_transitioned(self):
+        booking = self.add_booking('accepted', 10, 20)
+        db.session.commit()
+        now = datetime.now()
+        self.timer.refill(now)
+        booking.status = 'cancelled'
+        db.session.commit()
+
+        self.timer.run_due(now + timedelta(minutes=30))
+        self.assertEqual(self.status(booking.id), 'cancelled')
+
+    def test_refill_loads_changes_since_last_refill(self):
+        now = datetime.now()
+        self.timer.refill(now)
+        # Committed by another process, so not pushed to this timer
+        db.session.execute(Booking.__table__.insert().values(
+            status='accepted', issued_by=self.user.id, facility_id=self.facility.id,
+            check_in=now + timedelta(seconds=1), check_out=now + timedelta(minutes=10)))
+        db.session.commit()
+        self.assertEqual(len(self.timer), 0)
+        self.timer.refill(now + timedelta(minutes=5))
+        self.assertEqual(len(self.timer), 2)
+
+
+class TransitionTimerThreadTestCase(unittest.TestCase):
+    def test_fires_at_due_time(self):
+        fired = []
+        done = threading.Event()
+        start = datetime.now()
+
+        def fire(now, booking_ids):
+            fired.append((now, booking_ids))
+            done.set()
+
+        timer = TransitionTimer(lambda start_, end: [(start + timedelta(seconds=0.2), 7)], fire,
+                                horizon=60, refresh=60).start()
+        try:
+            self.assertTrue(done.wait(5))
+        finally:
+            timer.stop()
+        self.assertEqual(fired[0][1], [7])
+        self.assertGreaterEqual(fired[0][0], start + timedelta(seconds=0.2))
+
+
+if __name__ == '__main__':
+    unittest.main()